@@ -0,0 +1,476 @@
+"""Headless batch analysis for whole folders of photos.
+
+Runs as a streaming pipeline of bounded stages:
+
+    scan -> decode -> encode -> submit -> write
+
+Each stage has its own worker threads and hands items on through a bounded
+queue, so a slow stage blocks the ones before it (backpressure) and memory
+stays flat no matter how many images the folder holds.
+
+Usage:
+    python batch_analyzer.py PHOTOS_DIR --provider chatgpt --output results.jsonl
+
+``--pack N`` sends N images per provider request where the provider
+supports it (see request_packing). ``--structured`` asks for short JSON
+analyses instead of free text (see structured_output).
+
+``--metrics metrics.prom`` (or ``metrics.json``) writes per-stage
+histograms and outcome counters when the run finishes; see stage_metrics.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+
+import photo_analysis
+import provider_client
+import providers
+import hedging
+import duplicate_index
+import request_packing
+from large_image import open_image
+from stage_metrics import get_metrics, format_duration
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class BatchItem:
+    """One image travelling through the pipeline"""
+
+    __slots__ = ("path", "width", "height", "format", "upload", "result", "error")
+
+    def __init__(self, path):
+        self.path = path
+        self.width = None
+        self.height = None
+        self.format = None
+        self.upload = None
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        """Outcome for the stats: analyzed, fallback or failed"""
+        if self.error is not None or self.result is None:
+            return "failed"
+        return "fallback" if self.result.is_fallback else "analyzed"
+
+    def to_record(self):
+        if self.result is not None:
+            record = self.result.to_dict()
+        else:
+            record = {"path": self.path, "result": None}
+        record["width"] = self.width
+        record["height"] = self.height
+        record["format"] = self.format
+        record["error"] = self.error
+        return record
+
+
+class PipelineStage:
+    """A pool of worker threads between two bounded queues.
+
+    Items that already carry an error skip the work function and are passed
+    straight on so they still reach the writer. When every worker of the
+    stage has seen the end marker, one end marker per downstream worker is
+    forwarded.
+    """
+
+    def __init__(self, name, func, in_queue, out_queue, workers, downstream_workers):
+        self.name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.workers = workers
+        self.downstream_workers = downstream_workers
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _DONE:
+                break
+            if item.error is None:
+                try:
+                    self.func(item)
+                except Exception as e:
+                    item.error = f"{self.name}: {str(e)}"
+            self.out_queue.put(item)
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            for _ in range(self.downstream_workers):
+                self.out_queue.put(_DONE)
+
+
+class PackingStage(PipelineStage):
+    """A PipelineStage whose work function takes a list of up to pack_size items
+
+    A worker waits at most ``linger`` seconds for its pack to fill, so a
+    slow upstream stage never holds back the items already in hand.
+    """
+
+    def __init__(self, name, func, in_queue, out_queue, workers, downstream_workers, pack_size, linger=0.2):
+        super().__init__(name, func, in_queue, out_queue, workers, downstream_workers)
+        self.pack_size = pack_size
+        self.linger = linger
+
+    def _run(self):
+        done = False
+        while not done:
+            item = self.in_queue.get()
+            if item is _DONE:
+                break
+            pack = [item]
+            linger_until = time.monotonic() + self.linger
+            while len(pack) < self.pack_size:
+                try:
+                    item = self.in_queue.get(timeout=max(0.0, linger_until - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                pack.append(item)
+            ready = [item for item in pack if item.error is None]
+            if ready:
+                try:
+                    self.func(ready)
+                except Exception as e:
+                    for item in ready:
+                        if item.result is None:
+                            item.error = f"{self.name}: {str(e)}"
+            for item in pack:
+                self.out_queue.put(item)
+        self._finish()
+
+
+def scan_images(root_dir):
+    """Yield image paths under root_dir without listing the whole tree up front"""
+    stack = [root_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and photo_analysis.is_image_file(entry.name):
+                        yield entry.path
+        except OSError:
+            continue
+
+
+def decode_stage(item):
+    """Read the image header (no full raster decode) to validate the file"""
+    with open_image(item.path) as img:
+        item.width, item.height = img.size
+        item.format = img.format
+
+
+def make_encode_stage(provider):
+    """Downsample and re-encode for upload; the offline fallback reads the file itself"""
+    backend = providers.get_provider(provider)
+
+    def encode_stage(item):
+        if backend is not None:
+            item.upload = backend.prepare(item.path)
+    return encode_stage
+
+
+def make_submit_stage(provider, api_key, use_cache=True, dedupe_distance=None, hedge_settings=None,
+                      api_keys=None):
+    """Send the image to the provider and release its bytes afterwards"""
+    settings = hedge_settings or hedging.HedgeSettings(deadline=None)
+    api_keys = dict(api_keys or {}, **{provider: api_key})
+
+    def submit_stage(item):
+        # Picked per image: a backup whose breaker opened mid-run is skipped
+        hedge_name = settings.hedge_provider_for(provider, api_keys)
+        hedge = (hedge_name, api_keys.get(hedge_name, "")) if hedge_name else None
+        try:
+            item.result = photo_analysis.analyze_image(item.path, provider, api_key, item.upload,
+                                                       use_cache=use_cache,
+                                                       dedupe_distance=dedupe_distance,
+                                                       deadline=settings.deadline, hedge=hedge,
+                                                       hedge_percentile=settings.percentile)
+        finally:
+            if item.upload is not None:
+                item.upload.close()
+                item.upload = None
+    return submit_stage
+
+
+def make_packed_submit_stage(provider, api_key, use_cache=True, dedupe_distance=None, hedge_settings=None,
+                             pack_size=request_packing.DEFAULT_PACK_SIZE,
+                             max_input_tokens=request_packing.DEFAULT_MAX_INPUT_TOKENS):
+    """Send a list of items in as few requests as the token limits allow (no hedging)"""
+    settings = hedge_settings or hedging.HedgeSettings(deadline=None)
+    backend = providers.get_provider(provider)
+
+    def submit_stage(items):
+        try:
+            sizes = [(item.upload.width, item.upload.height) for item in items]
+            for pack in request_packing.split_by_budget(sizes, pack_size, max_input_tokens, backend.output_tokens):
+                packed = [items[index] for index in pack]
+                results = photo_analysis.analyze_images_packed(
+                    [item.path for item in packed], provider, api_key, [item.upload for item in packed],
+                    use_cache=use_cache, dedupe_distance=dedupe_distance, deadline=settings.deadline)
+                for item, result in zip(packed, results):
+                    item.result = result
+        finally:
+            for item in items:
+                if item.upload is not None:
+                    item.upload.close()
+                    item.upload = None
+    return submit_stage
+
+
+def process_item(item, encode_stage, submit_stage):
+    """Run one item through decode, encode and submit on the calling thread"""
+    for name, stage in (("decode", decode_stage), ("encode", encode_stage), ("submit", submit_stage)):
+        try:
+            stage(item)
+        except Exception as e:
+            item.error = f"{name}: {str(e)}"
+            break
+    if item.upload is not None:
+        item.upload.close()
+        item.upload = None
+    return item
+
+
+class BatchRunner:
+    """Wires the stages together and writes one JSON line per image"""
+
+    def __init__(self, provider, api_key, output, decode_workers=2, encode_workers=2,
+                 submit_workers=4, queue_size=16, progress=True, use_cache=True,
+                 dedupe_distance=duplicate_index.DEFAULT_MAX_DISTANCE, hedge_settings=None, api_keys=None,
+                 pack_size=1, max_input_tokens=request_packing.DEFAULT_MAX_INPUT_TOKENS):
+        self.provider = provider
+        self.api_key = api_key
+        self.output = output
+        self.decode_workers = decode_workers
+        self.encode_workers = encode_workers
+        self.submit_workers = submit_workers
+        self.queue_size = queue_size
+        self.progress = progress
+        self.use_cache = use_cache
+        self.dedupe_distance = dedupe_distance
+        self.hedge_settings = hedge_settings
+        self.api_keys = api_keys
+        # Images per provider request; 1 sends each image on its own
+        self.pack_size = pack_size
+        self.max_input_tokens = max_input_tokens
+        self.stats = {"images": 0, "analyzed": 0, "cached": 0, "duplicates": 0, "hedged": 0,
+                      "fallback": 0, "failed": 0}
+
+    def run(self, root_dir):
+        started = time.perf_counter()
+        decode_q = queue.Queue(self.queue_size)
+        encode_q = queue.Queue(self.queue_size)
+        submit_q = queue.Queue(self.queue_size)
+        write_q = queue.Queue(self.queue_size)
+
+        stages = [
+            PipelineStage("decode", decode_stage, decode_q, encode_q,
+                          self.decode_workers, self.encode_workers),
+            PipelineStage("encode", make_encode_stage(self.provider), encode_q, submit_q,
+                          self.encode_workers, self.submit_workers),
+            self._submit_stage(submit_q, write_q),
+        ]
+        for stage in stages:
+            stage.start()
+
+        writer = threading.Thread(target=self._write, args=(write_q,), name="write", daemon=True)
+        writer.start()
+
+        # Scan on the calling thread; put() blocks while the pipeline is full
+        for path in scan_images(root_dir):
+            decode_q.put(BatchItem(path))
+        for _ in range(self.decode_workers):
+            decode_q.put(_DONE)
+
+        writer.join()
+        self.stats["seconds"] = round(time.perf_counter() - started, 3)
+        backend = providers.get_provider(self.provider)
+        if backend is not None:
+            retry_stats = backend.retry_policy.stats
+            self.stats["retries"] = retry_stats["retries"]
+            self.stats["rate_limited"] = retry_stats["rate_limited"]
+            self.stats["throttled_seconds"] = round(retry_stats["throttled_seconds"], 3)
+        analyzed = self.stats["analyzed"]
+        self.stats["dedup_ratio"] = round(self.stats["duplicates"] / analyzed, 4) if analyzed else 0.0
+        return self.stats
+
+    def _submit_stage(self, submit_q, write_q):
+        backend = providers.get_provider(self.provider)
+        if self.pack_size > 1 and backend is not None and backend.supports_packing:
+            return PackingStage("submit", make_packed_submit_stage(self.provider, self.api_key, self.use_cache,
+                                                                   self.dedupe_distance, self.hedge_settings,
+                                                                   self.pack_size, self.max_input_tokens),
+                                submit_q, write_q, self.submit_workers, 1, self.pack_size)
+        return PipelineStage("submit", make_submit_stage(self.provider, self.api_key, self.use_cache,
+                                                         self.dedupe_distance, self.hedge_settings,
+                                                         self.api_keys), submit_q, write_q,
+                             self.submit_workers, 1)
+
+    def _write(self, write_q):
+        with open(self.output, "a", encoding="utf-8") as out:
+            while True:
+                item = write_q.get()
+                if item is _DONE:
+                    break
+                self._count(item)
+                out.write(json.dumps(item.to_record(), ensure_ascii=False) + "\n")
+                out.flush()
+                if self.progress:
+                    status = "❌" if item.error else "✅"
+                    print(f"{status} [{self.stats['images']}] {item.path}", file=sys.stderr)
+
+    def _count(self, item):
+        self.stats["images"] += 1
+        if item.error is not None or item.result is None:
+            self.stats["failed"] += 1
+        elif item.result.is_fallback:
+            self.stats["fallback"] += 1
+        else:
+            self.stats["analyzed"] += 1
+            if item.result.hedged:
+                self.stats["hedged"] += 1
+            if item.result.cache_source == "duplicate":
+                self.stats["duplicates"] += 1
+            elif item.result.cache_source:
+                self.stats["cached"] += 1
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Analyze every image in a folder without the GUI")
+    parser.add_argument("folder", help="Folder to scan (recursively) for images")
+    parser.add_argument("--provider", default="chatgpt",
+                        choices=providers.provider_names() + ["fallback"])
+    parser.add_argument("--api-key", default=None, help="Overrides the key from .env")
+    parser.add_argument("--output", default="analysis_results.jsonl",
+                        help="JSON Lines file results are appended to")
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--encode-workers", type=int, default=2)
+    parser.add_argument("--submit-workers", type=int, default=4,
+                        help="Concurrent provider requests")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="Items buffered between stages before upstream blocks")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Provider requests per second shared by all submit workers "
+                             "(default: <PREFIX>_RATE_LIMIT from .env, else unlimited)")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds each image's analysis may take, retries included "
+                             "(default: ANALYSIS_DEADLINE from .env, 0 = none)")
+    parser.add_argument("--hedge-provider", action="append", default=None,
+                        help="Backup provider raced against a slow primary; repeat for a preference "
+                             "order (default: HEDGE_PROVIDERS from .env)")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Primary latency percentile after which the backup is sent (default 90)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the provider, ignoring cached results")
+    parser.add_argument("--dedupe-distance", type=int, default=duplicate_index.DEFAULT_MAX_DISTANCE,
+                        help="Reuse the analysis of images whose perceptual hash differs by at "
+                             "most this many bits (-1 disables)")
+    parser.add_argument("--pack", type=int, default=1,
+                        help="Images sent per provider request (chat completions providers only; "
+                             "1 = one request per image)")
+    parser.add_argument("--pack-tokens", type=int, default=request_packing.DEFAULT_MAX_INPUT_TOKENS,
+                        help="Input token budget of a packed request; packs are split to stay under it")
+    parser.add_argument("--structured", action="store_true",
+                        help="Ask for short JSON analyses (default: STRUCTURED_OUTPUT from .env); "
+                             "records get an \"analysis\" field")
+    parser.add_argument("--metrics", default=None,
+                        help="Write stage timings and counters here: Prometheus text, or JSON for *.json")
+    parser.add_argument("--quiet", action="store_true", help="No per-image progress lines")
+    return parser
+
+
+def main(argv=None):
+    # Load .env first: it may register extra providers for --provider
+    keys = photo_analysis.load_environment()
+    args = build_arg_parser().parse_args(argv)
+    if not os.path.isdir(args.folder):
+        print(f"Error: folder not found: {args.folder}", file=sys.stderr)
+        return 2
+
+    api_key = args.api_key if args.api_key is not None else keys.get(args.provider, "")
+
+    hedge_settings = hedging.settings_from_env()
+    if args.deadline is not None:
+        hedge_settings.deadline = args.deadline or None
+    if args.hedge_provider is not None:
+        hedge_settings.hedge_providers = args.hedge_provider
+    if args.hedge_percentile is not None:
+        hedge_settings.percentile = args.hedge_percentile / 100
+
+    # One pooled connection per concurrent request, plus room for the
+    # cancelled legs of hedged requests that are still draining
+    pool_size = max(1, args.submit_workers) * (2 if hedge_settings.hedge_providers else 1)
+    provider_client.configure_client(pool_maxsize=pool_size)
+    backend = providers.get_provider(args.provider)
+    if backend is not None and args.rate_limit is not None:
+        backend.set_rate_limit(args.rate_limit)
+    if args.structured:
+        for other in providers.all_providers():
+            other.structured = True
+
+    runner = BatchRunner(args.provider, api_key, args.output,
+                         decode_workers=max(1, args.decode_workers),
+                         encode_workers=max(1, args.encode_workers),
+                         submit_workers=max(1, args.submit_workers),
+                         queue_size=max(1, args.queue_size),
+                         progress=not args.quiet,
+                         use_cache=not args.no_cache,
+                         dedupe_distance=args.dedupe_distance if args.dedupe_distance >= 0 else None,
+                         hedge_settings=hedge_settings,
+                         api_keys=keys,
+                         pack_size=max(1, args.pack),
+                         max_input_tokens=max(1, args.pack_tokens))
+    if args.pack > 1 and (backend is None or not backend.supports_packing):
+        print(f"Warning: {args.provider} can't take several images per request; sending one at a time",
+              file=sys.stderr)
+    stats = runner.run(args.folder)
+    rate = stats["images"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"📊 {stats['images']} images in {stats['seconds']:.1f}s ({rate:.2f}/s) - "
+          f"{stats['analyzed']} analyzed ({stats['cached']} cached, {stats['duplicates']} near-duplicates), "
+          f"{stats['fallback']} fallback, {stats['failed']} failed - dedup ratio {stats['dedup_ratio']:.1%}")
+    if "retries" in stats:
+        print(f"🔁 {stats['retries']} retries ({stats['rate_limited']} rate-limited responses), "
+              f"{stats['throttled_seconds']:.1f}s throttled by the rate limiter, {stats['hedged']} hedged")
+
+    metrics = get_metrics()
+    stage_means = metrics.stage_summary()
+    if stage_means:
+        print("⏱️ Mean per stage: " + " · ".join(f"{stage} {format_duration(mean)}"
+                                                 for stage, (_, mean) in stage_means.items()))
+    if args.metrics:
+        if "retries" in stats:
+            metrics.inc("provider_retries_total", stats["retries"], provider=args.provider)
+            metrics.inc("provider_rate_limited_total", stats["rate_limited"], provider=args.provider)
+            metrics.inc("provider_throttled_seconds_total", stats["throttled_seconds"], provider=args.provider)
+        metrics.write(args.metrics)
+        print(f"💾 Metrics written to {args.metrics}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
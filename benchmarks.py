@@ -0,0 +1,333 @@
+"""Reproducible benchmarks for the hot paths.
+
+A deterministic corpus of synthetic photos (several sizes, JPEG/PNG/WebP/
+TIFF, gradients plus noise so encoders have real work) is generated once
+into the app data directory. Each benchmark then runs a few warm-up
+iterations followed by timed ones, and reports p50/p95/p99 latency,
+throughput and peak memory. Memory is measured in a separate pass, run in
+a forked child process where the platform has fork: its peak RSS is that
+benchmark's own (a process's peak only ever grows), and a further pass
+under tracemalloc gives the Python-heap peak. Pillow's pixel buffers are
+allocated in C and only show up in the RSS figures.
+
+Benchmarks:
+  preview_decode   image_preview.decode_preview (the GUI's load_image)
+  sample_render    drawing the startup sample art from scratch
+  fallback         photo_analysis.analyze_image_fallback
+  payload          prepare_upload + streaming the chat completions body
+  end_to_end       analyze_image against an in-process mock provider
+
+Usage:
+    python benchmarks.py --output bench.json
+    python benchmarks.py --only preview_decode,payload --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import tracemalloc
+
+import PIL
+from PIL import Image, ImageDraw
+
+import photo_analysis
+import providers
+import image_preview
+import sample_art
+from image_encoding import prepare_upload, UPLOAD_LIMITS
+from payload_stream import build_json_body
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CORPUS_VERSION = 1
+
+# (width, height, format) of the synthetic photos
+CORPUS_SPECS = [
+    (640, 480, "JPEG"),
+    (1920, 1080, "JPEG"),
+    (4000, 3000, "JPEG"),
+    (6000, 4000, "JPEG"),
+    (1920, 1080, "PNG"),
+    (1920, 1080, "WEBP"),
+    (2048, 1536, "TIFF"),
+]
+QUICK_SPECS = CORPUS_SPECS[:2] + CORPUS_SPECS[4:6]
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "TIFF": ".tif"}
+
+
+def synthetic_photo(width, height, seed):
+    """Gradient sky, a few shapes and sensor-like noise; the same seed gives the same pixels"""
+    sky = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 24 + seed % 16)
+    red = Image.blend(sky, noise, 0.25)
+    green = Image.blend(sky.transpose(Image.Transpose.FLIP_TOP_BOTTOM), noise, 0.2)
+    blue = Image.blend(Image.radial_gradient("L").resize((width, height)), noise, 0.3)
+    image = Image.merge("RGB", (red, green, blue))
+    draw = ImageDraw.Draw(image)
+    for i in range(6):
+        x = (seed * 97 + i * 211) % width
+        y = (seed * 53 + i * 157) % height
+        size = max(width, height) // (6 + i)
+        draw.ellipse([x, y, x + size, y + size // 2], fill=((i * 40) % 256, 120, 255 - i * 30))
+    return image
+
+
+def build_corpus(specs=CORPUS_SPECS, directory=None):
+    """Paths of the corpus images, generating any that are missing"""
+    directory = directory or os.path.join(photo_analysis.app_data_dir(), f"bench_corpus_v{CORPUS_VERSION}")
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed, (width, height, format_name) in enumerate(specs):
+        path = os.path.join(directory, f"synthetic_{width}x{height}{EXTENSIONS[format_name]}")
+        if not os.path.exists(path):
+            options = {"quality": 90} if format_name in ("JPEG", "WEBP") else {}
+            synthetic_photo(width, height, seed).save(path, format_name, **options)
+        paths.append(path)
+    return paths
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def max_rss_mb():
+    """Process peak resident set size in MB, where the platform reports it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _memory_pass(func, inputs):
+    """{max_rss_mb, rss_growth_mb, peak_traced_mb} of one pass over inputs"""
+    before = max_rss_mb()
+    for item in inputs:
+        func(item)
+    after = max_rss_mb()
+    # Python objects only: Pillow's C buffers are not traced
+    tracemalloc.start()
+    for item in inputs:
+        func(item)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "max_rss_mb": round(after, 1) if after is not None else None,
+        "rss_growth_mb": round(after - before, 1) if after is not None else None,
+        "peak_traced_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def measure_memory(func, inputs):
+    """_memory_pass in a forked child, so earlier benchmarks don't raise its peak RSS
+
+    Without fork (Windows) the pass runs in this process; rss_growth_mb
+    then only counts memory beyond the process's earlier peak.
+    """
+    if not hasattr(os, "fork"):
+        return _memory_pass(func, inputs)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # The child starts with its peak RSS at its current size
+        os.close(read_fd)
+        status = 0
+        try:
+            report = _memory_pass(func, inputs)
+        except BaseException as e:
+            report = {"error": f"{type(e).__name__}: {e}"}
+            status = 1
+        with os.fdopen(write_fd, "w") as pipe:
+            json.dump(report, pipe)
+        os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    report = json.loads(data or "{}")
+    if "error" in report:
+        raise RuntimeError(f"memory pass failed: {report['error']}")
+    return report
+
+
+class Benchmark:
+    """A named operation run over a list of inputs"""
+
+    def __init__(self, name, func, inputs, setup=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.setup = setup
+
+    def run(self, iterations=10, warmup=2):
+        if self.setup is not None:
+            self.setup()
+        for _ in range(warmup):
+            for item in self.inputs:
+                self.func(item)
+
+        samples = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for item in self.inputs:
+                t0 = time.perf_counter()
+                self.func(item)
+                samples.append((time.perf_counter() - t0) * 1000)
+        total = time.perf_counter() - started
+
+        memory = measure_memory(self.func, self.inputs)
+
+        ordered = sorted(samples)
+        return {
+            "runs": len(samples),
+            "p50_ms": round(percentile(ordered, 0.50), 3),
+            "p95_ms": round(percentile(ordered, 0.95), 3),
+            "p99_ms": round(percentile(ordered, 0.99), 3),
+            "mean_ms": round(sum(samples) / len(samples), 3),
+            "throughput_per_s": round(len(samples) / total, 2) if total else None,
+            # Python heap only (tracemalloc)
+            "peak_traced_mb": memory["peak_traced_mb"],
+            "max_rss_mb": memory["max_rss_mb"],
+            "rss_growth_mb": memory["rss_growth_mb"],
+        }
+
+
+def _payload(path):
+    upload = prepare_upload(path, UPLOAD_LIMITS["chatgpt"])
+    try:
+        body = build_json_body(providers.get_provider("chatgpt").build_payload(upload.mime), upload.data)
+        # Drain the body the way requests would send it
+        for _ in body:
+            pass
+    finally:
+        upload.close()
+
+
+class MockBackend:
+    """In-process mock provider registered as "bench-mock" for end-to-end runs"""
+
+    def __init__(self, latency_ms=0):
+        import mock_provider_server
+        options = mock_provider_server.build_arg_parser().parse_args(
+            ["--port", "0", "--quiet", "--latency", str(latency_ms)])
+        self.server = mock_provider_server.make_server(options)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        providers.register_provider(providers.LocalOpenAIProvider(
+            "bench-mock", "Benchmark mock", f"http://{host}:{port}/v1", "mock-vision", None,
+            upload_limits=UPLOAD_LIMITS["chatgpt"]))
+
+    def analyze(self, path):
+        result = photo_analysis.analyze_image(path, "bench-mock", "", use_cache=False, dedupe_distance=None,
+                                              store_result=False)
+        if result.is_fallback:
+            raise RuntimeError(f"mock analysis failed: {result.error_summary}")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def build_benchmarks(paths, mock=None):
+    benchmarks = [
+        Benchmark("preview_decode", image_preview.decode_preview, paths),
+        Benchmark("sample_render", lambda size: sample_art.draw_sample_image(*size), [(600, 550)]),
+        Benchmark("fallback", photo_analysis.analyze_image_fallback, paths),
+        Benchmark("payload", _payload, paths),
+    ]
+    if mock is not None:
+        benchmarks.append(Benchmark("end_to_end", mock.analyze, paths))
+    return benchmarks
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    """Lines showing the change against a saved run"""
+    lines = []
+    for name, current in results["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            lines.append(f"  {name:<15} (new)")
+            continue
+        parts = []
+        for metric in ("p50_ms", "p95_ms", "rss_growth_mb", "peak_traced_mb"):
+            if before.get(metric) and current.get(metric) is not None:
+                change = (current[metric] - before[metric]) / before[metric]
+                parts.append(f"{metric} {before[metric]:.1f} -> {current[metric]:.1f} ({change:+.0%})")
+        lines.append(f"  {name:<15} " + ", ".join(parts))
+    return lines
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the decode, encode, analyze and render paths")
+    parser.add_argument("--output", default=None, help="Save results as JSON")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare against")
+    parser.add_argument("--only", default=None, help="Comma-separated benchmark names")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed passes over the corpus")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed passes first")
+    parser.add_argument("--quick", action="store_true", help="Small corpus and 3 iterations, for smoke runs")
+    parser.add_argument("--mock-latency", type=float, default=0,
+                        help="Latency in ms added by the mock provider in end_to_end")
+    parser.add_argument("--label", default=None, help="Free-form label stored with the results")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    photo_analysis.load_environment()
+    if args.quick:
+        args.iterations = min(args.iterations, 3)
+        args.warmup = min(args.warmup, 1)
+    paths = build_corpus(QUICK_SPECS if args.quick else CORPUS_SPECS)
+    only = set(args.only.split(",")) if args.only else None
+
+    mock = MockBackend(args.mock_latency) if only is None or "end_to_end" in only else None
+    results = {"label": args.label, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "environment": environment_info(), "iterations": args.iterations,
+               "corpus": [os.path.basename(p) for p in paths], "results": {}}
+    try:
+        for benchmark in build_benchmarks(paths, mock):
+            if only is not None and benchmark.name not in only:
+                continue
+            stats = benchmark.run(args.iterations, args.warmup)
+            results["results"][benchmark.name] = stats
+            print(f"{benchmark.name:<15} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+                  f"p99 {stats['p99_ms']:>9.2f} ms  {stats['throughput_per_s']:>8.1f}/s  "
+                  f"rss +{stats['rss_growth_mb'] or 0:>6.1f} MB  py-heap {stats['peak_traced_mb']:>6.1f} MB")
+    finally:
+        if mock is not None:
+            mock.close()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline.get('label') or args.compare}:")
+        print("\n".join(compare(results, baseline)))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
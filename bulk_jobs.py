@@ -0,0 +1,407 @@
+"""Bulk analysis through an OpenAI-style Batch API for large offline runs.
+
+Overnight archive runs don't need interactive latency, so instead of one
+chat completion per image this packs the requests into JSONL job files,
+uploads them, creates batches and polls until they finish. Batch requests
+are billed at a discount and don't count against the interactive rate
+limits.
+
+Everything about a job lives in its job directory: the JSONL input files
+and ``manifest.json``, which records every image (by custom_id), the file
+and batch it went out in and its outcome. The manifest is rewritten after
+each step, so re-running the same command resumes: finished images are
+skipped, submitted batches are polled again, and images whose request
+failed or was never processed (an expired batch) are resubmitted, up to
+``--max-attempts`` times.
+
+Results are appended to the output JSONL in the batch analyzer's record
+format and stored in the result cache.
+
+Usage:
+    python bulk_jobs.py PHOTOS_DIR --job-dir jobs/archive --output results.jsonl
+    python bulk_jobs.py PHOTOS_DIR --job-dir jobs/archive --no-wait   # submit and exit
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import photo_analysis
+import providers
+import result_cache
+from batch_analyzer import scan_images
+from payload_stream import build_json_body
+from provider_client import get_client
+from provider_retry import ProviderError, classify_response, classify_exception
+
+MANIFEST_FILENAME = "manifest.json"
+
+# OpenAI accepts up to 50,000 requests and 200 MB per batch input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_FILE_BYTES = 190 * 1024 * 1024
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchAPI:
+    """Files and batches endpoints next to a provider's chat completions"""
+
+    def __init__(self, provider, api_key):
+        self.provider = provider
+        self.base_url = provider.base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _call(self, method, path, **kwargs):
+        def attempt():
+            response = get_client().request(method, self.base_url + path, headers=self.headers, **kwargs)
+            if response.status_code != 200:
+                raise classify_response(response, self.provider.short_name)
+            return response
+        return self.provider.retry_policy.call(attempt, self.provider.limiter, label=self.provider.short_name)
+
+    def upload_file(self, path):
+        with open(path, "rb") as f:
+            response = self._call("POST", "/files", data={"purpose": "batch"},
+                                  files={"file": (os.path.basename(path), f, "application/jsonl")},
+                                  timeout=(10, 600))
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id):
+        return self._call("POST", "/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        }).json()
+
+    def get_batch(self, batch_id):
+        return self._call("GET", f"/batches/{batch_id}").json()
+
+    def file_lines(self, file_id):
+        """Parsed JSON lines of a result file"""
+        response = self._call("GET", f"/files/{file_id}/content", stream=True, timeout=(10, 600))
+        with response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class BulkJob:
+    """A resumable bulk run backed by a job directory"""
+
+    def __init__(self, job_dir, provider_name, api_key, use_cache=True, progress=True):
+        self.job_dir = job_dir
+        self.provider = providers.get_provider(provider_name)
+        self.api = BatchAPI(self.provider, api_key)
+        self.use_cache = use_cache
+        self.progress = progress
+        self.cache = result_cache.get_cache()
+        os.makedirs(job_dir, exist_ok=True)
+        self.manifest_path = os.path.join(job_dir, MANIFEST_FILENAME)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"provider": provider_name, "model": self.provider.model,
+                             "items": {}, "files": {}}
+        self._paths = {item["path"] for item in self.manifest["items"].values()}
+        self.stats = {"images": 0, "cached": 0, "analyzed": 0, "failed": 0, "batches": 0}
+
+    def log(self, message):
+        if self.progress:
+            print(message, file=sys.stderr)
+
+    def save(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _key(self, item):
+        return result_cache.cache_key(item["hash"], self.manifest["provider"],
+                                      self.provider.prompt, self.manifest["model"])
+
+    def add_images(self, paths):
+        """Register new images; known paths are left as they are"""
+        items = self.manifest["items"]
+        for path in paths:
+            if path in self._paths:
+                continue
+            try:
+                image_hash = result_cache.hash_file(path)
+            except OSError as e:
+                self.log(f"❌ {path}: {e}")
+                continue
+            custom_id = f"img-{len(items):06d}"
+            items[custom_id] = {"path": path, "hash": image_hash, "status": "pending", "attempts": 0,
+                                "file": None, "error": None}
+            self._paths.add(path)
+        self.save()
+
+    def _write_record(self, out, custom_id, item, text, cache_source=None, batch_id=None):
+        result = photo_analysis.AnalysisResult(item["path"], self.manifest["provider"], text,
+                                               cache_source=cache_source)
+        photo_analysis.index_result(result)
+        record = result.to_dict()
+        record["custom_id"] = custom_id
+        record["batch_id"] = batch_id
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def serve_cached(self, out):
+        """Finish pending images whose analysis is already in the result cache"""
+        if not self.use_cache:
+            return
+        for custom_id, item in self.manifest["items"].items():
+            if item["status"] != "pending":
+                continue
+            hit = self.cache.lookup(self._key(item))
+            if hit is not None:
+                self._write_record(out, custom_id, item, hit[0], cache_source=hit[1])
+                item["status"] = "done"
+                self.stats["cached"] += 1
+        out.flush()
+        self.save()
+
+    def build_files(self, max_requests=MAX_REQUESTS_PER_FILE, max_bytes=MAX_FILE_BYTES):
+        """Write pending images into new JSONL input files"""
+        pending = [(custom_id, item) for custom_id, item in self.manifest["items"].items()
+                   if item["status"] == "pending"]
+        current = None
+        for custom_id, item in pending:
+            if current is None or current["count"] >= max_requests or current["size"] >= max_bytes:
+                if current is not None:
+                    current["handle"].close()
+                name = f"input-{len(self.manifest['files']):04d}.jsonl"
+                current = {"name": name, "count": 0, "size": 0,
+                           "handle": open(os.path.join(self.job_dir, name), "wb")}
+                self.manifest["files"][name] = {"batch_id": None, "input_file_id": None,
+                                                "status": "building", "collected": False, "collecting": False}
+            try:
+                upload = self.provider.prepare(item["path"])
+            except Exception as e:
+                item["status"] = "failed"
+                item["error"] = {"kind": "bad_request", "message": f"Error: {str(e)}"}
+                continue
+            try:
+                # Streamed like a direct request: the image is base64-encoded slice by slice
+                line = build_json_body({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                                        "body": self.provider.build_payload(upload.mime)}, upload.data)
+                for chunk in line:
+                    current["handle"].write(chunk)
+                current["handle"].write(b"\n")
+                current["size"] += len(line) + 1
+            finally:
+                upload.close()
+            current["count"] += 1
+            item["status"] = "queued"
+            item["file"] = current["name"]
+        if current is not None:
+            current["handle"].close()
+        used = {item["file"] for item in self.manifest["items"].values()}
+        for name, info in list(self.manifest["files"].items()):
+            if info["status"] != "building":
+                continue
+            if name in used:
+                info["status"] = "built"
+            else:
+                # Every image in it failed to encode
+                del self.manifest["files"][name]
+                os.remove(os.path.join(self.job_dir, name))
+        self.save()
+
+    def submit(self):
+        """Upload built files and create their batches"""
+        for name, info in self.manifest["files"].items():
+            if info["batch_id"] is not None or info["status"] != "built":
+                continue
+            if info["input_file_id"] is None:
+                info["input_file_id"] = self.api.upload_file(os.path.join(self.job_dir, name))
+                self.save()
+            batch = self.api.create_batch(info["input_file_id"])
+            info["batch_id"] = batch["id"]
+            info["status"] = batch.get("status", "validating")
+            for item in self.manifest["items"].values():
+                if item["file"] == name and item["status"] == "queued":
+                    item["status"] = "submitted"
+                    item["attempts"] += 1
+            self.stats["batches"] += 1
+            self.save()
+            self.log(f"📤 {name} submitted as batch {batch['id']}")
+
+    def poll(self, interval=30.0, wait=True):
+        """Refresh batch statuses; with wait, until every batch has finished"""
+        while True:
+            running = 0
+            for name, info in self.manifest["files"].items():
+                if info["batch_id"] is None or info["status"] in TERMINAL_STATUSES:
+                    continue
+                batch = self.api.get_batch(info["batch_id"])
+                info["status"] = batch.get("status", info["status"])
+                info["output_file_id"] = batch.get("output_file_id")
+                info["error_file_id"] = batch.get("error_file_id")
+                counts = batch.get("request_counts") or {}
+                self.log(f"⏳ {info['batch_id']}: {info['status']} "
+                         f"({counts.get('completed', 0)}/{counts.get('total', '?')} done, "
+                         f"{counts.get('failed', 0)} failed)")
+                if info["status"] not in TERMINAL_STATUSES:
+                    running += 1
+            self.save()
+            if not running or not wait:
+                return running
+            time.sleep(interval)
+
+    def collect(self, out, max_attempts=3):
+        """Stitch finished batches' results back to their images"""
+        items = self.manifest["items"]
+        for name, info in self.manifest["files"].items():
+            if info["status"] not in TERMINAL_STATUSES or info["collected"]:
+                continue
+            if info.get("collecting"):
+                # An earlier collect of this batch was interrupted after writing some records
+                self._recover_written(out, info["batch_id"])
+            else:
+                info["collecting"] = True
+                self.save()
+            for file_key in ("output_file_id", "error_file_id"):
+                if not info.get(file_key):
+                    continue
+                for line in self.api.file_lines(info[file_key]):
+                    self._collect_line(out, line, info["batch_id"])
+            out.flush()
+            # Anything the batch never processed (expired, cancelled) goes around again
+            for item in items.values():
+                if item["file"] == name and item["status"] == "submitted":
+                    item["status"] = "failed"
+                    item["error"] = {"kind": "server", "message": f"Batch {info['status']} before processing"}
+            info["collected"] = True
+            info["collecting"] = False
+            self.save()
+
+        for item in items.values():
+            if item["status"] == "failed" and item["attempts"] < max_attempts and item["error"] \
+                    and item["error"].get("kind") != "bad_request":
+                item["status"] = "pending"
+                item["file"] = None
+        self.save()
+
+    def _recover_written(self, out, batch_id):
+        """Mark items whose records for batch_id are already in the output as done"""
+        out.flush()
+        items = self.manifest["items"]
+        try:
+            with open(out.name, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not isinstance(record, dict) or record.get("batch_id") != batch_id:
+                        continue
+                    item = items.get(record.get("custom_id"))
+                    if item is not None and item["path"] == record.get("path"):
+                        item["status"] = "done"
+                        item["error"] = None
+        except OSError:
+            pass
+
+    def _collect_line(self, out, line, batch_id):
+        custom_id = line.get("custom_id")
+        item = self.manifest["items"].get(custom_id)
+        if item is None or item["status"] == "done":
+            return
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200:
+            try:
+                text = self.provider.parse_response(body)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                item["status"] = "failed"
+                item["error"] = {"kind": "bad_response", "message": f"Error: unexpected response ({e})"}
+                return
+            self.cache.store(self._key(item), text, self.manifest["provider"], self.manifest["model"])
+            self._write_record(out, custom_id, item, text, batch_id=batch_id)
+            item["status"] = "done"
+            item["error"] = None
+            self.stats["analyzed"] += 1
+        else:
+            error = line.get("error") or body.get("error") or {}
+            status = response.get("status_code")
+            kind = "bad_request" if status is not None and 400 <= status < 500 and status != 429 else "server"
+            item["status"] = "failed"
+            item["error"] = {"kind": kind, "status": status,
+                             "message": error.get("message") if isinstance(error, dict) else str(error)}
+
+    def run(self, paths, output, poll_interval=30.0, wait=True, max_requests=MAX_REQUESTS_PER_FILE,
+            max_attempts=3):
+        self.add_images(paths)
+        with open(output, "a", encoding="utf-8") as out:
+            self.serve_cached(out)
+            while True:
+                self.build_files(max_requests)
+                self.submit()
+                self.poll(poll_interval, wait)
+                self.collect(out, max_attempts)
+                if not wait or not any(item["status"] == "pending" for item in self.manifest["items"].values()):
+                    break
+        self.stats["images"] = len(self.manifest["items"])
+        self.stats["failed"] = sum(1 for item in self.manifest["items"].values() if item["status"] == "failed")
+        self.stats["remaining"] = sum(1 for item in self.manifest["items"].values()
+                                      if item["status"] not in ("done", "failed"))
+        return self.stats
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Analyze a folder through the provider's Batch API")
+    parser.add_argument("folder", help="Folder to scan (recursively) for images")
+    parser.add_argument("--job-dir", required=True,
+                        help="Directory for the job files and manifest; reuse it to resume")
+    parser.add_argument("--provider", default="chatgpt")
+    parser.add_argument("--api-key", default=None, help="Overrides the key from .env")
+    parser.add_argument("--output", default="analysis_results.jsonl",
+                        help="JSON Lines file results are appended to")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between status checks")
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS_PER_FILE,
+                        help="Requests per batch input file")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Times an image is submitted before it is left as failed")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="Submit (and collect anything already finished), then exit")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Submit every image, even ones with a cached analysis")
+    parser.add_argument("--quiet", action="store_true", help="No progress lines")
+    return parser
+
+
+def main(argv=None):
+    import requests
+    keys = photo_analysis.load_environment()
+    args = build_arg_parser().parse_args(argv)
+    if not os.path.isdir(args.folder):
+        print(f"Error: folder not found: {args.folder}", file=sys.stderr)
+        return 2
+    backend = providers.get_provider(args.provider)
+    if not isinstance(backend, providers.OpenAIChatProvider):
+        print(f"Error: {args.provider} has no Batch API; use an OpenAI-compatible provider", file=sys.stderr)
+        return 2
+
+    api_key = args.api_key if args.api_key is not None else keys.get(args.provider, "")
+    job = BulkJob(args.job_dir, args.provider, api_key, use_cache=not args.no_cache, progress=not args.quiet)
+    if job.manifest["provider"] != args.provider:
+        print(f"Error: {args.job_dir} belongs to a {job.manifest['provider']} job", file=sys.stderr)
+        return 2
+    try:
+        stats = job.run(sorted(scan_images(args.folder)), args.output, args.poll_interval,
+                        wait=not args.no_wait, max_requests=max(1, args.max_requests),
+                        max_attempts=max(1, args.max_attempts))
+    except (ProviderError, requests.RequestException) as e:
+        # A dropped connection while downloading results, say
+        error = classify_exception(e)
+        print(f"❌ {error.message} - run the same command again to resume", file=sys.stderr)
+        return 1
+    print(f"📦 {stats['images']} images: {stats['analyzed']} analyzed in this run, {stats['cached']} from cache, "
+          f"{stats['failed']} failed, {stats['remaining']} still to do ({stats['batches']} batches submitted)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Near-duplicate detection with perceptual hashes.
+
+Bursts, re-exports and resized copies of the same photo have different
+bytes (so the content-addressed result cache misses) but nearly identical
+pictures. Each analyzed image gets a 64-bit difference hash (dHash); a new
+image whose hash lies within a small Hamming distance of an analyzed one
+reuses that analysis instead of calling the provider again.
+
+Hashes are kept in a BK-tree per provider/model for fast radius queries
+and persisted in SQLite next to the result cache.
+"""
+import os
+import sqlite3
+import threading
+
+INDEX_FILENAME = "phash_index.sqlite3"
+
+# Hamming distance (out of 64 bits) under which two images count as duplicates
+DEFAULT_MAX_DISTANCE = 6
+
+# Flat or low-detail images hash to (nearly) all zeros or all ones whatever
+# their colours, so hashes with fewer set or unset bits than this never match
+MIN_HASH_BITS = 8
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def is_informative(value, bits=64):
+    """True if a hash carries enough detail to tell images apart"""
+    ones = bin(value).count("1")
+    return MIN_HASH_BITS <= ones <= bits - MIN_HASH_BITS
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash of a PIL image: compares horizontally adjacent pixels"""
+    from PIL import Image
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(image_path):
+    """dHash of an image file, decoded at a reduced size"""
+    from image_features import load_small
+    small = load_small(image_path, 64)[0]
+    return dhash(small)
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, payload):
+        node = [value, payload, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, radius):
+        """All (distance, value, payload) within radius, nearest first"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.append((distance, node[0], node[1]))
+            # Triangle inequality: only these subtrees can hold matches
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda match: match[0])
+        return found
+
+
+class DuplicateIndex:
+    """Persistent perceptual-hash index mapping images to their result cache keys"""
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._trees = {}
+        self.stats = {"lookups": 0, "duplicates": 0}
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                scope TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                path TEXT,
+                result_key TEXT NOT NULL,
+                PRIMARY KEY (scope, result_key))""")
+            for scope, value, image_path, result_key in self._db.execute(
+                    "SELECT scope, hash, path, result_key FROM hashes"):
+                self._tree(scope).add(int(value, 16), (image_path, result_key))
+
+    def _tree(self, scope):
+        tree = self._trees.get(scope)
+        if tree is None:
+            tree = self._trees[scope] = BKTree()
+        return tree
+
+    def candidates(self, scope, value, max_distance=DEFAULT_MAX_DISTANCE):
+        """[(distance, path, result_key)] within max_distance, nearest first
+
+        Empty for hashes of flat images (see is_informative).
+        """
+        if not is_informative(value):
+            return []
+        with self._lock:
+            self.stats["lookups"] += 1
+            matches = self._tree(scope).search(value, max_distance)
+        return [(distance, image_path, result_key) for distance, _, (image_path, result_key) in matches]
+
+    def find(self, scope, value, max_distance=DEFAULT_MAX_DISTANCE):
+        """Nearest (distance, path, result_key) within max_distance, or None"""
+        matches = self.candidates(scope, value, max_distance)
+        return matches[0] if matches else None
+
+    def record_duplicate(self):
+        with self._lock:
+            self.stats["duplicates"] += 1
+
+    def add(self, scope, value, image_path, result_key):
+        if not is_informative(value):
+            return
+        with self._lock:
+            self._tree(scope).add(value, (image_path, result_key))
+            if self._db is not None:
+                self._db.execute("INSERT OR IGNORE INTO hashes (scope, hash, path, result_key) VALUES (?, ?, ?, ?)",
+                                 (scope, "%016x" % value, image_path, result_key))
+
+    @property
+    def dedup_ratio(self):
+        """Share of lookups that were served by a near-duplicate"""
+        lookups = self.stats["lookups"]
+        return self.stats["duplicates"] / lookups if lookups else 0.0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index stored in the app data directory"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            from photo_analysis import app_data_dir
+            _index = DuplicateIndex(os.path.join(app_data_dir(), INDEX_FILENAME))
+        return _index
@@ -0,0 +1,288 @@
+"""Virtualized thumbnail gallery for the desktop app.
+
+The gallery can hold tens of thousands of paths, but only the cells in
+view (plus one row above and below) exist as canvas items; scrolling
+deletes the cells that left the viewport and draws the ones that entered.
+Thumbnails come from the packed ThumbnailStore. Hits are read on the Tk
+thread (a small JPEG from a memory map); misses are made by a few worker
+threads, newest request first, and a request whose cell has scrolled away
+is dropped before any decoding starts.
+"""
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from thumbnail_store import get_store, THUMB_SIZE
+
+CELL_PADDING = 8
+CELL_SIZE = THUMB_SIZE + 2 * CELL_PADDING
+
+# Thumbnails decoded from originals at once
+THUMBNAIL_WORKERS = 2
+
+# PhotoImages kept for cells that scrolled away
+PHOTO_CACHE_SIZE = 600
+
+BG = '#0a0a0a'
+CELL_BG = '#1a1a1a'
+SELECTED = '#00ff88'
+
+
+class ThumbnailGallery(tk.Frame):
+    """Scrollable grid of thumbnails that only materializes the visible rows
+
+    ``post_event(handler, *args)`` must run handler on the Tk thread; it is
+    how worker threads hand finished thumbnails back. ``on_select(path)``
+    fires on click or keyboard selection, ``on_activate(path)`` on
+    double-click or Return.
+    """
+
+    def __init__(self, parent, post_event, on_select=None, on_activate=None):
+        super().__init__(parent, bg=BG)
+        self.post_event = post_event
+        self.on_select = on_select
+        self.on_activate = on_activate
+        self.paths = []
+        self.selected = None
+        self.columns = 1
+        # index -> canvas item ids of the cells currently drawn
+        self.cells = {}
+        self.photos = OrderedDict()
+        self.failed = set()
+        self.wanted = []
+        self.in_flight = set()
+        self.executor = None
+        self._redraw_pending = False
+
+        self.canvas = tk.Canvas(self, bg=BG, highlightthickness=0, bd=0, takefocus=1)
+        scrollbar = tk.Scrollbar(self, command=self._yview, bg='#1a1a1a', troughcolor='#0f0f0f',
+                                 activebackground='#00ff88', bd=0, width=12)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind('<Configure>', self._on_configure)
+        self.canvas.bind('<Button-1>', self._on_click)
+        self.canvas.bind('<Double-Button-1>', self._on_double_click)
+        self.canvas.bind('<MouseWheel>', self._on_wheel)
+        self.canvas.bind('<Button-4>', lambda e: self._scroll_units(-1))
+        self.canvas.bind('<Button-5>', lambda e: self._scroll_units(1))
+        for key, step in (('<Left>', -1), ('<Right>', 1), ('<Up>', 'up'), ('<Down>', 'down')):
+            self.canvas.bind(key, lambda e, step=step: self._move_selection(step))
+        self.canvas.bind('<Return>', lambda e: self._activate(self.selected))
+
+    def set_images(self, paths):
+        """Show paths (replacing the current set) and scroll to the top"""
+        self.paths = list(paths)
+        self.selected = None
+        self.wanted = []
+        self.failed.clear()
+        self.canvas.delete('all')
+        self.cells.clear()
+        self.canvas.yview_moveto(0)
+        self._update_scrollregion()
+        self.schedule_redraw()
+
+    def select_path(self, path):
+        """Highlight path if it is in the gallery (e.g. after opening it elsewhere)"""
+        try:
+            index = self.paths.index(path)
+        except ValueError:
+            return
+        self._select(index, notify=False)
+
+    def _update_scrollregion(self):
+        width = max(1, self.canvas.winfo_width())
+        self.columns = max(1, width // CELL_SIZE)
+        rows = (len(self.paths) + self.columns - 1) // self.columns
+        self.canvas.configure(scrollregion=(0, 0, self.columns * CELL_SIZE, rows * CELL_SIZE))
+
+    def _on_configure(self, event):
+        columns = max(1, event.width // CELL_SIZE)
+        if columns != self.columns:
+            # Reflow: every cell moves
+            self.canvas.delete('all')
+            self.cells.clear()
+        self._update_scrollregion()
+        self.schedule_redraw()
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_redraw()
+
+    def _scroll_units(self, units):
+        self.canvas.yview_scroll(units, 'units')
+        self.schedule_redraw()
+
+    def _on_wheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        step = -1 if event.delta > 0 else 1
+        self._scroll_units(step * max(1, abs(event.delta) // 120))
+
+    def schedule_redraw(self):
+        """Coalesce redraws: a fast scroll triggers one per idle pass"""
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self._redraw)
+
+    def visible_range(self):
+        """(first, last) indices of the cells in view, one row of margin each side"""
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        first_row = max(0, int(top // CELL_SIZE) - 1)
+        last_row = int((top + height) // CELL_SIZE) + 1
+        return first_row * self.columns, min(len(self.paths), (last_row + 1) * self.columns)
+
+    def _redraw(self):
+        self._redraw_pending = False
+        first, last = self.visible_range()
+        for index in [i for i in self.cells if not first <= i < last]:
+            for item in self.cells.pop(index):
+                self.canvas.delete(item)
+
+        wanted = []
+        for index in range(first, last):
+            if index in self.cells:
+                continue
+            path = self.paths[index]
+            photo = self._photo(path)
+            self.cells[index] = self._draw_cell(index, path, photo)
+            if photo is None and path not in self.failed:
+                wanted.append(path)
+        # Most recently revealed first; anything that scrolled away is dropped
+        visible = {self.paths[i] for i in range(first, last)}
+        self.wanted = [p for p in self.wanted if p in visible and p not in wanted] + wanted[::-1]
+        self._pump()
+
+    def _cell_origin(self, index):
+        row, column = divmod(index, self.columns)
+        return column * CELL_SIZE, row * CELL_SIZE
+
+    def _draw_cell(self, index, path, photo):
+        x, y = self._cell_origin(index)
+        outline = SELECTED if index == self.selected else CELL_BG
+        items = [self.canvas.create_rectangle(x + 2, y + 2, x + CELL_SIZE - 2, y + CELL_SIZE - 2,
+                                              fill=CELL_BG, outline=outline, width=2)]
+        center = (x + CELL_SIZE // 2, y + CELL_SIZE // 2)
+        if photo is not None:
+            items.append(self.canvas.create_image(*center, image=photo))
+        else:
+            label = "⚠️" if path in self.failed else "⏳"
+            items.append(self.canvas.create_text(*center, text=label, fill='#666666', font=('Segoe UI', 14)))
+        return items
+
+    def _photo(self, path):
+        """PhotoImage for path from memory or the thumbnail store, or None if it must be made"""
+        photo = self.photos.get(path)
+        if photo is not None:
+            self.photos.move_to_end(path)
+            return photo
+        try:
+            thumb = get_store().lookup(path)
+        except Exception:
+            thumb = None
+        return self._remember(path, thumb) if thumb is not None else None
+
+    def _remember(self, path, thumb):
+        from PIL import ImageTk
+        photo = ImageTk.PhotoImage(thumb)
+        self.photos[path] = photo
+        while len(self.photos) > PHOTO_CACHE_SIZE:
+            self.photos.popitem(last=False)
+        return photo
+
+    def _pump(self):
+        """Keep up to THUMBNAIL_WORKERS thumbnails in the making"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+        while self.wanted and len(self.in_flight) < THUMBNAIL_WORKERS:
+            path = self.wanted.pop()
+            if path in self.in_flight:
+                continue
+            self.in_flight.add(path)
+            self.executor.submit(self._thumbnail_worker, path)
+
+    def _thumbnail_worker(self, path):
+        try:
+            thumb = get_store().get_or_create(path)
+        except Exception:
+            thumb = None
+        self.post_event(self._on_thumbnail, path, thumb)
+
+    def _on_thumbnail(self, path, thumb):
+        self.in_flight.discard(path)
+        if thumb is None:
+            self.failed.add(path)
+        else:
+            self._remember(path, thumb)
+        # Redraw the cell if it is still on screen
+        for index, items in list(self.cells.items()):
+            if self.paths[index] == path:
+                for item in items:
+                    self.canvas.delete(item)
+                self.cells[index] = self._draw_cell(index, path, self.photos.get(path))
+        self._pump()
+
+    def _index_at(self, event):
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        column, row = int(x // CELL_SIZE), int(y // CELL_SIZE)
+        index = row * self.columns + column
+        if column < self.columns and 0 <= index < len(self.paths):
+            return index
+        return None
+
+    def _on_click(self, event):
+        self.canvas.focus_set()
+        index = self._index_at(event)
+        if index is not None:
+            self._select(index)
+
+    def _on_double_click(self, event):
+        index = self._index_at(event)
+        if index is not None:
+            self._activate(index)
+
+    def _move_selection(self, step):
+        if not self.paths:
+            return
+        if step == 'up':
+            step = -self.columns
+        elif step == 'down':
+            step = self.columns
+        current = self.selected if self.selected is not None else -step
+        self._select(min(len(self.paths) - 1, max(0, current + step)))
+
+    def _select(self, index, notify=True):
+        previous, self.selected = self.selected, index
+        for i in (previous, index):
+            if i is not None and i in self.cells:
+                self.canvas.itemconfigure(self.cells[i][0], outline=SELECTED if i == index else CELL_BG)
+        self._scroll_into_view(index)
+        if notify and self.on_select is not None:
+            self.on_select(self.paths[index])
+
+    def _scroll_into_view(self, index):
+        rows = (len(self.paths) + self.columns - 1) // self.columns
+        if not rows:
+            return
+        y = (index // self.columns) * CELL_SIZE
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        if y < top:
+            self.canvas.yview_moveto(y / (rows * CELL_SIZE))
+        elif y + CELL_SIZE > top + height:
+            self.canvas.yview_moveto((y + CELL_SIZE - height) / (rows * CELL_SIZE))
+        self.schedule_redraw()
+
+    def _activate(self, index):
+        if index is not None and self.on_activate is not None:
+            self.on_activate(self.paths[index])
+
+    def status_text(self):
+        count = len(self.paths)
+        return f"{count:,} photo{'s' if count != 1 else ''}"
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
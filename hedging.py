@@ -0,0 +1,161 @@
+"""Hedged provider requests for tail latency.
+
+The primary provider gets the request first. If it has not answered by the
+time most of its recent calls had (``HEDGE_PERCENTILE`` of its latency
+window), the same image is sent to a backup provider as well; the first
+good answer wins and the other leg is cancelled. A primary that fails
+outright fails over to the backup immediately. Backends whose circuit
+breaker is open are never used as the hedge.
+
+Settings come from the environment (``.env`` works too):
+
+    ANALYSIS_DEADLINE     seconds an analysis may take in total (default 90)
+    HEDGE_PROVIDERS       comma-separated backup providers in order of
+                          preference, e.g. "imagedescriber,chatgpt";
+                          unset disables hedging
+    HEDGE_PERCENTILE      primary latency percentile that triggers the
+                          hedge (default 90)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import providers
+from provider_retry import ProviderError, Deadline
+from stage_metrics import StageTimes
+
+DEFAULT_DEADLINE = 90.0
+DEFAULT_PERCENTILE = 0.9
+
+# Hedge delay until the primary has enough latency samples
+DEFAULT_HEDGE_DELAY = 8.0
+
+
+class HedgeSettings:
+    """Deadline and hedging configuration for interactive and batch runs"""
+
+    def __init__(self, deadline=DEFAULT_DEADLINE, hedge_providers=(), percentile=DEFAULT_PERCENTILE):
+        self.deadline = deadline
+        self.hedge_providers = list(hedge_providers)
+        self.percentile = percentile
+
+    def hedge_provider_for(self, primary, api_keys):
+        """First configured backup other than primary that has a key and a closed breaker"""
+        for name in self.hedge_providers:
+            backend = providers.get_provider(name)
+            if name == primary or backend is None:
+                continue
+            if backend.requires_key and not api_keys.get(name):
+                continue
+            if backend.breaker.available():
+                return name
+        return None
+
+
+def settings_from_env():
+    try:
+        deadline = float(os.getenv("ANALYSIS_DEADLINE") or DEFAULT_DEADLINE) or None
+    except ValueError:
+        deadline = DEFAULT_DEADLINE
+    try:
+        percentile = float(os.getenv("HEDGE_PERCENTILE") or DEFAULT_PERCENTILE * 100) / 100
+    except ValueError:
+        percentile = DEFAULT_PERCENTILE
+    names = [name.strip() for name in (os.getenv("HEDGE_PROVIDERS") or "").split(",") if name.strip()]
+    return HedgeSettings(deadline, names, percentile)
+
+
+def hedge_delay(primary, percentile=DEFAULT_PERCENTILE):
+    """Seconds to give the primary before hedging"""
+    observed = providers.get_provider(primary).latency.percentile(percentile)
+    return observed if observed is not None else DEFAULT_HEDGE_DELAY
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+        return _executor
+
+
+def hedged_analyze(image_path, primary, api_key, secondary, secondary_key, upload=None, deadline=None,
+                   percentile=DEFAULT_PERCENTILE, on_delta=None, stages=None):
+    """Return (provider name, text, hedged) from whichever provider answers first
+
+    ``upload`` is the primary's prepared image; the secondary prepares its
+    own. Only the primary streams to ``on_delta``. Each leg times its
+    stages separately; the winner's are added to ``stages``. Raises the
+    primary's ProviderError when both legs fail.
+    """
+    deadline = deadline or Deadline()
+    executor = _get_executor()
+    legs = {}
+
+    def launch(name, key, leg_upload, leg_delta=None):
+        leg_deadline = deadline.child()
+        leg_stages = StageTimes() if stages is not None else None
+        future = executor.submit(providers.get_provider(name).analyze, image_path, key, leg_upload, leg_deadline,
+                                 leg_delta, leg_stages)
+        legs[future] = (name, leg_deadline, leg_stages)
+
+    # A primary that is already streaming its answer is not hedged
+    streaming = threading.Event()
+
+    def primary_delta(text):
+        if text:
+            streaming.set()
+        on_delta(text)
+
+    launch(primary, api_key, upload, primary_delta if on_delta is not None else None)
+    hedged = False
+    waiting = True
+    delay = hedge_delay(primary, percentile)
+    errors = {}
+    try:
+        while legs:
+            timeout = delay if waiting else None
+            left = deadline.remaining()
+            if left is not None:
+                timeout = left if timeout is None else min(timeout, left)
+            done, _ = wait(list(legs), timeout, FIRST_COMPLETED)
+            if not done:
+                if deadline.expired:
+                    break
+                waiting = False
+                if not streaming.is_set():
+                    # Primary is slower than usual: race the backup against it
+                    hedged = True
+                    launch(secondary, secondary_key, None)
+                continue
+            for future in done:
+                name, _, leg_stages = legs.pop(future)
+                try:
+                    text = future.result()
+                    if leg_stages is not None:
+                        stages.merge(leg_stages)
+                    return name, text, hedged
+                except ProviderError as e:
+                    errors[name] = e
+                except Exception as e:
+                    errors[name] = ProviderError("bad_request", f"Error: {str(e)}")
+            if not hedged and not deadline.expired:
+                # Primary failed outright: fail over
+                hedged = True
+                waiting = False
+                launch(secondary, secondary_key, None)
+    finally:
+        # Losers drop a response they are reading at once; one still waiting
+        # for headers stops when they arrive. Neither records its latency.
+        for _, leg_deadline, _ in legs.values():
+            leg_deadline.cancel()
+
+    if primary in errors:
+        raise errors[primary]
+    if errors:
+        raise next(iter(errors.values()))
+    raise ProviderError("deadline", "Error: Analysis deadline exceeded")
@@ -0,0 +1,196 @@
+"""Prepare images for upload: downsample and re-encode to a byte budget.
+
+Providers only look at a limited resolution (GPT-4o fits images into
+2048x2048 and then scales the short side to 768 px), so sending a 24 MP
+original just costs upload time. ``prepare_upload`` shrinks each image to
+what its provider can use, then searches the encoder quality for the
+largest JPEG/WebP that stays within the provider's byte budget. Files that
+are already small enough and in a format the provider accepts are passed
+through untouched, with their real MIME type; those are memory-mapped
+rather than read, so the upload never holds a second copy of the file.
+
+Rasters too big to decode whole are reduced in strips first (see
+large_image).
+
+Each EncodedImage records how long the read, decode, resize and encode
+steps took, in milliseconds (see stage_metrics).
+"""
+import io
+import os
+import mmap
+import time
+
+from result_cache import hash_bytes, hash_file
+from large_image import open_image, load_within_budget, apply_orientation
+
+# Resolution and size budget per provider
+UPLOAD_LIMITS = {
+    "chatgpt": {"max_side": 2048, "max_short_side": 768, "target_bytes": 400 * 1024},
+    "imagedescriber": {"max_side": 1568, "max_short_side": None, "target_bytes": 800 * 1024},
+}
+DEFAULT_LIMITS = {"max_side": 2048, "max_short_side": None, "target_bytes": 800 * 1024}
+
+# Formats every provider accepts as-is
+PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+# Files above this are hashed in chunks rather than memory-mapped whole
+HASH_IN_CHUNKS_BYTES = 64 * 1024 * 1024
+
+MIN_QUALITY = 40
+MAX_QUALITY = 90
+
+
+class EncodedImage:
+    """Bytes ready to upload, plus what they are and where they came from"""
+
+    __slots__ = ("data", "mime", "width", "height", "source_size", "source_hash", "reencoded", "timings")
+
+    def __init__(self, data, mime, width, height, source_size, source_hash, reencoded, timings=None):
+        self.data = data
+        self.mime = mime
+        self.width = width
+        self.height = height
+        self.source_size = source_size
+        self.source_hash = source_hash
+        self.reencoded = reencoded
+        self.timings = timings or {}
+
+    def as_bytes(self):
+        """The payload as bytes (copies only when it is memory-mapped)"""
+        if isinstance(self.data, bytes):
+            return self.data
+        return bytes(self.data)
+
+    def close(self):
+        """Release the memory map of a passed-through file"""
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # A request still streaming it (e.g. a cancelled hedge); freed once it finishes
+                pass
+
+    @property
+    def extension(self):
+        return EXTENSIONS.get(self.mime, ".jpg")
+
+    def upload_name(self, image_path):
+        """File name to send in multipart uploads, matching the encoded format"""
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        return stem + self.extension
+
+
+def target_size(width, height, limits):
+    """Largest size within the provider's limits, never upscaling"""
+    scale = min(1.0, limits["max_side"] / max(width, height))
+    if limits.get("max_short_side"):
+        scale = min(scale, limits["max_short_side"] / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == "WEBP":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def encode_to_budget(image, fmt, target_bytes):
+    """Binary-search the highest quality whose output fits target_bytes"""
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(image, fmt, quality)
+        if len(data) <= target_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+    # Even the lowest quality is over budget: send the smallest we made
+    return best if best is not None else _encode(image, fmt, MIN_QUALITY)
+
+
+def map_file(image_path):
+    """Memory-map a file read-only (empty files fall back to bytes)"""
+    with open(image_path, "rb") as image_file:
+        try:
+            return mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b""
+
+
+def prepare_upload(image_path, limits, image_bytes=None, prefer_format="JPEG"):
+    """Return an EncodedImage sized and encoded for a provider
+
+    ``limits`` is a provider's upload limits dict, or a provider name to
+    look up in UPLOAD_LIMITS.
+    """
+    from PIL import Image, ImageOps
+    if isinstance(limits, str):
+        limits = UPLOAD_LIMITS.get(limits, DEFAULT_LIMITS)
+    timings = {}
+    started = time.perf_counter()
+
+    def lap(name):
+        nonlocal started
+        now = time.perf_counter()
+        timings[name] = (now - started) * 1000
+        started = now
+
+    if image_bytes is None and os.path.getsize(image_path) > HASH_IN_CHUNKS_BYTES:
+        # Far too big to pass through: hash it in chunks instead of mapping it all
+        source = None
+        source_size = os.path.getsize(image_path)
+        source_hash = hash_file(image_path)
+    else:
+        source = image_bytes if image_bytes is not None else map_file(image_path)
+        source_size = len(source)
+        source_hash = hash_bytes(source)
+    try:
+        lap("read")
+        with open_image(io.BytesIO(source) if image_bytes is not None else image_path) as img:
+            fmt = img.format
+            width, height = img.size
+            new_size = target_size(width, height, limits)
+            if (fmt in PASSTHROUGH_FORMATS and new_size == (width, height)
+                    and source_size <= limits["target_bytes"]):
+                upload = EncodedImage(source, MIME_TYPES[fmt], width, height,
+                                      source_size, source_hash, False, timings)
+                source = None
+                return upload
+
+            # Let the JPEG decoder skip detail we are about to throw away
+            if fmt == "JPEG":
+                img.draft("RGB", new_size)
+            decoded = load_within_budget(img, image_bytes if image_bytes is not None else image_path,
+                                         max(new_size))
+            if decoded is img:
+                image = ImageOps.exif_transpose(img)
+                image.load()
+            else:
+                image = apply_orientation(decoded, img.getexif().get(0x0112, 1))
+            lap("decode")
+    finally:
+        if isinstance(source, mmap.mmap):
+            source.close()
+
+    # exif_transpose may swap the axes
+    new_size = target_size(image.width, image.height, limits)
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    out_format = "WEBP" if (has_alpha or prefer_format == "WEBP") else "JPEG"
+    image = image.convert("RGBA" if has_alpha and out_format == "WEBP" else "RGB")
+    if image.size != new_size:
+        image = image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    lap("resize")
+
+    data = encode_to_budget(image, out_format, limits["target_bytes"])
+    lap("encode")
+    return EncodedImage(data, MIME_TYPES[out_format], image.width, image.height,
+                        source_size, source_hash, True, timings)
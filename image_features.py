@@ -0,0 +1,203 @@
+"""Offline image features for the no-network analysis tier.
+
+Everything is computed on a small copy of the image (256 px on the long
+side, decoded with JPEG draft mode where possible) using Pillow's C-level
+filters, histograms and channel arithmetic, so the cost is dominated by
+the initial decode and stays in the milliseconds for normal photos no
+matter how large the original is.
+
+Features:
+  * dominant colour palette (median-cut quantization)
+  * brightness histogram, exposure clipping and RMS contrast
+  * sharpness (variance of the Laplacian) with a blur verdict
+  * edge density (share of strong-gradient pixels)
+  * colourfulness (Hasler & Suesstrunk) and mean saturation
+"""
+import math
+import time
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from large_image import open_image, load_within_budget
+
+ANALYSIS_SIZE = 256
+PALETTE_COLORS = 5
+
+# The Laplacian ranges over +-1020 on 8-bit data, more than an "L" image can
+# hold (and Pillow won't filter "F" images), so it is taken in two passes, the
+# positive and the negative part, each divided by 4 to fit 0..255 unclipped
+_LAPLACIAN = ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=4)
+_NEGATED_LAPLACIAN = ImageFilter.Kernel((3, 3), [0, -1, 0, -1, 4, -1, 0, -1, 0], scale=4)
+
+# Threshold on FIND_EDGES output that counts as an edge pixel
+EDGE_THRESHOLD = 40
+
+# Reference colours for naming palette entries
+_COLOR_NAMES = [
+    ("black", (20, 20, 20)), ("dark gray", (70, 70, 70)), ("gray", (128, 128, 128)),
+    ("light gray", (190, 190, 190)), ("white", (245, 245, 245)),
+    ("red", (200, 30, 30)), ("dark red", (110, 20, 20)), ("orange", (235, 130, 30)),
+    ("brown", (120, 75, 40)), ("beige", (220, 200, 160)), ("yellow", (235, 220, 50)),
+    ("olive", (120, 120, 40)), ("green", (50, 160, 60)), ("dark green", (25, 80, 35)),
+    ("teal", (30, 130, 130)), ("cyan", (60, 200, 220)), ("sky blue", (120, 180, 235)),
+    ("blue", (40, 70, 200)), ("navy", (20, 30, 90)), ("purple", (120, 50, 150)),
+    ("pink", (235, 140, 180)), ("magenta", (200, 40, 160)),
+]
+
+
+def color_name(rgb):
+    """Nearest named colour for an (r, g, b) tuple"""
+    return min(_COLOR_NAMES, key=lambda named: sum((a - b) ** 2 for a, b in zip(rgb, named[1])))[0]
+
+
+class ImageFeatures:
+    """Numbers describing an image; see extract_features"""
+
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def laplacian_variance(gray):
+    """Variance of the Laplacian of an "L" image, as OpenCV computes it"""
+    if gray.width < 3 or gray.height < 3:
+        return 0.0
+    # Kernel filters copy the border pixels unfiltered
+    inner = (1, 1, gray.width - 1, gray.height - 1)
+    positive = ImageStat.Stat(gray.filter(_LAPLACIAN).crop(inner))
+    negative = ImageStat.Stat(gray.filter(_NEGATED_LAPLACIAN).crop(inner))
+    count = positive.count[0]
+    # At most one of the two parts is non-zero at each pixel
+    mean = (positive.sum[0] - negative.sum[0]) / count
+    return 16 * ((positive.sum2[0] + negative.sum2[0]) / count - mean * mean)
+
+
+def load_small(image_path, size=ANALYSIS_SIZE):
+    """Open image_path and return (small RGB copy, original size, format, mode)"""
+    with open_image(image_path) as img:
+        original_size = img.size
+        format_name = img.format
+        mode = img.mode
+        if format_name == "JPEG":
+            img.draft("RGB", (size, size))
+        # Huge rasters are reduced strip by strip instead of decoded whole
+        img = load_within_budget(img, image_path, size)
+        img.thumbnail((size, size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+            # Judge transparent images against white, as viewers show them
+            rgba = img.convert("RGBA")
+            small = Image.new("RGB", rgba.size, (255, 255, 255))
+            small.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            small = img.convert("RGB")
+    return small, original_size, format_name, mode
+
+
+def dominant_colors(small, count=PALETTE_COLORS):
+    """[(hex, name, share), ...] ordered by share"""
+    quantized = small.quantize(colors=count, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()
+    total = small.width * small.height
+    colors = []
+    for pixels, index in sorted(quantized.getcolors(), reverse=True):
+        rgb = tuple(palette[index * 3:index * 3 + 3])
+        colors.append(("#%02x%02x%02x" % rgb, color_name(rgb), pixels / total))
+    return colors
+
+
+def colorfulness(small):
+    """Hasler & Suesstrunk colourfulness (0 = grey, ~100+ = very colourful)"""
+    r, g, b = small.split()
+    # Signed differences are stored halved around 128 to fit in 8 bits
+    rg = ImageStat.Stat(ImageChops.subtract(r, g, scale=2, offset=128))
+    yb = ImageStat.Stat(ImageChops.subtract(ImageChops.add(r, g, scale=2), b, scale=2, offset=128))
+    std_rg, std_yb = rg.stddev[0] * 2, yb.stddev[0] * 2
+    mean_rg, mean_yb = (rg.mean[0] - 128) * 2, (yb.mean[0] - 128) * 2
+    return math.hypot(std_rg, std_yb) + 0.3 * math.hypot(mean_rg, mean_yb)
+
+
+def extract_features(image_path, size=ANALYSIS_SIZE):
+    """Compute ImageFeatures for image_path on a downsampled copy"""
+    started = time.perf_counter()
+    small, (width, height), format_name, mode = load_small(image_path, size)
+    gray = small.convert("L")
+    gray_stat = ImageStat.Stat(gray)
+    total = gray.width * gray.height
+
+    histogram = gray.histogram()
+    # Eight brightness bands, darkest first
+    bands = [sum(histogram[i:i + 32]) / total for i in range(0, 256, 32)]
+    shadows_clipped = sum(histogram[:6]) / total
+    highlights_clipped = sum(histogram[250:]) / total
+
+    sharpness = laplacian_variance(gray)
+
+    edges = gray.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v > EDGE_THRESHOLD else 0)
+    edge_density = ImageStat.Stat(edges).mean[0] / 255
+
+    saturation = ImageStat.Stat(small.convert("HSV").getchannel("S")).mean[0] / 255
+    r_mean, g_mean, b_mean = ImageStat.Stat(small).mean
+
+    return ImageFeatures(
+        width=width,
+        height=height,
+        format=format_name,
+        mode=mode,
+        palette=dominant_colors(small),
+        brightness=gray_stat.mean[0] / 255,
+        contrast=gray_stat.stddev[0] / 255,
+        brightness_bands=bands,
+        shadows_clipped=shadows_clipped,
+        highlights_clipped=highlights_clipped,
+        sharpness=sharpness,
+        edge_density=edge_density,
+        colorfulness=colorfulness(small),
+        saturation=saturation,
+        warmth=(r_mean - b_mean) / 255,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def _grade(value, levels):
+    """Pick the label of the first (upper_bound, label) that value is below"""
+    for bound, label in levels:
+        if value < bound:
+            return label
+    return levels[-1][1]
+
+
+def describe_features(features):
+    """Plain-language bullet lines for the fallback analysis"""
+    lines = []
+    # Neighbouring palette entries often share a name; report them together
+    shares = {}
+    for _, name, share in features.palette:
+        shares[name] = shares.get(name, 0) + share
+    palette = ", ".join(f"{name} {share:.0%}" for name, share in
+                        sorted(shares.items(), key=lambda item: -item[1])[:4])
+    lines.append(f"• Dominant colors: {palette}")
+
+    exposure = _grade(features.brightness, [(0.2, "very dark"), (0.4, "dark"), (0.6, "balanced"),
+                                            (0.8, "bright"), (2, "very bright")])
+    contrast = _grade(features.contrast, [(0.12, "low"), (0.22, "moderate"), (2, "high")])
+    lines.append(f"• Exposure: {exposure} (brightness {features.brightness:.0%}), {contrast} contrast")
+    if features.shadows_clipped > 0.05:
+        lines.append(f"• {features.shadows_clipped:.0%} of the image is crushed to black")
+    if features.highlights_clipped > 0.05:
+        lines.append(f"• {features.highlights_clipped:.0%} of the image is blown out to white")
+
+    focus = _grade(features.sharpness, [(50, "blurry or soft"), (200, "moderately sharp"), (10 ** 9, "sharp")])
+    lines.append(f"• Focus: {focus} (Laplacian variance {features.sharpness:.0f})")
+
+    detail = _grade(features.edge_density, [(0.03, "smooth, minimal detail"), (0.12, "moderate detail"),
+                                            (2, "busy, highly detailed")])
+    lines.append(f"• Texture: {detail} ({features.edge_density:.0%} edge pixels)")
+
+    vividness = _grade(features.colorfulness, [(10, "nearly monochrome"), (33, "muted colors"),
+                                               (60, "moderately colorful"), (10 ** 9, "vivid, highly colorful")])
+    tone = "warm" if features.warmth > 0.04 else "cool" if features.warmth < -0.04 else "neutral"
+    lines.append(f"• Color: {vividness}, {tone} tone (colorfulness {features.colorfulness:.0f}, "
+                 f"saturation {features.saturation:.0%})")
+    return lines
@@ -0,0 +1,444 @@
+"""Durable SQLite job queue for batch runs that must survive a crash.
+
+Every image is a row in the queue database with a state:
+
+    pending    waiting for a worker
+    in_flight  claimed by a worker until its lease expires
+    done       analyzed (by the provider or the fallback), result stored
+    failed     gave up after ``max_attempts`` tries
+
+A worker claims jobs under a lease and keeps renewing it while it works.
+If the process dies, its jobs become claimable again once the lease runs
+out - immediately, when the dead process was on this machine. The result
+record is stored in the same transaction that marks a job done, and only
+by the worker that still holds the lease, so a job finished twice (after a
+lease was reclaimed) is recorded once. The JSONL output is exported from
+the database, never appended to, so it always has one line per image.
+
+Re-running the same command resumes where the last run stopped: the folder
+is not scanned again, and only pending, expired and (with
+``--retry-failed``) failed jobs are worked on. Several processes, even on
+different machines sharing the database file, can work the same queue.
+
+Usage:
+    python job_queue.py PHOTOS_DIR --db archive.jobs.sqlite3 --output results.jsonl
+"""
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+import photo_analysis
+import provider_client
+import providers
+import hedging
+import duplicate_index
+from batch_analyzer import BatchItem, scan_images, make_encode_stage, make_submit_stage, process_item
+
+STATES = ("pending", "in_flight", "done", "failed")
+
+DEFAULT_LEASE = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Paths inserted per transaction while scanning
+ENQUEUE_CHUNK = 1000
+
+
+def worker_id(index=0):
+    """host:pid:index - lets a restarted process spot leases held by dead local workers"""
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    # A killed process nobody has reaped yet still answers signal 0
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            return f.read().rsplit(b")", 1)[1].split()[0] != b"Z"
+    except (OSError, IndexError):
+        return True
+
+
+class JobQueue:
+    """Image jobs with states, attempts and leases in one SQLite file"""
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Durable: a job marked done must still be done after a power cut
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            state TEXT NOT NULL DEFAULT 'pending',
+            outcome TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL,
+            error TEXT,
+            record TEXT,
+            updated REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, id)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _transaction(self, func):
+        """Run func(db) in an IMMEDIATE transaction, so claims never race across processes"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def enqueue(self, paths):
+        """Add paths as pending jobs; paths already queued are left alone. Returns the number added"""
+        added = 0
+        chunk = []
+        for path in paths:
+            chunk.append((os.path.abspath(path), time.time()))
+            if len(chunk) >= ENQUEUE_CHUNK:
+                added += self._insert(chunk)
+                chunk = []
+        if chunk:
+            added += self._insert(chunk)
+        return added
+
+    def _insert(self, rows):
+        def insert(db):
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO jobs (path, updated) VALUES (?, ?)", rows)
+            return db.total_changes - before
+        return self._transaction(insert)
+
+    def claim(self, owner, limit=1):
+        """Lease up to limit jobs to owner: pending ones first, then expired leases
+
+        Returns [(job_id, path)]. Jobs that used up their attempts are
+        marked failed instead of being handed out again.
+        """
+        def claim(db):
+            now = time.time()
+            claimed = []
+            # Expired leases out of attempts are failed and skipped, so keep
+            # selecting until enough jobs are leased or none are left
+            while len(claimed) < limit:
+                rows = db.execute(
+                    "SELECT id, path, attempts FROM jobs WHERE state = 'pending' "
+                    "OR (state = 'in_flight' AND lease_expires < ?) ORDER BY id LIMIT ?",
+                    (now, limit - len(claimed))).fetchall()
+                if not rows:
+                    break
+                for job_id, path, attempts in rows:
+                    if attempts >= self.max_attempts:
+                        db.execute("UPDATE jobs SET state = 'failed', lease_owner = NULL, lease_expires = NULL, "
+                                   "error = COALESCE(error, 'lease expired'), updated = ? WHERE id = ?",
+                                   (now, job_id))
+                        continue
+                    db.execute("UPDATE jobs SET state = 'in_flight', attempts = attempts + 1, lease_owner = ?, "
+                               "lease_expires = ?, updated = ? WHERE id = ?",
+                               (owner, now + self.lease_seconds, now, job_id))
+                    claimed.append((job_id, path))
+            return claimed
+        return self._transaction(claim)
+
+    def renew(self, owner, job_ids):
+        """Extend owner's leases; returns the ids it still holds"""
+        if not job_ids:
+            return []
+        def renew(db):
+            expires = time.time() + self.lease_seconds
+            held = []
+            for job_id in job_ids:
+                cursor = db.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = 'in_flight' "
+                                    "AND lease_owner = ?", (expires, job_id, owner))
+                if cursor.rowcount:
+                    held.append(job_id)
+            return held
+        return self._transaction(renew)
+
+    def complete(self, job_id, owner, outcome, record):
+        """Store the result and mark the job done; False if owner had lost the lease"""
+        def complete(db):
+            cursor = db.execute(
+                "UPDATE jobs SET state = 'done', outcome = ?, record = ?, error = NULL, lease_owner = NULL, "
+                "lease_expires = NULL, updated = ? WHERE id = ? AND state = 'in_flight' AND lease_owner = ?",
+                (outcome, json.dumps(record, ensure_ascii=False), time.time(), job_id, owner))
+            return cursor.rowcount == 1
+        return self._transaction(complete)
+
+    def fail(self, job_id, owner, error, record=None):
+        """Give the job back for another try, or mark it failed once out of attempts"""
+        def fail(db):
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ? AND state = 'in_flight' AND lease_owner = ?",
+                             (job_id, owner)).fetchone()
+            if row is None:
+                return None
+            state = "failed" if row[0] >= self.max_attempts else "pending"
+            db.execute("UPDATE jobs SET state = ?, outcome = ?, error = ?, record = ?, lease_owner = NULL, "
+                       "lease_expires = NULL, updated = ? WHERE id = ?",
+                       (state, "failed" if state == "failed" else None, error,
+                        json.dumps(record, ensure_ascii=False) if record is not None else None,
+                        time.time(), job_id))
+            return state
+        return self._transaction(fail)
+
+    def release(self, owner):
+        """Hand back owner's in-flight jobs without using up an attempt (clean shutdown)"""
+        def release(db):
+            return db.execute("UPDATE jobs SET state = 'pending', attempts = MAX(0, attempts - 1), "
+                              "lease_owner = NULL, lease_expires = NULL, updated = ? "
+                              "WHERE state = 'in_flight' AND lease_owner = ?", (time.time(), owner)).rowcount
+        return self._transaction(release)
+
+    def reclaim_dead_local(self):
+        """Expire the leases of workers on this host whose process has died"""
+        host = socket.gethostname()
+        def reclaim(db):
+            owners = [row[0] for row in db.execute(
+                "SELECT DISTINCT lease_owner FROM jobs WHERE state = 'in_flight' AND lease_owner LIKE ?",
+                (host + ":%",))]
+            reclaimed = 0
+            for owner in owners:
+                try:
+                    pid = int(owner.split(":")[-2])
+                except (IndexError, ValueError):
+                    continue
+                if pid != os.getpid() and not _pid_alive(pid):
+                    reclaimed += db.execute("UPDATE jobs SET lease_expires = 0 WHERE state = 'in_flight' "
+                                            "AND lease_owner = ?", (owner,)).rowcount
+            return reclaimed
+        return self._transaction(reclaim)
+
+    def retry_failed(self, include_fallback=True):
+        """Make failed (and fallback) jobs pending again with fresh attempts"""
+        condition = "state = 'failed'"
+        if include_fallback:
+            condition += " OR (state = 'done' AND outcome = 'fallback')"
+        def retry(db):
+            return db.execute(f"UPDATE jobs SET state = 'pending', outcome = NULL, attempts = 0, error = NULL, "
+                              f"updated = ? WHERE {condition}", (time.time(),)).rowcount
+        return self._transaction(retry)
+
+    def counts(self):
+        """{state: jobs}, plus "fallback" for done jobs that used the fallback"""
+        with self._lock:
+            counts = dict.fromkeys(STATES, 0)
+            counts.update(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            counts["fallback"] = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = 'done' AND outcome = 'fallback'").fetchone()[0]
+        return counts
+
+    def export(self, output):
+        """Write one JSON line per finished job to output (replaced atomically); returns the count"""
+        tmp_path = output + ".tmp"
+        written = 0
+        with self._lock:
+            rows = self._db.execute("SELECT record FROM jobs WHERE record IS NOT NULL "
+                                    "AND state IN ('done', 'failed') ORDER BY id")
+            with open(tmp_path, "w", encoding="utf-8") as out:
+                for (record,) in rows:
+                    out.write(record + "\n")
+                    written += 1
+        os.replace(tmp_path, output)
+        return written
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class QueueRunner:
+    """Workers that claim jobs from a JobQueue and analyze them until it is drained"""
+
+    def __init__(self, job_queue, provider, api_key, workers=4, use_cache=True,
+                 dedupe_distance=duplicate_index.DEFAULT_MAX_DISTANCE, hedge_settings=None, api_keys=None,
+                 progress=True):
+        self.jobs = job_queue
+        self.workers = workers
+        self.progress = progress
+        self._encode = make_encode_stage(provider)
+        self._submit = make_submit_stage(provider, api_key, use_cache, dedupe_distance, hedge_settings, api_keys)
+        self.stop_event = threading.Event()
+        # owner -> job id being worked on, for lease renewal
+        self._held = {}
+        self._held_lock = threading.Lock()
+        self.stats = {"analyzed": 0, "fallback": 0, "failed": 0, "retried": 0, "lost_leases": 0}
+        self._stats_lock = threading.Lock()
+
+    def run(self):
+        threads = [threading.Thread(target=self._work, args=(worker_id(i),), name=f"job-{i}", daemon=True)
+                   for i in range(self.workers)]
+        renewer = threading.Thread(target=self._renew_leases, name="job-leases", daemon=True)
+        for thread in threads:
+            thread.start()
+        renewer.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            print("⏸️ Stopping after the images in progress; run again to resume", file=sys.stderr)
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        self.stop_event.set()
+        renewer.join()
+        return self.stats
+
+    def _renew_leases(self):
+        interval = max(1.0, self.jobs.lease_seconds / 3)
+        while not self.stop_event.wait(interval):
+            with self._held_lock:
+                held = list(self._held.items())
+            for owner, job_id in held:
+                if not self.jobs.renew(owner, [job_id]):
+                    self._count("lost_leases")
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _work(self, owner):
+        try:
+            while not self.stop_event.is_set():
+                claimed = self.jobs.claim(owner)
+                if not claimed:
+                    counts = self.jobs.counts()
+                    if counts["pending"] == 0 and counts["in_flight"] == 0:
+                        return
+                    # Other workers still hold jobs; one may come back if its lease expires
+                    self.stop_event.wait(min(5.0, self.jobs.lease_seconds / 4))
+                    continue
+                job_id, path = claimed[0]
+                with self._held_lock:
+                    self._held[owner] = job_id
+                try:
+                    self._run_job(owner, job_id, path)
+                finally:
+                    with self._held_lock:
+                        self._held.pop(owner, None)
+        finally:
+            self.jobs.release(owner)
+
+    def _run_job(self, owner, job_id, path):
+        item = process_item(BatchItem(path), self._encode, self._submit)
+        outcome = item.outcome()
+        record = item.to_record()
+        if outcome == "failed":
+            state = self.jobs.fail(job_id, owner, item.error or "no result", record)
+            self._count("failed" if state == "failed" else "retried")
+        elif self.jobs.complete(job_id, owner, outcome, record):
+            self._count(outcome)
+        else:
+            # Reclaimed by another worker while this one was slow; its result counts
+            self._count("lost_leases")
+            return
+        if self.progress:
+            print(f"{'❌' if outcome == 'failed' else '✅'} {path}", file=sys.stderr)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Analyze a folder through a crash-safe job queue")
+    parser.add_argument("folder", help="Folder to scan (recursively) for images")
+    parser.add_argument("--db", required=True, help="Queue database; reuse it to resume the run")
+    parser.add_argument("--provider", default="chatgpt",
+                        choices=providers.provider_names() + ["fallback"])
+    parser.add_argument("--api-key", default=None, help="Overrides the key from .env")
+    parser.add_argument("--output", default="analysis_results.jsonl",
+                        help="JSON Lines file the results are exported to when the run ends")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent analyses")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                        help="Seconds before a job held by an unresponsive worker is handed out again")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="Tries per image before it is marked failed")
+    parser.add_argument("--rescan", action="store_true",
+                        help="Scan the folder again and queue images added since the first run")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Queue failed images, and images that got the fallback analysis, again")
+    parser.add_argument("--status", action="store_true", help="Print the queue counts and exit")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the provider, ignoring cached results")
+    parser.add_argument("--dedupe-distance", type=int, default=duplicate_index.DEFAULT_MAX_DISTANCE,
+                        help="Reuse the analysis of near-duplicates within this many bits (-1 disables)")
+    parser.add_argument("--quiet", action="store_true", help="No per-image progress lines")
+    return parser
+
+
+def _print_counts(counts):
+    print(f"📋 {counts['done']} done ({counts['fallback']} fallback), {counts['failed']} failed, "
+          f"{counts['pending']} pending, {counts['in_flight']} in flight")
+
+
+def main(argv=None):
+    keys = photo_analysis.load_environment()
+    args = build_arg_parser().parse_args(argv)
+    jobs = JobQueue(args.db, lease_seconds=max(10.0, args.lease), max_attempts=max(1, args.max_attempts))
+    if args.status:
+        _print_counts(jobs.counts())
+        return 0
+    if not os.path.isdir(args.folder):
+        print(f"Error: folder not found: {args.folder}", file=sys.stderr)
+        return 2
+
+    root = os.path.abspath(args.folder)
+    if jobs.get_meta("scanned") != root or args.rescan:
+        added = jobs.enqueue(scan_images(root))
+        jobs.set_meta("scanned", root)
+        print(f"📂 {added} images queued")
+    reclaimed = jobs.reclaim_dead_local()
+    if reclaimed:
+        print(f"♻️ {reclaimed} jobs reclaimed from an interrupted run")
+    if args.retry_failed:
+        print(f"🔁 {jobs.retry_failed()} failed or fallback jobs queued again")
+    _print_counts(jobs.counts())
+
+    api_key = args.api_key if args.api_key is not None else keys.get(args.provider, "")
+    hedge_settings = hedging.settings_from_env()
+    workers = max(1, args.workers)
+    provider_client.configure_client(pool_maxsize=workers * (2 if hedge_settings.hedge_providers else 1))
+    runner = QueueRunner(jobs, args.provider, api_key,
+                         workers=workers,
+                         use_cache=not args.no_cache,
+                         dedupe_distance=args.dedupe_distance if args.dedupe_distance >= 0 else None,
+                         hedge_settings=hedge_settings,
+                         api_keys=keys,
+                         progress=not args.quiet)
+    stats = runner.run()
+    print(f"📊 This run: {stats['analyzed']} analyzed, {stats['fallback']} fallback, {stats['failed']} failed, "
+          f"{stats['retried']} retried")
+    _print_counts(jobs.counts())
+    written = jobs.export(args.output)
+    print(f"💾 {written} results exported to {args.output}")
+    jobs.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
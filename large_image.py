@@ -0,0 +1,259 @@
+"""Memory-bounded decoding of very large images.
+
+A 30000x30000 scan is 900 MP: Pillow refuses to open it (its
+decompression-bomb guard stops at ~179 MP) and a full decode would need
+3.6 GB. Everything that reads pixels (preview, thumbnails, upload, the
+fallback features and the perceptual hash) only needs a small copy, so
+``load_within_budget`` produces that copy without ever holding the whole
+raster:
+
+  * JPEG      the decoder's DCT scaling (draft mode) shrinks by up to 8x
+              while decoding
+  * raw       uncompressed TIFF, BMP, PPM/PGM and other raw-tile rasters
+              are decoded in horizontal bands of ``STRIP_BYTES`` each,
+              box-filtered down and pasted into the result
+  * others    compressed single-stream formats (PNG, WebP, LZW/Deflate
+              TIFF) can't be decoded in parts; they are decoded whole when
+              the raster fits the decode budget and refused otherwise
+
+Oversized inputs raise ImageTooLargeError with the reason, instead of
+failing deep inside Pillow or exhausting memory. ``open_image`` replaces
+Pillow's bomb guard with the explicit ``MAX_PIXELS`` limit, so every path
+that opens user images should go through it.
+
+Limits can be changed in .env: MAX_IMAGE_PIXELS, and MAX_DECODE_MB to
+lower the decode budget below ``FULL_DECODE_BYTES``.
+"""
+import io
+import os
+import math
+import threading
+
+# Most memory a whole-image decode may take, whatever MAX_DECODE_MB says
+FULL_DECODE_BYTES = 256 * 1024 * 1024
+
+# Size of one band when decoding in strips
+STRIP_BYTES = 32 * 1024 * 1024
+
+DEFAULT_MAX_PIXELS = 2_000_000_000
+DEFAULT_MAX_DECODE_MB = 256
+
+# EXIF orientation -> Image.Transpose member name
+_ORIENTATION_TRANSPOSE = {
+    2: "FLIP_LEFT_RIGHT",
+    3: "ROTATE_180",
+    4: "FLIP_TOP_BOTTOM",
+    5: "TRANSPOSE",
+    6: "ROTATE_270",
+    7: "TRANSVERSE",
+    8: "ROTATE_90",
+}
+
+# Pillow's guard is a module global; swap it only while holding this lock
+_open_lock = threading.Lock()
+
+
+class ImageTooLargeError(ValueError):
+    """The image can't be processed within the configured limits"""
+
+
+def _env_number(name, default):
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def max_pixels():
+    return int(_env_number("MAX_IMAGE_PIXELS", DEFAULT_MAX_PIXELS))
+
+
+def max_decode_bytes():
+    """Budget for decoding a whole image: MAX_DECODE_MB, capped at FULL_DECODE_BYTES"""
+    return min(FULL_DECODE_BYTES, int(_env_number("MAX_DECODE_MB", DEFAULT_MAX_DECODE_MB) * 1024 * 1024))
+
+
+def raster_bytes(size, mode):
+    """Bytes Pillow needs to hold a decoded image of this size and mode"""
+    width, height = size
+    if mode in ("1", "L", "P"):
+        per_pixel = 1
+    elif mode.startswith("I;16"):
+        per_pixel = 2
+    else:
+        # Multi-band images are stored 4 bytes per pixel
+        per_pixel = 4
+    return width * height * per_pixel
+
+
+def open_image(fp):
+    """Image.open with MAX_PIXELS instead of Pillow's decompression-bomb guard"""
+    from PIL import Image
+    with _open_lock:
+        guard = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            img = Image.open(fp)
+        finally:
+            Image.MAX_IMAGE_PIXELS = guard
+    width, height = img.size
+    limit = max_pixels()
+    if width * height > limit:
+        img.close()
+        raise ImageTooLargeError(f"{width}×{height} is {width * height / 1e6:,.0f} MP; "
+                                 f"the limit is {limit / 1e6:,.0f} MP (MAX_IMAGE_PIXELS)")
+    return img
+
+
+def apply_orientation(image, orientation):
+    """Rotate/flip image for an EXIF orientation value (1 = as stored)"""
+    from PIL import Image
+    method = _ORIENTATION_TRANSPOSE.get(orientation)
+    return image.transpose(getattr(Image.Transpose, method)) if method else image
+
+
+def _raw_bits(rawmode):
+    """Bits per pixel of a raw-decoder mode such as "RGB", "BGR;24", "I;16B", "1;I", or None"""
+    base, _, suffix = rawmode.partition(";")
+    if base == "1":
+        return 1
+    if suffix[:2].isdigit():
+        return int(suffix[:2])
+    if suffix[:1].isdigit():
+        # "P;4", "L;2": packed pixels; "RGB;16" etc. would have matched above
+        return int(suffix[:1])
+    if base in ("I", "F"):
+        return 32
+    if base.isalpha() and base.isupper():
+        return 8 * len(base)
+    return None
+
+
+def _raw_tiles(img):
+    """[(x0, y0, x1, y1, offset, rawmode, stride, orientation)] if every tile is raw, else None"""
+    tiles = []
+    for tile in img.tile:
+        name, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if name != "raw" or extents is None:
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        x0, y0, x1, y1 = extents
+        if not stride:
+            bits = _raw_bits(rawmode)
+            if bits is None:
+                return None
+            stride = ((x1 - x0) * bits + 7) // 8
+        tiles.append((x0, y0, x1, y1, offset, rawmode, stride, orientation))
+    return tiles or None
+
+
+def _open_source(source):
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else open(source, "rb")
+
+
+def _decode_band(img, source_file, tiles, band_top, band_bottom):
+    """Rows band_top..band_bottom of img, decoded from its raw tiles with Image.frombytes"""
+    from PIL import Image
+    width = img.size[0]
+    band = None
+    for x0, y0, x1, y1, offset, rawmode, stride, orientation in tiles:
+        top, bottom = max(y0, band_top), min(y1, band_bottom)
+        if top >= bottom:
+            continue
+        if orientation < 0:
+            # Stored bottom-up: the band's last row comes first
+            start = offset + (y1 - bottom) * stride
+        else:
+            start = offset + (top - y0) * stride
+        source_file.seek(start)
+        piece = Image.frombytes(img.mode, (x1 - x0, bottom - top), source_file.read((bottom - top) * stride),
+                                "raw", rawmode, stride, orientation)
+        if piece.size == (width, band_bottom - band_top):
+            # One tile covers the whole band (strip-organized files)
+            band = piece
+            continue
+        if band is None:
+            band = Image.new(img.mode, (width, band_bottom - band_top))
+        band.paste(piece, (x0, top - band_top))
+    if img.mode == "P" and img.palette is not None:
+        palette_mode, palette = img.palette.getdata()
+        band.putpalette(palette, palette_mode)
+    if "transparency" in img.info:
+        band.info["transparency"] = img.info["transparency"]
+    return band
+
+
+def _band_mode(band):
+    """Convert modes that can't be box-filtered"""
+    if band.mode == "P":
+        return band.convert("RGBA" if "transparency" in band.info else "RGB")
+    if band.mode == "1":
+        return band.convert("L")
+    if band.mode.startswith("I;16"):
+        return band.convert("I")
+    if band.mode in ("CMYK", "YCbCr", "LAB", "HSV"):
+        return band.convert("RGB")
+    return band
+
+
+def reduce_in_strips(img, source, max_edge, strip_bytes=STRIP_BYTES):
+    """Image fitting a max_edge square, decoded band by band from raw tiles
+
+    ``source`` is the path (or bytes) img was opened from; each band is
+    read from it and decoded on its own, so only one band is in memory at a
+    time.
+    """
+    from PIL import Image
+    tiles = _raw_tiles(img)
+    if tiles is None:
+        raise ValueError("image has no raw tiles")
+    width, height = img.size
+    scale = min(1.0, max_edge / max(width, height))
+    out_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    rows = max(1, strip_bytes // max(1, raster_bytes((width, 1), img.mode)))
+
+    # Whole output rows per band, each resized from exactly the source rows it
+    # covers, so the result matches one BOX resize of the full image
+    out_rows = max(1, rows * out_size[1] // height)
+    reduced = None
+    with _open_source(source) as source_file:
+        for out_top in range(0, out_size[1], out_rows):
+            out_bottom = min(out_size[1], out_top + out_rows)
+            source_top = out_top * height / out_size[1]
+            source_bottom = out_bottom * height / out_size[1]
+            band_top, band_bottom = int(source_top), min(height, math.ceil(source_bottom))
+            band = _band_mode(_decode_band(img, source_file, tiles, band_top, band_bottom))
+            if reduced is None:
+                reduced = Image.new(band.mode, out_size)
+            reduced.paste(band.resize((out_size[0], out_bottom - out_top), Image.Resampling.BOX,
+                                      box=(0, source_top - band_top, width, source_bottom - band_top)),
+                          (0, out_top))
+    return reduced
+
+
+def load_within_budget(img, source, max_edge):
+    """Decoded pixels of img, reduced towards max_edge if it is too big to decode whole
+
+    Returns img itself (loaded, possibly JPEG-drafted) when it fits in
+    memory, else a new, smaller image; the caller applies the EXIF
+    orientation of img to the latter. Raises ImageTooLargeError when
+    neither works within the limits.
+    """
+    if img.format == "JPEG" and max(img.size) > max_edge:
+        img.draft("RGB", (max_edge, max_edge))
+    needed = raster_bytes(img.size, img.mode)
+    if needed > STRIP_BYTES and max(img.size) > max_edge and _raw_tiles(img) is not None:
+        # As fast as a full decode for raw data, and bounded
+        return reduce_in_strips(img, source, max_edge)
+    budget = max_decode_bytes()
+    if needed <= budget:
+        img.load()
+        return img
+    width, height = img.size
+    raise ImageTooLargeError(f"{width}×{height} {img.format or ''} needs {needed / 1024 ** 2:,.0f} MB to decode "
+                             f"and can't be read in strips; the limit is {budget / 1024 ** 2:,.0f} MB "
+                             f"(MAX_DECODE_MB)")
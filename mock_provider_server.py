@@ -0,0 +1,365 @@
+"""Local stand-in for the analysis providers.
+
+Speaks just enough of the OpenAI chat completions API and the
+ImageDescriber describe-image API to drive the app, the batch analyzer and
+load tests without network access, API keys or cost. Latency, jitter,
+error rate, tail stalls and rate limiting are configurable so client behaviour under
+slow or failing backends can be reproduced.
+
+Requests with several images get one "### Image N" section per image, as
+request_packing asks for; ``--pack-error-rate`` drops a section so the
+client's per-image fallback can be exercised. Requests with a json_schema
+``response_format`` get a structured_output style JSON answer, from the
+chat endpoint and in batches alike.
+
+The OpenAI Batch API is emulated too (``/v1/files``, ``/v1/batches``):
+batches move from validating to in_progress to completed over
+``--batch-delay`` seconds, and ``--error-rate`` fails individual requests
+in the error file.
+
+Usage:
+    python mock_provider_server.py --port 8080 --latency 800 --jitter 200
+
+then point the app at it (``.env`` works too):
+
+    OPENAI_BASE_URL=http://127.0.0.1:8080/v1
+    IMAGEDESCRIBER_URL=http://127.0.0.1:8080/api/openapi-v2/describe-image
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from provider_retry import TokenBucket
+
+DESCRIPTION = """Summary: A placeholder description returned by the local mock provider.
+
+Detailed Description:
+
+Setting: The image was received by a test server; no real analysis was performed.
+
+Colors and Lighting: Not evaluated.
+
+Atmosphere and Mood: Useful for exercising the app without network access."""
+
+
+def describe(options, received):
+    text = DESCRIPTION + f"\n\n(Request body: {received} bytes)"
+    if options.payload_size > len(text):
+        text += "\n" + "x" * (options.payload_size - len(text) - 1)
+    return text
+
+
+def count_images(request):
+    """Number of image_url parts in a chat completions request"""
+    count = 0
+    for message in request.get("messages") or ():
+        content = message.get("content")
+        if isinstance(content, list):
+            count += sum(1 for part in content if isinstance(part, dict) and part.get("type") == "image_url")
+    return count
+
+
+def describe_pack(options, received, count):
+    """One "### Image N" section per image, as the packed prompt asks"""
+    numbers = list(range(1, count + 1))
+    if options.pack_error_rate and random.random() < options.pack_error_rate:
+        # An answer the client can't split: a section is missing
+        numbers.pop()
+    return "\n\n".join(f"### Image {number}\n" + describe(options, received // count) for number in numbers)
+
+
+def describe_structured(images):
+    """JSON answer for a request with a json_schema response_format"""
+    record = {"summary": "A placeholder description returned by the local mock provider.",
+              "people": "", "setting": "The image was received by a test server.",
+              "objects": "None analyzed.", "background": "Not evaluated.", "foreground": "Not evaluated.",
+              "colors": "Not evaluated.", "mood": "Useful for exercising the app without network access."}
+    if images > 1:
+        return json.dumps({"images": [record] * images})
+    return json.dumps(record)
+
+
+def answer(options, request, received):
+    """Answer text for a chat completions request body: structured, packed or plain"""
+    images = count_images(request)
+    if (request.get("response_format") or {}).get("type") == "json_schema":
+        return describe_structured(images)
+    if images > 1:
+        return describe_pack(options, received, images)
+    return describe(options, received)
+
+
+def chat_completion(model, text, body_size):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": body_size // 4, "completion_tokens": len(text) // 4,
+                  "total_tokens": (body_size + len(text)) // 4},
+    }
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """Threaded server holding the mock Batch API state"""
+
+    daemon_threads = True
+
+    def __init__(self, options):
+        super().__init__((options.host, options.port), MockProviderHandler)
+        self.options = options
+        self.bucket = TokenBucket(options.rate_limit) if options.rate_limit > 0 else None
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+
+    def store_file(self, data, filename, purpose):
+        file_id = f"file-{next(self.ids):06d}"
+        self.files[file_id] = {"data": data, "filename": filename, "purpose": purpose}
+        return {"id": file_id, "object": "file", "bytes": len(data), "filename": filename,
+                "purpose": purpose, "created_at": int(time.time())}
+
+    def process_batch(self, batch):
+        """Answer every request of a batch after --batch-delay seconds"""
+        delay = self.options.batch_delay
+        time.sleep(delay / 3)
+        lines = self.files[batch["input_file_id"]]["data"].splitlines()
+        batch["status"] = "in_progress"
+        batch["request_counts"]["total"] = len(lines)
+        time.sleep(delay / 3)
+        outputs, errors = [], []
+        for line in lines:
+            request = json.loads(line)
+            custom_id = request.get("custom_id")
+            if self.options.error_rate and random.random() < self.options.error_rate:
+                errors.append({"id": f"req_{next(self.ids)}", "custom_id": custom_id,
+                               "response": {"status_code": 500, "body": {
+                                   "error": {"message": "Injected server error", "type": "server_error"}}},
+                               "error": None})
+                batch["request_counts"]["failed"] += 1
+                continue
+            body = request.get("body") or {}
+            text = answer(self.options, body, len(line))
+            outputs.append({"id": f"req_{next(self.ids)}", "custom_id": custom_id, "error": None,
+                            "response": {"status_code": 200, "body": chat_completion(
+                                body.get("model", self.options.model), text, len(line))}})
+            batch["request_counts"]["completed"] += 1
+        time.sleep(delay / 3)
+        if outputs:
+            batch["output_file_id"] = self.store_file(
+                "\n".join(json.dumps(o) for o in outputs).encode("utf-8"), "output.jsonl", "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self.store_file(
+                "\n".join(json.dumps(e) for e in errors).encode("utf-8"), "errors.jsonl", "batch_output")["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    server_version = "MockProvider/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if not self.server.options.quiet:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, model, text):
+        """Server-sent events, one chunk per word, as chat completions streaming does"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        delay = self.server.options.token_delay / 1000
+        pieces = text.split(" ")
+        for index, word in enumerate(pieces):
+            content = word if index == len(pieces) - 1 else word + " "
+            write_event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                                    "choices": [{"index": 0, "delta": {"content": content},
+                                                 "finish_reason": None}]}))
+            if delay:
+                time.sleep(delay)
+        write_event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def description(self, received):
+        return describe(self.server.options, received)
+
+    def simulate(self):
+        """Apply rate limit, latency and injected errors; True if a response was sent"""
+        options = self.server.options
+        if self.server.bucket is not None:
+            wait = self.server.bucket.try_acquire()
+            if wait:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                               {"Retry-After": f"{wait:.2f}"})
+                return True
+        delay = options.latency + random.uniform(-options.jitter, options.jitter)
+        if options.tail_rate and random.random() < options.tail_rate:
+            delay = options.tail_latency
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if options.error_rate and random.random() < options.error_rate:
+            self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return True
+        return False
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        parts = path.split("/")
+        if path == "/v1/models":
+            self.send_json(200, {"object": "list", "data": [{"id": self.server.options.model, "object": "model"}]})
+        elif path.startswith("/v1/batches/") and len(parts) == 4:
+            batch = self.server.batches.get(parts[3])
+            if batch is None:
+                self.send_json(404, {"error": {"message": f"No batch {parts[3]}"}})
+            else:
+                self.send_json(200, batch)
+        elif path.startswith("/v1/files/") and len(parts) == 5 and parts[4] == "content":
+            stored = self.server.files.get(parts[3])
+            if stored is None:
+                self.send_json(404, {"error": {"message": f"No file {parts[3]}"}})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(stored["data"])))
+            self.end_headers()
+            self.wfile.write(stored["data"])
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def upload_file(self, body):
+        """POST /v1/files with a multipart "file" and "purpose" """
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode("latin-1") + b"\r\n\r\n" + body)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = (
+                part.get_filename(), part.get_payload(decode=True))
+        if "file" not in fields:
+            self.send_json(400, {"error": {"message": "Missing file field"}})
+            return
+        filename, data = fields["file"]
+        purpose = (fields.get("purpose") or (None, b"batch"))[1].decode("utf-8")
+        self.send_json(200, self.server.store_file(data, filename, purpose))
+
+    def create_batch(self, body):
+        request = json.loads(body or b"{}")
+        if request.get("input_file_id") not in self.server.files:
+            self.send_json(400, {"error": {"message": "Unknown input_file_id"}})
+            return
+        batch_id = f"batch_{next(self.server.ids):06d}"
+        batch = {"id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+                 "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window"),
+                 "status": "validating", "output_file_id": None, "error_file_id": None,
+                 "created_at": int(time.time()), "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        self.server.batches[batch_id] = batch
+        threading.Thread(target=self.server.process_batch, args=(batch,), daemon=True).start()
+        self.send_json(200, batch)
+
+    def do_POST(self):
+        body = self.read_body()
+        path = self.path.rstrip("/")
+        if path == "/v1/files":
+            self.upload_file(body)
+        elif path == "/v1/batches":
+            self.create_batch(body)
+        elif path == "/v1/chat/completions":
+            if self.simulate():
+                return
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                self.send_json(400, {"error": {"message": "Body is not valid JSON"}})
+                return
+            text = answer(self.server.options, request, len(body))
+            if request.get("stream"):
+                self.send_stream(request.get("model", self.server.options.model), text)
+                return
+            self.send_json(200, chat_completion(request.get("model", self.server.options.model), text, len(body)))
+        elif path == "/api/openapi-v2/describe-image":
+            if self.simulate():
+                return
+            self.send_json(200, {"code": 0, "data": {"content": self.description(len(body))}})
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI and ImageDescriber APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="mock-vision", help="Model id reported by /v1/models")
+    parser.add_argument("--latency", type=float, default=0, help="Added response time in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Random +/- ms added to the latency")
+    parser.add_argument("--tail-rate", type=float, default=0,
+                        help="Share of requests that stall for --tail-latency instead")
+    parser.add_argument("--tail-latency", type=float, default=5000, help="Stall time in ms for tail requests")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Requests per second before answering 429 with Retry-After (0 = unlimited)")
+    parser.add_argument("--token-delay", type=float, default=20,
+                        help="ms between streamed chunks when the client asks for stream=true")
+    parser.add_argument("--batch-delay", type=float, default=3,
+                        help="Seconds a submitted batch takes to complete")
+    parser.add_argument("--payload-size", type=int, default=0,
+                        help="Pad descriptions to this many characters")
+    parser.add_argument("--pack-error-rate", type=float, default=0,
+                        help="Share of multi-image answers that leave out an image's section")
+    parser.add_argument("--quiet", action="store_true", help="No request log")
+    return parser
+
+
+def make_server(options):
+    return MockProviderServer(options)
+
+
+def main(argv=None):
+    options = build_arg_parser().parse_args(argv)
+    server = make_server(options)
+    host, port = server.server_address[:2]
+    print(f"🧪 Mock provider listening on http://{host}:{port}")
+    print(f"   OPENAI_BASE_URL=http://{host}:{port}/v1")
+    print(f"   IMAGEDESCRIBER_URL=http://{host}:{port}/api/openapi-v2/describe-image")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Streaming JSON request bodies for image payloads.
+
+Building a chat completion body the obvious way keeps the image in memory
+several times over: the raw bytes, the base64 bytes, the decoded str, the
+data URL f-string and finally the serialized JSON. ``StreamingJSONBody``
+instead serializes the JSON around a placeholder once, then yields
+
+    <json prefix> <base64 chunks of the image buffer> <json suffix>
+
+encoding one small slice of the (memory-mapped or re-encoded) image at a
+time. It has a ``__len__``, so requests sends a plain Content-Length body
+rather than chunked transfer encoding.
+"""
+import json
+import base64
+
+# Raw bytes per base64 chunk; a multiple of 3 so chunks concatenate cleanly
+CHUNK_SIZE = 3 * 16 * 1024
+
+_PLACEHOLDER = "\x00IMAGE_DATA\x00"
+
+
+def base64_length(size):
+    return 4 * ((size + 2) // 3)
+
+
+class StreamingJSONBody:
+    """Iterable HTTP body with image buffers base64-encoded on the fly
+
+    ``texts`` are the JSON pieces around the images: one more than
+    ``buffers``, as in text, image, text, image, text.
+    """
+
+    def __init__(self, texts, buffers, chunk_size=CHUNK_SIZE):
+        if len(texts) != len(buffers) + 1:
+            raise ValueError("need one more text piece than image buffers")
+        self.texts = texts
+        self.buffers = buffers
+        self.chunk_size = chunk_size - chunk_size % 3
+
+    def __len__(self):
+        return sum(len(text) for text in self.texts) + sum(base64_length(len(b)) for b in self.buffers)
+
+    def __iter__(self):
+        for text, buffer in zip(self.texts, self.buffers):
+            yield text
+            view = memoryview(buffer)
+            try:
+                for offset in range(0, len(view), self.chunk_size):
+                    yield base64.b64encode(view[offset:offset + self.chunk_size])
+            finally:
+                view.release()
+        yield self.texts[-1]
+
+
+def build_json_body(payload, buffer, chunk_size=CHUNK_SIZE):
+    """Serialize payload, splicing the base64 of buffer in at IMAGE_DATA
+
+    ``payload`` must contain exactly one string that includes the
+    ``IMAGE_DATA`` marker, e.g. ``f"data:image/png;base64,{IMAGE_DATA}"``.
+    """
+    return build_packed_json_body(payload, [buffer], chunk_size)
+
+
+def build_packed_json_body(payload, buffers, chunk_size=CHUNK_SIZE):
+    """Like build_json_body for several images: the n-th IMAGE_DATA marker gets buffers[n]"""
+    serialized = json.dumps(payload, ensure_ascii=False)
+    marker = json.dumps(_PLACEHOLDER)[1:-1]
+    texts = serialized.split(marker)
+    if len(texts) != len(buffers) + 1:
+        raise ValueError(f"payload must contain the image marker exactly {len(buffers)} times")
+    return StreamingJSONBody([text.encode("utf-8") for text in texts], list(buffers), chunk_size)
+
+
+IMAGE_DATA = _PLACEHOLDER
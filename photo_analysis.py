@@ -0,0 +1,544 @@
+"""Analysis core shared by the desktop app and the headless tools.
+
+Nothing in this module touches Tk, so every function here is safe to call
+from worker threads, batch runs and servers. Pillow and requests are only
+imported when an image is first decoded or a provider first called, which
+keeps the desktop app's cold start short.
+"""
+import os
+import sys
+import time
+import threading
+
+from dotenv import load_dotenv
+
+from provider_client import get_client
+import providers
+from provider_retry import ProviderError, Deadline
+import hedging
+from stage_metrics import StageTimes, get_metrics
+from providers import ANALYSIS_PROMPT, format_imagedescriber_text
+import result_cache
+import duplicate_index
+import structured_output
+
+FALLBACK_NAME = "Fallback Analysis (Basic)"
+
+CACHE_SOURCE_LABELS = {
+    "memory": "⚡ Cached (memory)",
+    "disk": "⚡ Cached (disk)",
+    "shared": "⚡ Shared in-flight request",
+    "duplicate": "♻️ Reused near-duplicate analysis",
+}
+
+# Why the provider could not be used, shown next to fallback results
+ERROR_LABELS = {
+    "auth": "missing or rejected API key",
+    "quota": "API quota exhausted",
+    "rate_limit": "rate limited",
+    "server": "provider server error",
+    "timeout": "request timed out",
+    "connection": "provider unreachable",
+    "bad_request": "request rejected",
+    "bad_response": "unreadable provider response",
+    "deadline": "analysis deadline exceeded",
+    "circuit_open": "skipped after repeated failures",
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.webp')
+
+
+def load_environment():
+    """Load .env (robust to bad encodings or missing file) and return API keys"""
+    try:
+        dotenv_path = os.path.join(os.getcwd(), ".env")
+        if os.path.exists(dotenv_path):
+            load_dotenv(dotenv_path=dotenv_path, encoding="utf-8")
+        else:
+            load_dotenv(encoding="utf-8")
+    except Exception:
+        # Ignore dotenv read errors so the app can still run
+        pass
+    # Endpoints and extra backends may come from .env as well
+    providers.configure_from_env()
+    return {provider.name: provider.default_api_key() for provider in providers.all_providers()}
+
+
+def app_data_dir():
+    """Directory for caches and local stores (override with PHOTO_ANALYZER_HOME)"""
+    path = os.getenv("PHOTO_ANALYZER_HOME") or os.path.join(os.path.expanduser("~"), ".ai_photo_analyzer")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_image_file(path):
+    """True if the path has one of the supported image extensions"""
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def read_image_bytes(image_path):
+    """Read the raw bytes of an image file"""
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+
+def analyze_with_provider(provider, image_path, api_key, upload=None):
+    """Description text from a registered provider, or an "Error: ..." string"""
+    try:
+        return providers.get_provider(provider).analyze(image_path, api_key, upload)
+    except ProviderError as e:
+        return e.message
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def analyze_with_chatgpt(image_path, api_key, upload=None):
+    """Analyze image using ChatGPT (OpenAI GPT-4 Vision API)"""
+    return analyze_with_provider("chatgpt", image_path, api_key, upload)
+
+
+def analyze_with_imagedescriber(image_path, api_key, upload=None):
+    """Analyze image using ImageDescriber.online API"""
+    return analyze_with_provider("imagedescriber", image_path, api_key, upload)
+
+
+def analyze_image_fallback(image_path):
+    """Fallback analysis from local image features (no network needed)"""
+    # Pillow loads on first use, so importing this module stays cheap
+    from image_features import extract_features, describe_features
+    try:
+        features = extract_features(image_path)
+        width, height = features.width, features.height
+        mode = features.mode
+        format_name = features.format or "Unknown"
+        file_size = os.path.getsize(image_path)
+
+        # Basic content analysis
+        aspect_ratio = width / height
+        if aspect_ratio > 1.5:
+            orientation = "landscape orientation"
+        elif aspect_ratio < 0.7:
+            orientation = "portrait orientation"
+        else:
+            orientation = "square orientation"
+
+        # File size analysis
+        megapixels = width * height / 1_000_000
+        if file_size > 5 * 1024 * 1024:
+            quality_note = "high resolution image"
+        elif file_size > 1 * 1024 * 1024:
+            quality_note = "good quality image"
+        else:
+            quality_note = "standard quality image"
+
+        visual_lines = "\n".join(describe_features(features))
+
+        description = f"""📊 Technical Analysis:
+• Dimensions: {width} × {height} pixels ({megapixels:.1f} MP)
+• Format: {format_name} ({mode} mode)
+• File Size: {file_size / 1024:.1f} KB
+
+🖼️ Visual Assessment:
+• This is a {quality_note}
+• Image has {orientation}
+• Aspect ratio: {aspect_ratio:.2f}
+{visual_lines}
+
+📝 Basic Description:
+This summary was computed locally from the image's colors, exposure, focus and texture. It does not identify objects or scenes.
+
+💡 For full AI-powered analysis with object recognition, scene understanding, and detailed descriptions, ensure your OpenAI API key is properly configured."""
+
+        return description
+
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+class DeltaBuffer:
+    """Collects streamed answer pieces on a worker thread for the UI to pick up
+
+    Pass ``push`` as analyze_image's ``on_delta``; the UI thread calls
+    ``drain`` on a timer so it inserts text in batches, not per token.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._read = 0
+        self._restarted = False
+
+    def push(self, text):
+        with self._lock:
+            if text is None:
+                self._chunks = []
+                self._read = 0
+                self._restarted = True
+            else:
+                self._chunks.append(text)
+
+    def drain(self):
+        """(restarted, text added since the last drain)"""
+        with self._lock:
+            text = "".join(self._chunks[self._read:])
+            self._read = len(self._chunks)
+            restarted, self._restarted = self._restarted, False
+        return restarted, text
+
+    def text(self):
+        """Everything received so far; marks it all as read"""
+        with self._lock:
+            self._read = len(self._chunks)
+            self._restarted = False
+            return "".join(self._chunks)
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self._chunks)
+
+
+class AnalysisResult:
+    """Outcome of one analysis: the text plus where it came from"""
+
+    def __init__(self, image_path, provider, text, is_fallback=False, elapsed=0.0, cache_source=None,
+                 duplicate_of=None, duplicate_distance=None, error=None, hedged=False, ttft=None, stages=None):
+        self.image_path = image_path
+        self.provider = provider
+        self.text = text
+        self.is_fallback = is_fallback
+        self.elapsed = elapsed
+        self.cache_source = cache_source
+        self.duplicate_of = duplicate_of
+        self.duplicate_distance = duplicate_distance
+        # ProviderError that sent this result to the fallback, if any
+        self.error = error
+        # True if a backup provider was raced against (or replaced) the primary
+        self.hedged = hedged
+        # Seconds until the first streamed token, when the answer was streamed
+        self.ttft = ttft
+        # stage_metrics.StageTimes of the work done for this result
+        self.stages = stages
+        # structured_output.PhotoDescription when the answer is structured;
+        # text then holds it rendered under the usual headings
+        self.record = None if is_fallback else structured_output.try_parse(text)
+        if self.record is not None:
+            self.text = self.record.to_text()
+
+    @property
+    def stored_text(self):
+        """The answer as cached: compact JSON for structured answers"""
+        return self.record.to_json() if self.record is not None else self.text
+
+    @property
+    def generated_by(self):
+        backend = providers.get_provider(self.provider)
+        if self.is_fallback or backend is None:
+            return FALLBACK_NAME
+        return backend.display_name
+
+    @property
+    def service_tag(self):
+        tag = "\n\n" + "="*50 + f"\n🤖 Generated by: {self.generated_by}"
+        if self.cache_source:
+            tag += f" • {CACHE_SOURCE_LABELS[self.cache_source]}"
+        if self.duplicate_of:
+            tag += f"\n♻️ Near-duplicate of: {os.path.basename(self.duplicate_of)} (distance {self.duplicate_distance})"
+        if self.ttft is not None:
+            tag += f"\n⏱️ First token after {self.ttft:.2f}s, complete after {self.elapsed:.2f}s"
+        if self.hedged and not self.is_fallback:
+            tag += f"\n🏁 Hedged request: first answer came from {self.generated_by}"
+        if self.error is not None:
+            tag += f"\n⚠️ Provider unavailable: {self.error_summary}"
+        return tag
+
+    @property
+    def error_summary(self):
+        if self.error is None:
+            return None
+        summary = ERROR_LABELS.get(self.error.kind, self.error.kind)
+        if self.error.status:
+            summary += f" (HTTP {self.error.status})"
+        if self.error.attempts > 1:
+            summary += f" after {self.error.attempts} attempts"
+        return summary
+
+    def to_dict(self):
+        return {
+            "path": self.image_path,
+            "provider": self.provider,
+            "generated_by": self.generated_by,
+            "fallback": self.is_fallback,
+            "cache": self.cache_source,
+            "hedged": self.hedged,
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "duplicate_of": self.duplicate_of,
+            "elapsed": round(self.elapsed, 3),
+            "stages_ms": self.stages.to_dict() if self.stages else None,
+            "provider_error": self.error.to_dict() if self.error is not None else None,
+            "analysis": self.record.to_dict() if self.record is not None else None,
+            "result": self.text,
+        }
+
+
+def _analyze_uncached(image_path, provider, api_key, upload, started, deadline=None, hedge=None,
+                      hedge_percentile=hedging.DEFAULT_PERCENTILE, on_delta=None, stages=None):
+    if stages is None:
+        stages = StageTimes()
+    backend = providers.get_provider(provider)
+    error = None
+    if backend is not None:
+        try:
+            if hedge is not None:
+                winner, text, hedged = hedging.hedged_analyze(image_path, provider, api_key, hedge[0], hedge[1],
+                                                              upload, deadline, hedge_percentile, on_delta, stages)
+                return AnalysisResult(image_path, winner, text, False, time.perf_counter() - started,
+                                      hedged=hedged)
+            text = backend.analyze(image_path, api_key, upload, deadline, on_delta, stages)
+            return AnalysisResult(image_path, provider, text, False, time.perf_counter() - started)
+        except ProviderError as e:
+            error = e
+        except Exception as e:
+            error = ProviderError("bad_request", f"Error: {str(e)}")
+    with stages.span("fallback"):
+        text = analyze_image_fallback(image_path)
+    return AnalysisResult(image_path, provider, text, True, time.perf_counter() - started, error=error,
+                          hedged=hedge is not None and backend is not None)
+
+
+def analyze_image(image_path, provider, api_key, upload=None, use_cache=True,
+                  dedupe_distance=duplicate_index.DEFAULT_MAX_DISTANCE, deadline=None, hedge=None,
+                  hedge_percentile=hedging.DEFAULT_PERCENTILE, on_delta=None, store_result=True):
+    """Run one analysis with the selected provider, dropping to the fallback on failure
+
+    ``upload`` is an already prepared EncodedImage (see image_encoding);
+    when omitted the image is prepared here.
+
+    Provider results are served from the result cache when the same image
+    was analyzed before with the same prompt and model. Fallback results
+    are never cached, so a later call retries the provider.
+
+    On a cache miss, an image whose perceptual hash is within
+    ``dedupe_distance`` bits of an already analyzed one reuses that
+    analysis (pass None to always call the provider).
+
+    ``deadline`` (seconds or a provider_retry.Deadline) bounds the whole
+    call, retries included. ``hedge`` is an optional (provider, api_key)
+    backup that is raced against a slow primary; see hedging.
+
+    ``on_delta`` receives the answer piece by piece while a streaming
+    provider writes it (None means a retry started over); the result
+    records the time to the first piece as ``ttft``.
+
+    The result's ``stages`` break the time down by stage (see
+    stage_metrics), and every call is counted in the process metrics.
+
+    With ``store_result`` the analysis is kept in the search index (see
+    search_index), so it can be found again after the window is cleared.
+    """
+    stages = StageTimes()
+    if upload is not None:
+        # Prepared by the caller, but still part of this analysis
+        stages.add_timings(upload.timings)
+    result = _analyze_image(image_path, provider, api_key, upload, use_cache, dedupe_distance, deadline,
+                            hedge, hedge_percentile, on_delta, stages)
+    result.stages = stages
+    get_metrics().record_analysis(result)
+    if store_result:
+        index_result(result)
+    return result
+
+
+def index_result(result):
+    """Add result to the search index; a failure there must not lose the analysis"""
+    import sqlite3
+    import search_index
+    try:
+        search_index.get_index().add_result(result)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Could not index the analysis of {result.image_path}: {e}", file=sys.stderr)
+
+
+def _analyze_image(image_path, provider, api_key, upload, use_cache, dedupe_distance, deadline, hedge,
+                   hedge_percentile, on_delta, stages):
+    started = time.perf_counter()
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    backend = providers.get_provider(provider)
+
+    first_token = []
+
+    def relay(text):
+        if text and not first_token:
+            first_token.append(time.perf_counter() - started)
+        on_delta(text)
+
+    def call_provider():
+        result = _analyze_uncached(image_path, provider, api_key, upload, started, deadline, hedge,
+                                   hedge_percentile, relay if on_delta is not None else None, stages)
+        if first_token and not result.is_fallback and result.provider == provider:
+            result.ttft = first_token[0]
+        return result
+
+    if not use_cache or backend is None:
+        return call_provider()
+
+    if upload is not None:
+        image_hash = upload.source_hash
+    else:
+        try:
+            image_hash = result_cache.hash_file(image_path)
+        except OSError:
+            return call_provider()
+
+    model = backend.model
+    key = result_cache.cache_key(image_hash, provider, backend.prompt, model)
+    cache = result_cache.get_cache()
+    hit = cache.lookup(key)
+    if hit is not None:
+        return AnalysisResult(image_path, provider, hit[0], False,
+                              time.perf_counter() - started, cache_source=hit[1])
+
+    def compute():
+        phash, scope, duplicate = _find_duplicate(image_path, backend, key, dedupe_distance, cache, started)
+        if duplicate is not None:
+            return duplicate
+
+        result = call_provider()
+        if result.is_fallback:
+            return result
+        if result.provider == provider:
+            _store_provider_result(result, key, phash, scope, model, cache)
+        else:
+            # A hedge answered: file it under the provider that wrote it
+            winner = providers.get_provider(result.provider)
+            cache.store(result_cache.cache_key(image_hash, result.provider, winner.prompt, winner.model),
+                        result.stored_text, result.provider, winner.model)
+        return result
+
+    result, shared = cache.single_flight(key, compute)
+    if shared:
+        return AnalysisResult(image_path, result.provider, result.stored_text, result.is_fallback,
+                              time.perf_counter() - started,
+                              cache_source=None if result.is_fallback else "shared",
+                              duplicate_of=result.duplicate_of,
+                              duplicate_distance=result.duplicate_distance,
+                              error=result.error, hedged=result.hedged)
+    return result
+
+
+def _find_duplicate(image_path, backend, key, dedupe_distance, cache, started, prompts=None):
+    """(phash, scope, result reusing a near-duplicate's analysis or None)
+
+    Near-duplicates analyzed with any of prompts (default: the provider's
+    prompt) are searched, in order; the scope returned, to add this image
+    under, is that of the last prompt.
+    """
+    provider, model = backend.name, backend.model
+    phash = None
+    if dedupe_distance is not None:
+        try:
+            phash = duplicate_index.dhash_file(image_path)
+        except Exception:
+            phash = None
+    scopes = [result_cache.cache_key("dhash", provider, prompt, model) for prompt in prompts or [backend.prompt]]
+    scope = scopes[-1]
+    if phash is not None:
+        index = duplicate_index.get_index()
+        candidates = [candidate for each in scopes for candidate in index.candidates(each, phash, dedupe_distance)]
+        for distance, duplicate_path, result_key in candidates:
+            # The nearest one's analysis may have been evicted from the cache
+            source = cache.lookup(result_key)
+            if source is None:
+                continue
+            index.record_duplicate()
+            # Exact repeats of this file now hit the cache directly
+            cache.store(key, source[0], provider, model)
+            return phash, scope, AnalysisResult(image_path, provider, source[0], False,
+                                                time.perf_counter() - started, cache_source="duplicate",
+                                                duplicate_of=duplicate_path, duplicate_distance=distance)
+    return phash, scope, None
+
+
+def _store_provider_result(result, key, phash, scope, model, cache):
+    cache.store(key, result.stored_text, result.provider, model)
+    if phash is not None:
+        duplicate_index.get_index().add(scope, phash, result.image_path, key)
+
+
+def analyze_images_packed(image_paths, provider, api_key, uploads, use_cache=True,
+                          dedupe_distance=duplicate_index.DEFAULT_MAX_DISTANCE, deadline=None, store_result=True):
+    """[AnalysisResult] for several prepared images, sent to the provider in one request
+
+    Images found in the result cache, or matching a near-duplicate, are
+    left out of the request. If the provider can't take packed requests,
+    the request fails or its answer can't be split per image, the rest are
+    analyzed one by one with analyze_image (which falls back as usual).
+    Packed answers are cached under the packed prompt: packed runs reuse
+    single-image answers, but single analyses never get a packed answer.
+    """
+    started = time.perf_counter()
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    backend = providers.get_provider(provider)
+    results = [None] * len(image_paths)
+    stages = []
+    for upload in uploads:
+        image_stages = StageTimes()
+        image_stages.add_timings(upload.timings)
+        stages.append(image_stages)
+
+    # (index, cache key, phash, dhash scope) of the images still to analyze
+    pending = []
+    cache = result_cache.get_cache() if use_cache and backend is not None else None
+    for index, (image_path, upload) in enumerate(zip(image_paths, uploads)):
+        if cache is None:
+            pending.append((index, None, None, None))
+            continue
+        key = result_cache.cache_key(upload.source_hash, provider, backend.packed_prompt, backend.model)
+        single_key = result_cache.cache_key(upload.source_hash, provider, backend.prompt, backend.model)
+        hit = cache.lookup(single_key) or cache.lookup(key)
+        if hit is not None:
+            results[index] = AnalysisResult(image_path, provider, hit[0], False,
+                                            time.perf_counter() - started, cache_source=hit[1])
+            continue
+        phash, scope, duplicate = _find_duplicate(image_path, backend, key, dedupe_distance, cache, started,
+                                                  prompts=[backend.prompt, backend.packed_prompt])
+        if duplicate is not None:
+            results[index] = duplicate
+        else:
+            pending.append((index, key, phash, scope))
+
+    texts = None
+    if len(pending) > 1 and backend is not None and backend.supports_packing:
+        call_stages = StageTimes()
+        try:
+            texts = backend.analyze_packed([image_paths[i] for i, _, _, _ in pending], api_key,
+                                           [uploads[i] for i, _, _, _ in pending], deadline, call_stages)
+        except ProviderError:
+            texts = None
+        if texts is not None:
+            elapsed = time.perf_counter() - started
+            for (index, key, phash, scope), text in zip(pending, texts):
+                result = AnalysisResult(image_paths[index], provider, text, False, elapsed)
+                stages[index].merge(call_stages)
+                if cache is not None:
+                    _store_provider_result(result, key, phash, scope, backend.model, cache)
+                results[index] = result
+
+    for index, result in enumerate(results):
+        if result is None:
+            # Not packed, or the packed request failed: one request each
+            results[index] = analyze_image(image_paths[index], provider, api_key, uploads[index],
+                                           use_cache=use_cache, dedupe_distance=dedupe_distance,
+                                           deadline=deadline, store_result=store_result)
+            continue
+        result.stages = stages[index]
+        get_metrics().record_analysis(result)
+        if store_result:
+            index_result(result)
+    return results
+
+
+async def analyze_image_async(image_path, provider, api_key, upload=None, **kwargs):
+    """Awaitable analyze_image; requests share the pooled provider client"""
+    return await get_client().run_async(analyze_image, image_path, provider, api_key, upload, **kwargs)
@@ -1,35 +1,77 @@
+import time
+# Start of the cold-start clock (see --startup-time)
+_module_started = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
-from PIL import Image, ImageTk, ImageDraw, ImageFont, ImageFilter
-from dotenv import load_dotenv
+from tkinter import messagebox
 import os
-import base64
-import requests
-import json
+import sys
+import queue
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+# Pillow (ImageTk, the preview decoder, sample art) and requests are
+# imported on first use, after the window is up
+import photo_analysis
+import providers
+import hedging
+from stage_metrics import StageTimes, get_metrics
+
+# How often the Tk loop drains events posted by worker threads (ms)
+UI_POLL_INTERVAL = 50
+
+WINDOW_SIZE = (1400, 900)
+
+# Most matches a gallery search shows
+SEARCH_LIMIT = 500
+
+# Width of the thumbnail gallery beside the preview (one column of thumbnails);
+# the preview gives up this space, and the gallery can be hidden to get it back
+GALLERY_WIDTH = 150
+
+
+class StartupTimer:
+    """Milestones from module load to an interactive window"""
+
+    def __init__(self, started=_module_started):
+        self.started = started
+        self.last = started
+        self.stages = StageTimes()
+        self.interactive_after = None
+
+    def mark(self, milestone):
+        now = time.perf_counter()
+        self.stages.add(milestone, now - self.last)
+        self.last = now
+        return now - self.started
+
+    def report(self):
+        total = self.last - self.started
+        return (f"🚀 Interactive after {format_ms(self.interactive_after)}, sample art after {format_ms(total)} "
+                f"({self.stages.summary()})")
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds is not None else "n/a"
+
 
 class SimplePhotoAnalyzer:
-    def __init__(self, root):
+    def __init__(self, root, startup=None, exit_after_startup=False):
         self.root = root
+        self.startup = startup or StartupTimer()
+        self.exit_after_startup = exit_after_startup
         self.root.title("🤖 AI Photo Analyzer Pro")
-        self.root.geometry("1400x900")
         self.root.configure(bg='#0a0a0a')
         self.root.minsize(1200, 800)
         
-        # Load environment variables (robust to bad encodings or missing file)
-        try:
-            dotenv_path = os.path.join(os.getcwd(), ".env")
-            if os.path.exists(dotenv_path):
-                load_dotenv(dotenv_path=dotenv_path, encoding="utf-8")
-            else:
-                load_dotenv(encoding="utf-8")
-        except Exception:
-            # Ignore dotenv read errors so the app can still run
-            pass
-        # Default API keys (load from environment; leave empty if not provided)
-        self.default_chatgpt_key = os.getenv("OPENAI_API_KEY", "")
-        self.default_imagedescriber_key = os.getenv("IMAGEDESCRIBER_API_KEY", "")
+        # Center the window before it is first mapped
+        self.center_window()
         
-        self.api_key = self.default_chatgpt_key
+        # Load environment variables and default API keys (empty if not provided)
+        self.default_keys = photo_analysis.load_environment()
+        # Per-analysis deadline and optional backup provider for slow answers
+        self.hedge_settings = hedging.settings_from_env()
+        
+        self.api_key = self.default_keys["chatgpt"]
         self.api_key_var = tk.StringVar()
         
         # API provider selection
@@ -38,20 +80,105 @@ class SimplePhotoAnalyzer:
         # Current image path
         self.current_image_path = None
         
+        # Background work: decoding and analysis run on worker threads and
+        # report back through ui_events, which the Tk loop polls
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="analyzer")
+        self.ui_events = queue.Queue()
+        self.load_generation = 0
+        self.active_analyses = 0
+        self.analysis_results = {}
+        self.sample_image = None
+        self.sample_photo = None
+        self.sample_pending = False
+        self.progress_bar = None
+        self.first_paint_done = False
+        # Built when the first folder is opened (see open_folder)
+        self.gallery = None
+        self.folder_generation = 0
+        self.analyze_when_loaded = None
+        # Streamed answers in progress, by image path; flushed to the results
+        # pane once per poll so Tk sees a few inserts instead of one per token
+        self.active_streams = {}
+        self.stream_view_provider = {}
+        self.stream_view = None
+        self.stream_start = '1.0'
+        
         # Create GUI elements
         self.create_modern_ui()
+        self.startup.mark("ui")
         
-        # Center the window
-        self.center_window()
+        # Sample art and the rest wait until the window has been drawn
+        self.root.bind('<Map>', self._on_map, add='+')
         
-        # Load sample image for better visual appeal
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(UI_POLL_INTERVAL, self.process_ui_events)
+    
+    def _on_map(self, event):
+        if event.widget is self.root and not self.first_paint_done:
+            self.first_paint_done = True
+            # Queued behind the redraws the mapping just scheduled
+            self.root.after_idle(self._after_first_paint)
+    
+    def _after_first_paint(self):
+        """Finish start-up once the window is on screen and responsive"""
+        self.startup.interactive_after = self.startup.mark("first_paint")
+        self.add_button_hover_effects()
         self.load_sample_image()
     
+    def post_event(self, handler, *args):
+        """Schedule handler(*args) on the Tk thread (safe to call from workers)"""
+        self.ui_events.put((handler, args))
+    
+    def process_ui_events(self):
+        """Drain events posted by worker threads, then poll again"""
+        try:
+            while True:
+                handler, args = self.ui_events.get_nowait()
+                try:
+                    handler(*args)
+                except Exception as e:
+                    self.status_var.set(f"❌ UI update failed: {str(e)}")
+        except queue.Empty:
+            pass
+        self.flush_streams()
+        self.root.after(UI_POLL_INTERVAL, self.process_ui_events)
+    
+    def flush_streams(self):
+        """Append newly streamed text for the image on screen"""
+        image_path = self.current_image_path
+        buffer = self.active_streams.get(image_path)
+        if not buffer:
+            return
+        if self.stream_view != image_path:
+            # First tokens, or back on this image: show everything so far
+            provider_name = self.stream_view_provider.get(image_path, "AI")
+            self.results_text.delete('1.0', tk.END)
+            self.results_text.insert('1.0', f"🧠 AI Analysis Results ({provider_name}, streaming...)\n{'='*50}\n\n")
+            self.stream_start = self.results_text.index(tk.END + "-1c")
+            self.results_text.insert(tk.END, buffer.text())
+            self.stream_view = image_path
+            return
+        restarted, text = buffer.drain()
+        if restarted:
+            # The provider retried; drop the partial answer
+            self.results_text.delete(self.stream_start, tk.END)
+        if text:
+            at_bottom = self.results_text.yview()[1] >= 0.999
+            self.results_text.insert(tk.END, text)
+            if at_bottom:
+                self.results_text.see(tk.END)
+    
+    def on_close(self):
+        """Stop background work and close the window"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.gallery is not None:
+            self.gallery.shutdown()
+        self.root.destroy()
+    
     def center_window(self):
         """Center the window on screen"""
-        self.root.update_idletasks()
-        width = self.root.winfo_width()
-        height = self.root.winfo_height()
+        # The size is known up front, so no layout pass is needed to measure it
+        width, height = WINDOW_SIZE
         x = (self.root.winfo_screenwidth() // 2) - (width // 2)
         y = (self.root.winfo_screenheight() // 2) - (height // 2)
         self.root.geometry(f'{width}x{height}+{x}+{y}')
@@ -193,6 +320,23 @@ class SimplePhotoAnalyzer:
                                    command=self.import_photo)
         self.import_btn.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
         
+        # Open folder button: fills the gallery
+        folder_container = tk.Frame(button_frame, bg='#00d4ff', bd=0)
+        folder_container.pack(fill=tk.X, pady=10)
+        
+        self.folder_btn = tk.Button(folder_container,
+                                   text="📂 Open Folder",
+                                   bg='#00d4ff',
+                                   fg='white',
+                                   font=('Segoe UI', 13, 'bold'),
+                                   relief='flat',
+                                   bd=0,
+                                   cursor='hand2',
+                                   height=2,
+                                   activebackground='#00a8cc',
+                                   command=self.open_folder)
+        self.folder_btn.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+        
         # Analyze button
         analyze_container = tk.Frame(button_frame, bg='#00ff88', bd=0)
         analyze_container.pack(fill=tk.X, pady=10)
@@ -227,9 +371,6 @@ class SimplePhotoAnalyzer:
                                   activebackground='#ee3742',
                                   command=self.clear_image)
         self.clear_btn.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
-        
-        # Add hover effects
-        self.add_button_hover_effects()
     
     def add_button_hover_effects(self):
         """Add hover effects to buttons"""
@@ -238,6 +379,7 @@ class SimplePhotoAnalyzer:
             widget.bind('<Leave>', lambda e: e.widget.configure(bg=leave_color))
         
         create_hover(self.import_btn, '#00a8cc', '#00d4ff')
+        create_hover(self.folder_btn, '#00a8cc', '#00d4ff')
         create_hover(self.analyze_btn, '#00cc66', '#00ff88')
         create_hover(self.clear_btn, '#ee3742', '#ff4757')
     
@@ -297,9 +439,59 @@ class SimplePhotoAnalyzer:
                               font=('Segoe UI', 15, 'bold'))
         title_label.pack(pady=15)
         
+        self.gallery_toggle_btn = tk.Button(title_frame,
+                                            text="🗂️ Hide Gallery",
+                                            bg='#252525',
+                                            fg='#00d4ff',
+                                            font=('Segoe UI', 10),
+                                            relief='flat',
+                                            bd=0,
+                                            cursor='hand2',
+                                            activebackground='#252525',
+                                            highlightthickness=0,
+                                            command=self.toggle_gallery)
+        self.gallery_toggle_btn.place(relx=1.0, rely=0.5, x=-15, anchor='e')
+        
+        # Thumbnail gallery beside the preview (collapsible)
+        self.gallery_frame = tk.Frame(inner_frame, bg='#0a0a0a', width=GALLERY_WIDTH)
+        self.gallery_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 15), pady=(0, 15))
+        self.gallery_frame.pack_propagate(False)
+        
+        self.gallery_title = tk.Label(self.gallery_frame,
+                                      text="🗂️ Gallery",
+                                      bg='#0a0a0a',
+                                      fg='#00d4ff',
+                                      font=('Segoe UI', 11, 'bold'),
+                                      anchor='w')
+        self.gallery_title.pack(fill=tk.X, padx=8, pady=(8, 4))
+        
+        # Search over every stored analysis; matches fill the gallery
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(self.gallery_frame,
+                                     textvariable=self.search_var,
+                                     bg='#1a1a1a',
+                                     fg='#e0e0e0',
+                                     insertbackground='#00d4ff',
+                                     font=('Segoe UI', 10),
+                                     relief='flat',
+                                     bd=4)
+        self.search_entry.pack(fill=tk.X, padx=8, pady=(0, 8))
+        self.search_entry.bind('<Return>', lambda e: self.search_photos())
+        
+        self.gallery_placeholder = tk.Label(self.gallery_frame,
+                                            text="📂 Open a folder\nto browse its photos\n\n🔎 or search your analyses\nabove, e.g. beach sunset dog",
+                                            bg='#0a0a0a',
+                                            fg='#666666',
+                                            font=('Segoe UI', 11),
+                                            justify='center',
+                                            wraplength=GALLERY_WIDTH - 16)
+        self.gallery_placeholder.pack(expand=True, fill=tk.BOTH)
+        
         # Image display area with dark background
         self.image_display_frame = tk.Frame(inner_frame, bg='#0a0a0a', relief='flat', bd=0)
-        self.image_display_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=(0, 15))
+        self.image_display_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=15, pady=(0, 15))
+        # Previews are fitted to this frame, so they must not make it (and the window) grow
+        self.image_display_frame.pack_propagate(False)
         
         # Image label
         self.image_label = tk.Label(self.image_display_frame,
@@ -345,31 +537,20 @@ class SimplePhotoAnalyzer:
         radio_frame = tk.Frame(provider_frame, bg='#1a1a1a')
         radio_frame.pack(fill=tk.X)
         
-        chatgpt_radio = tk.Radiobutton(radio_frame,
-                                      text="ChatGPT-4 (OpenAI)",
-                                      variable=self.api_provider,
-                                      value="chatgpt",
-                                      bg='#1a1a1a',
-                                      fg='#00d4ff',
-                                      selectcolor='#0f0f0f',
-                                      activebackground='#1a1a1a',
-                                      activeforeground='#00d4ff',
-                                      font=('Segoe UI', 10),
-                                      command=self.on_provider_change)
-        chatgpt_radio.pack(side=tk.LEFT, padx=(0, 20))
-        
-        imagedescriber_radio = tk.Radiobutton(radio_frame,
-                                             text="ImageDescriber.online",
-                                             variable=self.api_provider,
-                                             value="imagedescriber",
-                                             bg='#1a1a1a',
-                                             fg='#00d4ff',
-                                             selectcolor='#0f0f0f',
-                                             activebackground='#1a1a1a',
-                                             activeforeground='#00d4ff',
-                                             font=('Segoe UI', 10),
-                                             command=self.on_provider_change)
-        imagedescriber_radio.pack(side=tk.LEFT)
+        # One radio button per registered backend
+        for provider in providers.all_providers():
+            radio = tk.Radiobutton(radio_frame,
+                                   text=provider.display_name,
+                                   variable=self.api_provider,
+                                   value=provider.name,
+                                   bg='#1a1a1a',
+                                   fg='#00d4ff',
+                                   selectcolor='#0f0f0f',
+                                   activebackground='#1a1a1a',
+                                   activeforeground='#00d4ff',
+                                   font=('Segoe UI', 10),
+                                   command=self.on_provider_change)
+            radio.pack(side=tk.LEFT, padx=(0, 20))
         
         # API Key input frame
         input_frame = tk.Frame(inner, bg='#1a1a1a')
@@ -415,58 +596,36 @@ class SimplePhotoAnalyzer:
     
     def on_provider_change(self):
         """Handle API provider change"""
-        provider = self.api_provider.get()
-        if provider == "chatgpt":
-            # Set default ChatGPT key if no custom key
-            if not self.api_key_var.get():
-                self.api_key = self.default_chatgpt_key
+        provider = providers.get_provider(self.api_provider.get())
+        # Use the provider's default key if no custom key
+        if not self.api_key_var.get():
+            self.api_key = self.default_keys.get(provider.name, "")
             self.api_status_label.configure(
-                text="✅ ChatGPT Selected - Using Default Key" if not self.api_key_var.get() else "✅ ChatGPT Selected",
+                text=f"✅ {provider.short_name} - Using Default Key",
                 fg='#00ff88'
             )
         else:
-            # Set default ImageDescriber key if no custom key
-            if not self.api_key_var.get():
-                self.api_key = self.default_imagedescriber_key
-                self.api_status_label.configure(
-                    text="✅ ImageDescriber - Using Default Key",
-                    fg='#00ff88'
-                )
-            else:
-                self.api_status_label.configure(
-                    text="✅ ImageDescriber Selected",
-                    fg='#00ff88'
-                )
+            self.api_status_label.configure(
+                text=f"✅ {provider.short_name} Selected",
+                fg='#00ff88'
+            )
         self.update_status_bar()
     
     def update_api_key(self):
         """Update the API key"""
         new_key = self.api_key_var.get().strip()
-        provider = self.api_provider.get()
-        
-        if provider == "chatgpt":
-            if len(new_key) < 20 and new_key != "":
-                self.api_status_label.configure(text="❌ Invalid ChatGPT API Key", fg='#ff4757')
-                return
-            
-            if new_key == "":
-                # Use default key
-                self.api_key = self.default_chatgpt_key
-                self.api_status_label.configure(text="✅ Using Default ChatGPT Key", fg='#00ff88')
-            else:
-                self.api_key = new_key
-                self.api_status_label.configure(text="✅ ChatGPT API Key Updated", fg='#00ff88')
-        else:  # imagedescriber
-            if new_key == "":
-                # Use default key
-                self.api_key = self.default_imagedescriber_key
-                self.api_status_label.configure(text="✅ Using Default ImageDescriber Key", fg='#00ff88')
-            elif len(new_key) < 20:
-                self.api_status_label.configure(text="❌ Invalid ImageDescriber Key", fg='#ff4757')
-                return
-            else:
-                self.api_key = new_key
-                self.api_status_label.configure(text="✅ ImageDescriber API Key Set", fg='#00ff88')
+        provider = providers.get_provider(self.api_provider.get())
+        
+        if new_key == "":
+            # Use default key
+            self.api_key = self.default_keys.get(provider.name, "")
+            self.api_status_label.configure(text=f"✅ Using Default {provider.short_name} Key", fg='#00ff88')
+        elif provider.requires_key and len(new_key) < 20:
+            self.api_status_label.configure(text=f"❌ Invalid {provider.short_name} API Key", fg='#ff4757')
+            return
+        else:
+            self.api_key = new_key
+            self.api_status_label.configure(text=f"✅ {provider.short_name} API Key Updated", fg='#00ff88')
         
         # Update status bar
         self.update_status_bar()
@@ -568,6 +727,9 @@ Your OpenAI API is ready! 🟢"""
                                anchor='w')
         status_label.pack(side=tk.LEFT, padx=15, pady=12)
         
+        # Activity indicator, built when the first analysis starts
+        self.status_inner = inner
+        
         # API status indicator
         self.api_status_bar = tk.Label(inner,
                                       text="🟢 API Connected",
@@ -578,29 +740,23 @@ Your OpenAI API is ready! 🟢"""
     
     def update_status_bar(self):
         """Update the status bar API indicator"""
-        provider = self.api_provider.get()
-        
-        if provider == "chatgpt":
-            if self.api_key and len(self.api_key) > 20:
-                is_default = (self.api_key == self.default_chatgpt_key)
-                if is_default:
-                    self.api_status_bar.configure(text="🟠 ChatGPT (Default Key)", fg='#ffaa00')
-                else:
-                    self.api_status_bar.configure(text="🟢 ChatGPT API Connected", fg='#00ff88')
-            else:
-                self.api_status_bar.configure(text="❌ ChatGPT - No Key", fg='#ff4757')
-        else:  # imagedescriber
-            if self.api_key and len(self.api_key) > 20:
-                is_default = (self.api_key == self.default_imagedescriber_key)
-                if is_default:
-                    self.api_status_bar.configure(text="🟠 ImageDescriber (Default Key)", fg='#ffaa00')
-                else:
-                    self.api_status_bar.configure(text="🟢 ImageDescriber Connected", fg='#00ff88')
+        provider = providers.get_provider(self.api_provider.get())
+        name = provider.short_name
+        
+        if not provider.requires_key and not self.api_key:
+            self.api_status_bar.configure(text=f"🟢 {name} (No Key Needed)", fg='#00ff88')
+        elif self.api_key and (len(self.api_key) > 20 or not provider.requires_key):
+            is_default = (self.api_key == self.default_keys.get(provider.name, ""))
+            if is_default:
+                self.api_status_bar.configure(text=f"🟠 {name} (Default Key)", fg='#ffaa00')
             else:
-                self.api_status_bar.configure(text="❌ ImageDescriber - No Key", fg='#ff4757')
+                self.api_status_bar.configure(text=f"🟢 {name} API Connected", fg='#00ff88')
+        else:
+            self.api_status_bar.configure(text=f"❌ {name} - No Key", fg='#ff4757')
     
     def import_photo(self):
         """Import photo with file dialog"""
+        from tkinter import filedialog
         file_types = [
             ("Image files", "*.jpg *.jpeg *.png *.bmp *.gif *.tiff *.webp"),
             ("All files", "*.*")
@@ -613,70 +769,248 @@ Your OpenAI API is ready! 🟢"""
         
         if file_path:
             self.load_image(file_path)
+            if self.gallery is not None:
+                self.gallery.select_path(file_path)
+    
+    def toggle_gallery(self):
+        """Hide or show the gallery; hidden, its width goes to the preview"""
+        if self.gallery_frame.winfo_manager():
+            self.gallery_frame.pack_forget()
+            self.gallery_toggle_btn.configure(text="🗂️ Show Gallery")
+            self._refit_preview()
+        else:
+            self._show_gallery()
+    
+    def _show_gallery(self):
+        if not self.gallery_frame.winfo_manager():
+            self.gallery_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 15), pady=(0, 15),
+                                    before=self.image_display_frame)
+            self.gallery_toggle_btn.configure(text="🗂️ Hide Gallery")
+            self._refit_preview()
+    
+    def _refit_preview(self):
+        """Redo the preview for the width the gallery left it"""
+        self.root.update_idletasks()
+        if self.current_image_path is None:
+            if self.sample_image is not None:
+                self.load_sample_image()
+        else:
+            # Same generation: a newer load still wins
+            self.executor.submit(self._decode_worker, self.load_generation, self.current_image_path,
+                                 self._preview_size(), self._on_preview_refit)
+    
+    def open_folder(self):
+        """Browse a folder of photos in the gallery"""
+        from tkinter import filedialog
+        folder = filedialog.askdirectory(title="Select a Folder of Photos")
+        if folder:
+            self.load_folder(folder)
+    
+    def load_folder(self, folder):
+        """Scan folder (recursively) on a worker thread and show it in the gallery"""
+        self.folder_generation += 1
+        self.status_var.set(f"⏳ Scanning {folder}...")
+        self.executor.submit(self._scan_worker, self.folder_generation, folder)
+    
+    def _scan_worker(self, generation, folder):
+        try:
+            from batch_analyzer import scan_images
+            from thumbnail_store import get_store
+            paths = sorted(scan_images(folder))
+            # Open the thumbnail index here rather than on the first redraw
+            get_store()
+            self.post_event(self._on_folder_scanned, generation, folder, paths)
+        except Exception as e:
+            self.post_event(self._on_folder_failed, generation, e)
+    
+    def _on_folder_scanned(self, generation, folder, paths):
+        if generation != self.folder_generation:
+            return
+        self._ensure_gallery()
+        self.gallery.set_images(paths)
+        self.gallery_title.configure(text=f"🗂️ Gallery • {self.gallery.status_text()}")
+        name = os.path.basename(os.path.normpath(folder)) or folder
+        if paths:
+            self.status_var.set(f"📂 {name}: {len(paths):,} photos - click to preview, double-click to analyze")
+        else:
+            self.status_var.set(f"📂 No images found in {name}")
+    
+    def _ensure_gallery(self):
+        # New contents for the gallery: show it if it was hidden
+        self._show_gallery()
+        if self.gallery is None:
+            from gallery_view import ThumbnailGallery
+            self.gallery_placeholder.destroy()
+            self.gallery = ThumbnailGallery(self.gallery_frame, self.post_event,
+                                            on_select=self.load_image,
+                                            on_activate=self.load_and_analyze)
+            self.gallery.pack(fill=tk.BOTH, expand=True)
+    
+    def search_photos(self):
+        """Show the images whose stored analyses match the search box in the gallery"""
+        query = self.search_var.get().strip()
+        if not query:
+            return
+        # A search replaces the folder in the gallery, like opening another folder
+        self.folder_generation += 1
+        self.status_var.set(f"🔎 Searching for {query}...")
+        self.executor.submit(self._search_worker, self.folder_generation, query)
+    
+    def _search_worker(self, generation, query):
+        try:
+            import search_index
+            started = time.perf_counter()
+            hits = search_index.get_index().search(query, limit=SEARCH_LIMIT)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            # Moved or deleted photos can't be previewed
+            paths = [hit.path for hit in hits if os.path.exists(hit.path)]
+            self.post_event(self._on_search_done, generation, query, paths, elapsed_ms)
+        except Exception as e:
+            self.post_event(self._on_folder_failed, generation, e)
+    
+    def _on_search_done(self, generation, query, paths, elapsed_ms):
+        if generation != self.folder_generation:
+            return
+        self._ensure_gallery()
+        self.gallery.set_images(paths)
+        self.gallery_title.configure(text=f"🔎 Search • {self.gallery.status_text()}")
+        if paths:
+            self.status_var.set(f"🔎 {len(paths):,} photos match \"{query}\" ({elapsed_ms:.0f} ms) - best match first")
+        else:
+            self.status_var.set(f"🔎 No analyzed photos match \"{query}\"")
+    
+    def _on_folder_failed(self, generation, error):
+        if generation != self.folder_generation:
+            return
+        messagebox.showerror("Error", f"Failed to open folder: {str(error)}")
+        self.status_var.set("❌ Error opening folder")
+    
+    def load_and_analyze(self, image_path):
+        """Preview image_path and queue its analysis once it is loaded"""
+        self.analyze_when_loaded = image_path
+        self.load_image(image_path)
     
     def load_image(self, image_path):
-        """Load and display image"""
+        """Load and display image (decoding runs on a worker thread)"""
+        if not os.path.exists(image_path):
+            messagebox.showerror("Error", "File not found!")
+            return
+        
+        # Only the most recent load may update the preview
+        self.load_generation += 1
+        generation = self.load_generation
+        self.status_var.set(f"⏳ Loading {os.path.basename(image_path)}...")
+        self.executor.submit(self._decode_worker, generation, image_path, self._preview_size())
+    
+    def _preview_size(self):
+        """Largest preview that fits the display area, at most 600x550"""
+        # Less the image label's padding
+        width = self.image_display_frame.winfo_width() - 24
+        height = self.image_display_frame.winfo_height() - 24
+        if width < 100 or height < 100:
+            # Not laid out yet
+            return (600, 550)
+        return (min(600, width), min(550, height))
+    
+    def _decode_worker(self, generation, image_path, max_size=(600, 550), on_decoded=None):
+        """Decode and resize for display off the Tk thread"""
         try:
-            if not os.path.exists(image_path):
-                messagebox.showerror("Error", "File not found!")
-                return
-            
-            # Load original image
-            original_image = Image.open(image_path)
-            
-            # Create display version
-            display_image = original_image.copy()
-            
-            # Convert to RGB if necessary
-            if display_image.mode != 'RGB':
-                display_image = display_image.convert('RGB')
-            
-            # Calculate size for display
-            max_width, max_height = 600, 550
-            img_width, img_height = display_image.size
-            
-            scale = min(max_width/img_width, max_height/img_height)
-            if scale < 1 or scale > 1:
-                new_width = int(img_width * scale)
-                new_height = int(img_height * scale)
-                display_image = display_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convert to PhotoImage
-            photo = ImageTk.PhotoImage(display_image)
-            
-            # Update image display
-            self.image_label.configure(image=photo, text="", compound='center')
-            self.image_label.image = photo
-            
-            # Store current image path
-            self.current_image_path = image_path
-            
-            # Enable analyze button
-            self.analyze_btn.configure(state="normal", bg='#00ff88')
-            
-            # Update image info
-            self.update_image_info(original_image)
-            
-            # Update status
-            filename = os.path.basename(image_path)
-            self.status_var.set(f"📁 Loaded: {filename} - Ready for AI analysis")
+            import image_preview
+            # Draft-mode decode and reduce before converting (see image_preview)
+            preview = image_preview.decode_preview(image_path, max_size)
+            get_metrics().record_preview(preview)
             
+            self.post_event(on_decoded or self._on_image_decoded, generation, image_path, preview)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to load image: {str(e)}")
-            self.status_var.set("❌ Error loading image")
+            self.post_event(self._on_image_failed, generation, e)
+    
+    def _on_image_decoded(self, generation, image_path, preview):
+        if generation != self.load_generation:
+            return
+        
+        # Convert to PhotoImage (must happen on the Tk thread)
+        from PIL import ImageTk
+        photo = ImageTk.PhotoImage(preview.image)
+        
+        # Update image display
+        self.image_label.configure(image=photo, text="", compound='center')
+        self.image_label.image = photo
+        
+        # Store current image path
+        self.current_image_path = image_path
+        
+        # Enable analyze button
+        self.analyze_btn.configure(state="normal", bg='#00ff88')
+        
+        # Update image info
+        self.update_image_info(preview)
+        
+        # Show an earlier analysis of this image, if any; a streaming one
+        # is redrawn on the next flush
+        self.stream_view = None
+        if image_path in self.analysis_results:
+            self.show_analysis(self.analysis_results[image_path])
+        elif image_path not in self.active_streams:
+            # Analyzed in an earlier session? Look it up in the search index
+            self.executor.submit(self._stored_analysis_worker, generation, image_path)
+        
+        # Update status
+        filename = os.path.basename(image_path)
+        self.status_var.set(f"📁 Loaded: {filename} in {preview.total_ms:.0f} ms - Ready for AI analysis")
+        
+        if self.analyze_when_loaded == image_path:
+            self.analyze_when_loaded = None
+            self.analyze_photo()
+    
+    def _on_preview_refit(self, generation, image_path, preview):
+        if generation != self.load_generation or image_path != self.current_image_path:
+            return
+        from PIL import ImageTk
+        photo = ImageTk.PhotoImage(preview.image)
+        self.image_label.configure(image=photo)
+        self.image_label.image = photo
+    
+    def _stored_analysis_worker(self, generation, image_path):
+        try:
+            import search_index
+            history = search_index.get_index().history(image_path)
+        except Exception:
+            return
+        if history:
+            self.post_event(self._on_stored_analysis, generation, image_path, history)
+    
+    def _on_stored_analysis(self, generation, image_path, history):
+        if generation != self.load_generation or image_path in self.analysis_results:
+            return
+        # Prefer the newest provider analysis over a newer basic one
+        provider, model, created, text = next((row for row in history if row[0] != "fallback"), history[0])
+        backend = providers.get_provider(provider)
+        source = backend.display_name if backend is not None else provider.title()
+        if model:
+            source += f" ({model})"
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+        self.results_text.delete('1.0', tk.END)
+        self.results_text.insert('1.0', f"📚 Stored Analysis\n{'='*50}\n\n{text}\n\n"
+                                        f"🔖 {source} • {when}\n{'='*50}\n🔄 Analyze again for a fresh result")
+    
+    def _on_image_failed(self, generation, error):
+        if generation != self.load_generation:
+            return
+        messagebox.showerror("Error", f"Failed to load image: {str(error)}")
+        self.status_var.set("❌ Error loading image")
     
-    def update_image_info(self, image):
+    def update_image_info(self, preview):
         """Update image information display"""
         try:
-            width, height = image.size
-            mode = image.mode
-            format_name = image.format or "Unknown"
-            file_size = os.path.getsize(self.current_image_path)
+            width, height = preview.width, preview.height
+            format_name = preview.format or "Unknown"
+            file_size = preview.file_size
             
             info_text = f"""📏 Dimensions: {width} × {height} px
 📊 Format: {format_name}
 🎨 Purpose: UI Demonstration
 💾 File Size: {file_size / 1024:.1f} KB
+⏱️ Preview: {preview.timing_summary()}
 
 🎯 Ready to import your own image!"""
             
@@ -688,231 +1022,138 @@ Your OpenAI API is ready! 🟢"""
             self.info_text.insert('1.0', f"Error: {str(e)}")
     
     def analyze_photo(self):
-        """Analyze photo with AI"""
+        """Analyze photo with AI on a worker thread; several may run at once"""
         if not self.current_image_path:
             messagebox.showwarning("Warning", "Please import a photo first!")
             return
         
         provider = self.api_provider.get()
+        image_path = self.current_image_path
         
         # Update UI for analysis
-        self.analyze_btn.configure(state="disabled", bg='#7f8c8d', text="🤖 Analyzing...")
-        provider_name = "ChatGPT-4" if provider == "chatgpt" else "ImageDescriber.online"
-        self.status_var.set(f"🧠 {provider_name} is analyzing your image... Please wait")
+        provider_name = providers.get_provider(provider).display_name
         self.results_text.delete('1.0', tk.END)
         self.results_text.insert('1.0', f"🤖 AI Analysis in Progress ({provider_name})...\n\nPlease wait while our advanced AI analyzes your image.")
-        self.root.update()
-        
+        self.analysis_started()
+        
+        hedge = None
+        hedge_name = self.hedge_settings.hedge_provider_for(provider, self.default_keys)
+        if hedge_name:
+            hedge = (hedge_name, self.default_keys.get(hedge_name, ""))
+        
+        # Streaming providers show the answer as it is written
+        stream = None
+        if providers.get_provider(provider).supports_streaming:
+            stream = photo_analysis.DeltaBuffer()
+            self.active_streams[image_path] = stream
+            self.stream_view_provider[image_path] = provider_name
+            if self.stream_view == image_path:
+                self.stream_view = None
+        self.executor.submit(self._analysis_worker, image_path, provider, self.api_key, hedge, stream)
+    
+    def _analysis_worker(self, image_path, provider, api_key, hedge=None, stream=None):
         try:
-            if provider == "chatgpt":
-                result = self.analyze_with_chatgpt(self.current_image_path)
-                service_tag = "\n\n" + "="*50 + "\n🤖 Generated by: ChatGPT-4 (OpenAI)"
-            else:
-                result = self.analyze_with_imagedescriber(self.current_image_path)
-                service_tag = "\n\n" + "="*50 + "\n🤖 Generated by: ImageDescriber.online"
-            
-            if "insufficient_quota" in result.lower() or "429" in result or "error" in result.lower():
-                result = self.analyze_image_fallback(self.current_image_path)
-                service_tag = "\n\n" + "="*50 + "\n🤖 Generated by: Fallback Analysis (Basic)"
-            
-            self.results_text.delete('1.0', tk.END)
-            formatted_result = f"🧠 AI Analysis Results\n{'='*50}\n\n{result}{service_tag}\n{'='*50}\n✅ Analysis Complete"
-            self.results_text.insert('1.0', formatted_result)
-            
-            self.status_var.set("✅ Analysis complete - Scroll to view full results")
-            
+            analysis = photo_analysis.analyze_image(image_path, provider, api_key,
+                                                    deadline=self.hedge_settings.deadline, hedge=hedge,
+                                                    hedge_percentile=self.hedge_settings.percentile,
+                                                    on_delta=stream.push if stream is not None else None)
+            self.post_event(self._on_analysis_done, analysis, stream)
         except Exception as e:
-            try:
-                result = self.analyze_image_fallback(self.current_image_path)
-                service_tag = "\n\n" + "="*50 + "\n🤖 Generated by: Fallback Analysis (Basic)"
-                
-                self.results_text.delete('1.0', tk.END)
-                formatted_result = f"🧠 Basic Analysis Results\n{'='*50}\n\n{result}{service_tag}\n{'='*50}\n✅ Analysis Complete"
-                self.results_text.insert('1.0', formatted_result)
-                self.status_var.set("✅ Basic analysis complete")
-            except:
-                error_msg = f"Error: {str(e)}"
-                self.results_text.delete('1.0', tk.END)
-                self.results_text.insert('1.0', f"❌ Analysis Failed\n\n{error_msg}")
-                self.status_var.set("❌ Analysis failed")
-        
-        finally:
-            self.analyze_btn.configure(state="normal", bg='#00ff88', text="🤖 Analyze with AI")
+            self.post_event(self._on_analysis_failed, image_path, e, stream)
+    
+    def analysis_started(self):
+        self.active_analyses += 1
+        self.update_activity()
+    
+    def analysis_finished(self):
+        self.active_analyses = max(0, self.active_analyses - 1)
+        self.update_activity()
+    
+    def update_activity(self):
+        """Reflect the number of running analyses in the button and status bar"""
+        if self.active_analyses:
+            self.analyze_btn.configure(text=f"🤖 Analyze with AI ({self.active_analyses} running)")
+            self.status_var.set(f"🧠 {self.active_analyses} analysis(es) in progress...")
+            if self.progress_bar is None:
+                from tkinter import ttk
+                self.progress_bar = ttk.Progressbar(self.status_inner, mode='indeterminate', length=140)
+            if not self.progress_bar.winfo_ismapped():
+                self.progress_bar.pack(side=tk.RIGHT, padx=(0, 15), pady=12)
+                self.progress_bar.start(12)
+        else:
+            self.analyze_btn.configure(text="🤖 Analyze with AI")
+            if self.progress_bar is not None and self.progress_bar.winfo_ismapped():
+                self.progress_bar.stop()
+                self.progress_bar.pack_forget()
+    
+    def _on_analysis_done(self, analysis, stream=None):
+        self.analysis_results[analysis.image_path] = analysis
+        self._end_stream(analysis.image_path, stream)
+        self.analysis_finished()
+        filename = os.path.basename(analysis.image_path)
+        
+        if analysis.image_path == self.current_image_path:
+            self.show_analysis(analysis)
+        
+        if self.active_analyses:
+            return
+        # Where the time went, slowest stages first
+        timing = f" • ⏱️ {analysis.stages.summary(limit=4)}" if analysis.stages else ""
+        if analysis.is_fallback and analysis.error is not None:
+            self.status_var.set(f"⚠️ Basic analysis used for {filename}: {analysis.error_summary}" + timing)
+        elif analysis.is_fallback:
+            self.status_var.set(f"✅ Basic analysis complete: {filename}")
+        elif analysis.ttft is not None:
+            self.status_var.set(f"✅ Analysis complete: {filename} - first words after {analysis.ttft:.1f}s, "
+                                f"done after {analysis.elapsed:.1f}s" + timing)
+        elif analysis.hedged:
+            self.status_var.set(f"🏁 Analysis complete via {analysis.generated_by}: {filename}" + (timing or " - Scroll to view full results"))
+        elif analysis.duplicate_of:
+            self.status_var.set(f"♻️ Reused analysis of near-duplicate {os.path.basename(analysis.duplicate_of)}")
+        elif analysis.cache_source:
+            self.status_var.set(f"⚡ Analysis loaded from cache: {filename} - Scroll to view full results")
+        else:
+            self.status_var.set(f"✅ Analysis complete: {filename}" + (timing or " - Scroll to view full results"))
+    
+    def _on_analysis_failed(self, image_path, error, stream=None):
+        self._end_stream(image_path, stream)
+        self.analysis_finished()
+        if image_path == self.current_image_path:
+            self.results_text.delete('1.0', tk.END)
+            self.results_text.insert('1.0', f"❌ Analysis Failed\n\nError: {str(error)}")
+        self.status_var.set("❌ Analysis failed")
+    
+    def _end_stream(self, image_path, stream):
+        # A newer analysis of the same image may own the slot by now
+        if stream is None or self.active_streams.get(image_path) is not stream:
+            return
+        del self.active_streams[image_path]
+        self.stream_view_provider.pop(image_path, None)
+        if self.stream_view == image_path:
+            self.stream_view = None
+    
+    def show_analysis(self, analysis):
+        """Render an analysis result in the results pane"""
+        heading = "Basic Analysis Results" if analysis.is_fallback else "AI Analysis Results"
+        self.results_text.delete('1.0', tk.END)
+        formatted_result = f"🧠 {heading}\n{'='*50}\n\n{analysis.text}{analysis.service_tag}\n{'='*50}\n✅ Analysis Complete"
+        self.results_text.insert('1.0', formatted_result)
     
     def analyze_with_chatgpt(self, image_path):
         """Analyze image using ChatGPT (OpenAI GPT-4 Vision API)"""
-        if not self.api_key:
-            return "Error: ChatGPT API key not found."
-        
-        try:
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            payload = {
-                "model": "gpt-4o",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Analyze this image in comprehensive detail following this exact structure:
-
-Summary: Provide a one-sentence overview that captures the essence of the image.
-
-Detailed Description:
-Break down the image into relevant sections such as:
-
-Person/People: (if applicable) Describe age range, appearance, clothing, pose, expression, and what they might be doing or feeling.
-
-Setting: Describe the environment, location type, and physical surroundings.
-
-Objects/Elements: Identify and describe key objects, structures, or elements in the scene.
-
-Background: Describe what's visible in the background - buildings, landscapes, sky, etc.
-
-Foreground: Describe elements in the immediate foreground.
-
-Colors and Lighting: Analyze the color palette, lighting conditions, and visual tone.
-
-Atmosphere and Mood: Describe the overall feeling, mood, and emotional tone of the image. What impression does it convey?
-
-Be thorough, specific, and descriptive. Organize the information clearly under these headings."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "max_tokens": 1500
-            }
-            
-            response = requests.post("https://api.openai.com/v1/chat/completions", 
-                                   headers=headers, json=payload)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                return f"API Error {response.status_code}: {response.text}"
-                
-        except Exception as e:
-            return f"Error: {str(e)}"
+        return photo_analysis.analyze_with_chatgpt(image_path, self.api_key)
     
     def analyze_with_imagedescriber(self, image_path):
         """Analyze image using ImageDescriber.online API"""
-        if not self.api_key:
-            return "Error: ImageDescriber API key not found."
-        
-        try:
-            # Use multipart/form-data: keep file handle open during request
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
-            }
-
-            form_data = {
-                "prompt": """Analyze this image in comprehensive detail following this exact structure:
-
-Summary: Provide a one-sentence overview that captures the essence of the image.
-
-Detailed Description:
-Break down the image into relevant sections such as:
-
-Person/People: (if applicable) Describe age range, appearance, clothing, pose, expression, and what they might be doing or feeling.
-
-Setting: Describe the environment, location type, and physical surroundings.
-
-Objects/Elements: Identify and describe key objects, structures, or elements in the scene.
-
-Background: Describe what's visible in the background - buildings, landscapes, sky, etc.
-
-Foreground: Describe elements in the immediate foreground.
-
-Colors and Lighting: Analyze the color palette, lighting conditions, and visual tone.
-
-Atmosphere and Mood: Describe the overall feeling, mood, and emotional tone of the image. What impression does it convey?
-
-Be thorough, specific, and descriptive. Organize the information clearly under these headings."""
-            }
-
-            with open(image_path, "rb") as image_file:
-                files = {
-                    "image": (os.path.basename(image_path), image_file, "image/jpeg")
-                }
-                response = requests.post(
-                    "https://imagedescriber.online/api/openapi-v2/describe-image",
-                    headers=headers,
-                    files=files,
-                    data=form_data,
-                    timeout=60
-                )
-            
-            if response.status_code == 200:
-                result = response.json()
-                # Extract description from response
-                extracted = None
-                if 'description' in result:
-                    extracted = result['description']
-                elif 'data' in result:
-                    data = result['data']
-                    if isinstance(data, dict):
-                        if 'content' in data and isinstance(data['content'], str):
-                            extracted = data['content']
-                        elif 'description' in data and isinstance(data['description'], str):
-                            extracted = data['description']
-                elif 'result' in result and isinstance(result['result'], str):
-                    extracted = result['result']
-
-                if isinstance(extracted, str) and extracted.strip():
-                    return self._format_imagedescriber_text(extracted)
-
-                # Fallback to stringifying, but ensure it's readable
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return f"ImageDescriber API Error {response.status_code}: {response.text}"
-                
-        except Exception as e:
-            return f"Error: {str(e)}"
+        return photo_analysis.analyze_with_imagedescriber(image_path, self.api_key)
 
     def _format_imagedescriber_text(self, text):
         """Normalize ImageDescriber text for consistent, readable display."""
-        try:
-            cleaned = text.strip()
-            if cleaned.startswith('{') and cleaned.endswith('}'):
-                # In case a JSON string slipped through
-                return cleaned
-            # Remove surrounding quotes
-            if (cleaned.startswith('"') and cleaned.endswith('"')) or (cleaned.startswith("'") and cleaned.endswith("'")):
-                cleaned = cleaned[1:-1].strip()
-            # Normalize bullets like '*   ' to '• '
-            lines = cleaned.splitlines()
-            normalized_lines = []
-            for line in lines:
-                l = line.lstrip()
-                if l.startswith('* '):
-                    normalized_lines.append('• ' + l[2:])
-                elif l.startswith('*\t'):
-                    normalized_lines.append('• ' + l[2:])
-                elif l.startswith('*') and '   ' in l[:4]:
-                    normalized_lines.append('• ' + l[l.find(' ')+1:])
-                else:
-                    normalized_lines.append(line)
-            cleaned = "\n".join(normalized_lines)
-            return cleaned
-        except Exception:
-            return text
+        return photo_analysis.format_imagedescriber_text(text)
 
     def open_about_modal(self):
         """Show About modal with project information and usage instructions."""
+        from tkinter import scrolledtext
         try:
             modal = tk.Toplevel(self.root)
             modal.title("About • AI Photo Analyzer Pro")
@@ -984,57 +1225,7 @@ Be thorough, specific, and descriptive. Organize the information clearly under t
     
     def analyze_image_fallback(self, image_path):
         """Fallback analysis"""
-        try:
-            with Image.open(image_path) as img:
-                width, height = img.size
-                mode = img.mode
-                format_name = img.format or "Unknown"
-                file_size = os.path.getsize(image_path)
-                
-                # Analyze colors
-                colors = img.getcolors(maxcolors=256*256*256)
-                if colors:
-                    color_info = "Rich color palette detected"
-                else:
-                    color_info = "Complex color composition"
-                
-                # Basic content analysis
-                aspect_ratio = width / height
-                if aspect_ratio > 1.5:
-                    orientation = "landscape orientation"
-                elif aspect_ratio < 0.7:
-                    orientation = "portrait orientation"
-                else:
-                    orientation = "square orientation"
-                
-                # File size analysis
-                if file_size > 5 * 1024 * 1024:
-                    quality_note = "high resolution image"
-                elif file_size > 1 * 1024 * 1024:
-                    quality_note = "good quality image"
-                else:
-                    quality_note = "standard quality image"
-            
-            description = f"""📊 Technical Analysis:
-• Dimensions: {width} × {height} pixels
-• Format: {format_name} ({mode} mode)
-• File Size: {file_size / 1024:.1f} KB
-• {color_info}
-
-🖼️ Visual Assessment:
-• This is a {quality_note}
-• Image has {orientation}
-• Aspect ratio: {aspect_ratio:.2f}
-
-📝 Basic Description:
-This image contains visual content suitable for detailed AI analysis. The technical properties indicate it's ready for advanced computer vision processing.
-
-💡 For full AI-powered analysis with object recognition, scene understanding, and detailed descriptions, ensure your OpenAI API key is properly configured."""
-            
-            return description
-            
-        except Exception as e:
-            return f"Analysis error: {str(e)}"
+        return photo_analysis.analyze_image_fallback(image_path)
     
     def clear_image(self):
         """Clear image and reset UI"""
@@ -1042,8 +1233,10 @@ This image contains visual content suitable for detailed AI analysis. The techni
         self.image_label.configure(image="", text="")
         self.image_label.image = None
         
-        # Reset variables
+        # Reset variables (and drop any preview still decoding)
         self.current_image_path = None
+        self.stream_view = None
+        self.load_generation += 1
         
         # Reset buttons
         self.analyze_btn.configure(state="disabled", bg='#7f8c8d')
@@ -1076,120 +1269,61 @@ Your OpenAI API is ready! 🟢"""
     
     def load_sample_image(self):
         """Load a beautiful sample image"""
+        if self.sample_image is not None:
+            width, height = self._preview_size()
+            scale = min(width / self.sample_image.width, height / self.sample_image.height, 1.0)
+            size = (max(1, round(self.sample_image.width * scale)), max(1, round(self.sample_image.height * scale)))
+            if self.sample_photo is None or (self.sample_photo.width(), self.sample_photo.height()) != size:
+                from PIL import Image, ImageTk
+                image = self.sample_image if size == self.sample_image.size else \
+                    self.sample_image.resize(size, Image.Resampling.LANCZOS)
+                self.sample_photo = ImageTk.PhotoImage(image)
+            self.image_label.configure(image=self.sample_photo, text="")
+            self.image_label.image = self.sample_photo
+        elif not self.sample_pending:
+            # Rendered once per process (and cached on disk between runs), off the Tk thread
+            self.sample_pending = True
+            self.executor.submit(self._sample_worker)
+    
+    def _sample_worker(self):
         try:
-            # Create enhanced gradient sample image
-            width, height = 600, 550
-            image = Image.new('RGB', (width, height), '#0a0a0a')
-            draw = ImageDraw.Draw(image)
-            
-            # Create radial gradient background
-            center_x, center_y = width // 2, height // 2
-            max_radius = ((width/2)**2 + (height/2)**2)**0.5
-            
-            for y in range(height):
-                for x in range(width):
-                    # Calculate distance from center
-                    distance = ((x - center_x)**2 + (y - center_y)**2)**0.5
-                    # Create gradient
-                    gradient_factor = distance / max_radius
-                    base_color = int(15 + gradient_factor * 40)
-                    color = (base_color, base_color + 5, base_color + 10)
-                    draw.point((x, y), fill=color)
-            
-            # Add geometric shapes with glow effect
-            # Circle with glow
-            circle_center = (200, 200)
-            circle_radius = 90
-            
-            # Outer glow
-            for i in range(5, 0, -1):
-                alpha_color = '#00ff88' if i == 1 else f'#{int(0x00 * (i/5)):02x}{int(0xff * (i/5)):02x}{int(0x88 * (i/5)):02x}'
-                draw.ellipse([
-                    circle_center[0] - circle_radius - i*2, 
-                    circle_center[1] - circle_radius - i*2,
-                    circle_center[0] + circle_radius + i*2, 
-                    circle_center[1] + circle_radius + i*2
-                ], outline='#00ff88', width=2)
-            
-            # Rectangle with glow
-            rect_coords = [380, 150, 550, 280]
-            for i in range(4, 0, -1):
-                offset = i * 2
-                draw.rectangle([
-                    rect_coords[0] - offset, rect_coords[1] - offset,
-                    rect_coords[2] + offset, rect_coords[3] + offset
-                ], outline='#00d4ff', width=2)
-            
-            # Triangle with glow
-            triangle_points = [(475, 330), (400, 450), (550, 450)]
-            for i in range(3, 0, -1):
-                for j in range(len(triangle_points)):
-                    start = triangle_points[j]
-                    end = triangle_points[(j + 1) % len(triangle_points)]
-                    draw.line([start, end], fill='#ff4757', width=3)
-            
-            # Add glowing text
-            try:
-                font_large = ImageFont.truetype("arial.ttf", 42)
-                font_medium = ImageFont.truetype("arial.ttf", 20)
-                font_small = ImageFont.truetype("arial.ttf", 16)
-            except:
-                font_large = ImageFont.load_default()
-                font_medium = ImageFont.load_default()
-                font_small = ImageFont.load_default()
-            
-            # Main title with shadow
-            text = "AI Photo Analyzer"
-            text_bbox = draw.textbbox((0, 0), text, font=font_large)
-            text_width = text_bbox[2] - text_bbox[0]
-            text_x = (width - text_width) // 2
-            
-            # Shadow effect
-            draw.text((text_x + 3, 53), text, fill='#003322', font=font_large)
-            draw.text((text_x, 50), text, fill='#00ff88', font=font_large)
-            
-            # Subtitle
-            subtitle = "Drop your image here to analyze"
-            subtitle_bbox = draw.textbbox((0, 0), subtitle, font=font_medium)
-            subtitle_width = subtitle_bbox[2] - subtitle_bbox[0]
-            subtitle_x = (width - subtitle_width) // 2
-            draw.text((subtitle_x, 480), subtitle, fill='#888888', font=font_medium)
-            
-            # Add decorative elements
-            # Corner accents
-            accent_color = '#00d4ff'
-            corner_size = 30
-            
-            # Top-left
-            draw.line([(10, 10), (10 + corner_size, 10)], fill=accent_color, width=3)
-            draw.line([(10, 10), (10, 10 + corner_size)], fill=accent_color, width=3)
-            
-            # Top-right
-            draw.line([(width - 10, 10), (width - 10 - corner_size, 10)], fill=accent_color, width=3)
-            draw.line([(width - 10, 10), (width - 10, 10 + corner_size)], fill=accent_color, width=3)
-            
-            # Bottom-left
-            draw.line([(10, height - 10), (10 + corner_size, height - 10)], fill=accent_color, width=3)
-            draw.line([(10, height - 10), (10, height - 10 - corner_size)], fill=accent_color, width=3)
-            
-            # Bottom-right
-            draw.line([(width - 10, height - 10), (width - 10 - corner_size, height - 10)], fill=accent_color, width=3)
-            draw.line([(width - 10, height - 10), (width - 10, height - 10 - corner_size)], fill=accent_color, width=3)
-            
-            # Convert to PhotoImage and display
-            photo = ImageTk.PhotoImage(image)
-            self.image_label.configure(image=photo, text="")
-            self.image_label.image = photo
-            
-        except Exception as e:
-            pass
+            import sample_art
+            image = sample_art.render_sample_image(600, 550)
+        except Exception:
+            image = None
+        self.post_event(self._on_sample_rendered, image)
+    
+    def _on_sample_rendered(self, image):
+        self.sample_pending = False
+        if image is not None:
+            # Rendered at full size; load_sample_image scales it to the space there is
+            self.sample_image = image
+            # A photo imported meanwhile keeps the preview
+            if self.current_image_path is None:
+                self.load_sample_image()
+        self.startup.mark("sample_art")
+        if self.exit_after_startup:
+            self.root.after_idle(self._finish_startup_measurement)
+    
+    def _finish_startup_measurement(self):
+        print(self.startup.report())
+        self.on_close()
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI Photo Analyzer desktop app")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="Print the time to an interactive window and exit")
+    args = parser.parse_args(argv)
+    
+    startup = StartupTimer()
+    startup.mark("imports")
     root = tk.Tk()
-    app = SimplePhotoAnalyzer(root)
+    startup.mark("window")
+    app = SimplePhotoAnalyzer(root, startup, exit_after_startup=args.startup_time)
     root.mainloop()
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 
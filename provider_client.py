@@ -0,0 +1,103 @@
+"""Shared, pooled HTTP client for the analysis providers.
+
+Every provider call goes through one ``requests.Session`` whose adapters
+keep connections alive, so repeat analyses skip the TCP+TLS handshake.
+The pool is bounded: when all connections are busy, callers wait for one
+to be returned instead of opening more.
+
+The async API runs the pooled calls on a small executor sized to the pool,
+so many coroutines can be in flight while sharing a handful of sockets. The
+sync methods are what the GUI and the batch threads use.
+
+requests and asyncio are imported when the first client is built, so
+importing the analysis modules does not pay for the networking stack.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# (connect, read) seconds; no provider call may hang forever
+DEFAULT_TIMEOUT = (10, 120)
+
+
+class ProviderClient:
+    """Keep-alive connection pool with sync and async entry points"""
+
+    def __init__(self, pool_connections=4, pool_maxsize=8, timeout=DEFAULT_TIMEOUT):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        """Blocking request over the shared pool"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_maxsize,
+                                                    thread_name_prefix="provider-http")
+            return self._executor
+
+    def run_async(self, func, *args, **kwargs):
+        """Await a blocking call on the client's executor"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def request_async(self, method, url, **kwargs):
+        return await self.run_async(self.request, method, url, **kwargs)
+
+    async def post_async(self, url, **kwargs):
+        return await self.request_async("POST", url, **kwargs)
+
+    async def get_async(self, url, **kwargs):
+        return await self.request_async("GET", url, **kwargs)
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ProviderClient()
+        return _client
+
+
+def configure_client(**kwargs):
+    """Replace the shared client, e.g. to size the pool for a batch run"""
+    global _client
+    with _client_lock:
+        old = _client
+        _client = ProviderClient(**kwargs)
+    if old is not None:
+        old.close()
+    return _client
@@ -0,0 +1,402 @@
+"""Error classification, retries and rate limiting for provider calls.
+
+Provider calls used to return "Error: ..." strings that callers sniffed for
+"429" or "error", so a transient rate limit dropped straight to the basic
+fallback (and so did any real description that mentioned an error).
+Providers now raise ``ProviderError`` with a ``kind``; only transient kinds
+are retried, with exponential backoff and full jitter, honouring the
+server's ``Retry-After``.
+
+Each provider also owns a ``TokenBucket``. Every attempt takes a token
+first, and a 429 pauses the bucket for everyone, so concurrent batch
+workers settle just under the quota instead of hammering it in lockstep.
+
+A ``Deadline`` bounds a whole analysis: every attempt's HTTP timeout, each
+backoff sleep and the limiter wait are cut to the time left, and a
+cancelled deadline (the losing leg of a hedged request) stops retrying.
+A ``CircuitBreaker`` per provider skips a backend that keeps failing and
+probes it again after a cool-down; a ``LatencyTracker`` keeps recent call
+times so hedging can fire at a latency percentile.
+"""
+import time
+import random
+import threading
+from collections import deque
+
+# Error kinds worth another attempt
+RETRYABLE_KINDS = ("rate_limit", "server", "timeout", "connection")
+
+# Error kinds that suggest the backend itself is unhealthy
+BREAKER_KINDS = ("server", "timeout", "connection")
+
+
+class ProviderError(Exception):
+    """A failed provider call, classified by ``kind``
+
+    Kinds: auth, quota, rate_limit, server, timeout, connection,
+    bad_request, bad_response, deadline, circuit_open.
+    """
+
+    def __init__(self, kind, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+        self.attempts = 1
+
+    @property
+    def retryable(self):
+        return self.kind in RETRYABLE_KINDS
+
+    def to_dict(self):
+        return {"kind": self.kind, "status": self.status, "message": self.message, "attempts": self.attempts}
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_code(response):
+    """The "code"/"type" of an OpenAI-style JSON error body, lower-cased"""
+    try:
+        error = response.json().get("error")
+    except ValueError:
+        return ""
+    if isinstance(error, dict):
+        return str(error.get("code") or error.get("type") or "").lower()
+    return ""
+
+
+def classify_response(response, label):
+    """ProviderError for a non-200 response"""
+    status = response.status_code
+    message = f"{label} API Error {status}: {response.text[:500]}"
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if status == 429:
+        # OpenAI reports an exhausted balance as a 429 too; waiting won't fix it
+        if "insufficient_quota" in _error_code(response):
+            return ProviderError("quota", message, status)
+        return ProviderError("rate_limit", message, status, retry_after)
+    if status in (401, 403):
+        return ProviderError("auth", message, status)
+    if status in (408, 425):
+        return ProviderError("timeout", message, status, retry_after)
+    if status >= 500:
+        return ProviderError("server", message, status, retry_after)
+    return ProviderError("bad_request", message, status)
+
+
+def classify_exception(exc):
+    """ProviderError for an exception raised while calling a provider"""
+    if isinstance(exc, ProviderError):
+        return exc
+    # Imported here: a failed call has loaded requests already
+    import requests
+    if isinstance(exc, requests.Timeout):
+        return ProviderError("timeout", f"Error: request timed out ({exc})")
+    if isinstance(exc, requests.ConnectionError):
+        return ProviderError("connection", f"Error: connection failed ({exc})")
+    if isinstance(exc, (ValueError, KeyError, IndexError, TypeError)):
+        return ProviderError("bad_response", f"Error: unexpected response ({exc})")
+    return ProviderError("bad_request", f"Error: {exc}")
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` requests per second, bursts of ``burst``"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is free; otherwise return the seconds until one is"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, max_wait=None):
+        """Block until a token is available; returns the seconds spent waiting
+
+        Returns None without taking a token if that would take longer than
+        ``max_wait`` seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Reserve the token now (possibly going negative) so waiters queue fairly
+            self.tokens -= 1
+            wait = max(self.paused_until - now, -self.tokens / self.rate if self.tokens < 0 else 0.0)
+            if max_wait is not None and wait > max_wait:
+                self.tokens += 1
+                return None
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Hold every caller back for ``seconds``, e.g. after a 429"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Deadline:
+    """Time budget for one analysis, shared by every stage and attempt
+
+    ``seconds=None`` means no time limit (it can still be cancelled).
+    Children share the parent's expiry but can be cancelled on their own.
+    """
+
+    def __init__(self, seconds=None, parent=None):
+        self.parent = parent
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+        if parent is not None and parent.expires_at is not None:
+            self.expires_at = min(self.expires_at or parent.expires_at, parent.expires_at)
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def child(self):
+        child = Deadline(parent=self)
+        self.on_cancel(child.cancel)
+        return child
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call callback() when cancelled (now, if already); returns a function that unregisters it"""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def remaining(self):
+        """Seconds left, or None if unbounded"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.cancelled or self.remaining() == 0
+
+    def check(self, label="Analysis"):
+        """Raise a "deadline" ProviderError once expired or cancelled"""
+        if self.cancelled:
+            raise ProviderError("deadline", f"Error: {label} request cancelled")
+        if self.remaining() == 0:
+            raise ProviderError("deadline", f"Error: {label} deadline exceeded")
+
+    def timeout(self, timeout):
+        """(connect, read) timeout capped to the time left"""
+        left = self.remaining()
+        if left is None:
+            return timeout
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return min(connect, left), min(read, left)
+
+    def sleep(self, seconds):
+        """Sleep up to ``seconds``, waking early on cancel; False if the deadline ran out"""
+        left = self.remaining()
+        if left is not None and left < seconds:
+            return False
+        self._cancelled.wait(seconds)
+        return not self.expired
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures, half-open after ``reset_timeout``"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def available(self):
+        """True unless open; does not claim the half-open probe"""
+        return self.state != "open"
+
+    def allow(self):
+        """May a call go ahead? In half-open state only one probe is let through"""
+        with self.lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def release_probe(self):
+        """End a half-open probe that said nothing about the backend's health
+
+        The failure count and open state are left as they are; the next
+        call may probe again.
+        """
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class LatencyTracker:
+    """Sliding window of recent successful call times"""
+
+    def __init__(self, window=200, min_samples=5):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        """Latency at ``fraction`` (0-1), or None until enough samples are in"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by attempts and wait time"""
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=20.0, max_retry_after=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "throttled_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to sleep before retry number ``attempt`` (1-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            # Never earlier than the server asked; jitter spreads the herd
+            delay = retry_after + random.uniform(0, self.base_delay)
+        return delay
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def call(self, func, limiter=None, deadline=None, breaker=None, label="Provider"):
+        """Run func() until it succeeds, raising the last ProviderError when retries run out
+
+        ``deadline`` bounds limiter waits and backoff sleeps; ``breaker``
+        stops the attempts as soon as the backend is considered down.
+        """
+        self._count("calls")
+        deadline = deadline or Deadline()
+        attempt = 1
+        while True:
+            deadline.check(label)
+            if breaker is not None and not breaker.allow():
+                raise ProviderError("circuit_open", f"Error: {label} skipped after repeated failures")
+            if limiter is not None:
+                waited = limiter.acquire(deadline.remaining())
+                if waited is None:
+                    raise ProviderError("deadline", f"Error: {label} deadline exceeded waiting for the rate limiter")
+                if waited:
+                    self._count("throttled_seconds", waited)
+            try:
+                result = func()
+            except Exception as exc:
+                error = classify_exception(exc)
+                error.attempts = attempt
+                if deadline.cancelled or (error.kind == "timeout" and deadline.expired):
+                    # Cut short by the deadline (or a cancel that aborted the read), not the provider
+                    error.kind = "deadline"
+                if breaker is not None:
+                    if error.kind in BREAKER_KINDS:
+                        breaker.record_failure()
+                    else:
+                        # Not the backend's health: neither a failure nor a recovery
+                        breaker.release_probe()
+                if error.kind == "rate_limit":
+                    self._count("rate_limited")
+                if not error.retryable or attempt >= self.max_attempts:
+                    raise error from exc
+                if error.retry_after is not None and error.retry_after > self.max_retry_after:
+                    raise error from exc
+                delay = self.backoff(attempt, error.retry_after)
+                if limiter is not None and error.kind == "rate_limit":
+                    limiter.pause(delay)
+                self._count("retries")
+                if not deadline.sleep(delay):
+                    raise error from exc
+                attempt += 1
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
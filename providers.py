@@ -0,0 +1,494 @@
+"""Analysis provider backends and the registry that names them.
+
+Each backend declares where it lives (endpoint), what it accepts (upload
+limits, timeout, output token budget) and how to read its answer. The GUI
+and the headless tools look providers up by name instead of branching on
+"chatgpt" vs "imagedescriber", so adding a backend is one
+``register_provider`` call.
+
+Calls raise ``provider_retry.ProviderError`` on failure after retrying
+transient errors; see provider_retry for the backoff and rate limiting.
+Given a ``stage_metrics.StageTimes``, they record how long preparing the
+upload, connecting, uploading, waiting and reading the answer took.
+
+Endpoints come from the environment (``.env`` works too):
+
+    OPENAI_BASE_URL               base URL for the built-in ChatGPT provider
+    OPENAI_MODEL                  model for the built-in ChatGPT provider
+    IMAGEDESCRIBER_URL            ImageDescriber describe-image endpoint
+    OPENAI_COMPATIBLE_BASE_URL    adds an "openai-compatible" provider, e.g.
+                                  a vLLM/Ollama/LocalAI server on the LAN
+    OPENAI_COMPATIBLE_MODEL       model name for that server
+    OPENAI_COMPATIBLE_API_KEY     its key (many local servers accept any)
+    <PREFIX>_RATE_LIMIT           requests per second for a provider, where
+                                  PREFIX is OPENAI, IMAGEDESCRIBER or
+                                  OPENAI_COMPATIBLE (unset = unlimited)
+    STRUCTURED_OUTPUT             1 to ask every provider for JSON analyses
+                                  (see structured_output)
+"""
+import os
+import json
+import time
+from collections import OrderedDict
+
+from provider_client import get_client
+from image_encoding import prepare_upload, UPLOAD_LIMITS, DEFAULT_LIMITS
+from payload_stream import build_json_body, build_packed_json_body, IMAGE_DATA
+from stage_metrics import TimedBody
+import structured_output
+from provider_retry import (ProviderError, RetryPolicy, TokenBucket, CircuitBreaker, LatencyTracker,
+                            Deadline, classify_response)
+
+ANALYSIS_PROMPT = """Analyze this image in comprehensive detail following this exact structure:
+
+Summary: Provide a one-sentence overview that captures the essence of the image.
+
+Detailed Description:
+Break down the image into relevant sections such as:
+
+Person/People: (if applicable) Describe age range, appearance, clothing, pose, expression, and what they might be doing or feeling.
+
+Setting: Describe the environment, location type, and physical surroundings.
+
+Objects/Elements: Identify and describe key objects, structures, or elements in the scene.
+
+Background: Describe what's visible in the background - buildings, landscapes, sky, etc.
+
+Foreground: Describe elements in the immediate foreground.
+
+Colors and Lighting: Analyze the color palette, lighting conditions, and visual tone.
+
+Atmosphere and Mood: Describe the overall feeling, mood, and emotional tone of the image. What impression does it convey?
+
+Be thorough, specific, and descriptive. Organize the information clearly under these headings."""
+
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_OPENAI_MODEL = "gpt-4o"
+DEFAULT_IMAGEDESCRIBER_URL = "https://imagedescriber.online/api/openapi-v2/describe-image"
+
+
+def _abort(response):
+    """Shut down response's connection, waking a read blocked on it in another thread
+
+    (Closing the response alone leaves that read waiting for its timeout.)
+    """
+    import socket
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class Provider:
+    """A remote analysis backend"""
+
+    requires_key = True
+    # True if send() can report partial text through on_delta
+    supports_streaming = False
+    # True if analyze_packed() can take several images in one request
+    supports_packing = False
+
+    def __init__(self, name, display_name, endpoint, model, api_key_env, short_name=None,
+                 upload_limits=None, timeout=(10, 120), max_tokens=1500, rate_limit=None,
+                 retry_policy=None, structured=False):
+        self.name = name
+        self.display_name = display_name
+        # Short label used in status and error messages
+        self.short_name = short_name or display_name
+        self.endpoint = endpoint
+        self.model = model
+        self.api_key_env = api_key_env
+        self.upload_limits = upload_limits or UPLOAD_LIMITS.get(name, DEFAULT_LIMITS)
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        # Shared by every thread calling this provider
+        self.limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        # Time to first streamed token
+        self.ttft = LatencyTracker()
+        # Ask for JSON analyses (structured_output) instead of free text
+        self.structured = structured
+
+    @property
+    def prompt(self):
+        """The analysis prompt sent with each image (part of the cache key)"""
+        return structured_output.STRUCTURED_PROMPT if self.structured else ANALYSIS_PROMPT
+
+    @property
+    def packed_prompt(self):
+        """The packed prompt template (part of the cache key of packed answers)"""
+        from request_packing import PACKED_PROMPT
+        return structured_output.PACKED_STRUCTURED_PROMPT if self.structured else PACKED_PROMPT
+
+    @property
+    def output_tokens(self):
+        """Output token budget of one analysis"""
+        return min(self.max_tokens, structured_output.MAX_TOKENS) if self.structured else self.max_tokens
+
+    def set_rate_limit(self, rate):
+        """Requests per second for this provider (None or 0 = unlimited)"""
+        self.limiter = TokenBucket(rate) if rate else None
+
+    def default_api_key(self):
+        return os.getenv(self.api_key_env, "") if self.api_key_env else ""
+
+    def prepare(self, image_path):
+        """EncodedImage sized for this provider"""
+        return prepare_upload(image_path, self.upload_limits)
+
+    def analyze(self, image_path, api_key, upload=None, deadline=None, on_delta=None, stages=None):
+        """Return the description text; raises ProviderError once retries are exhausted
+
+        ``deadline`` (a provider_retry.Deadline) caps every attempt's
+        timeout and stops retrying when it runs out or is cancelled.
+
+        ``on_delta(text)`` receives pieces of the answer as they stream in,
+        on the calling thread, if the provider supports streaming; it is
+        called with None when a retry starts over.
+
+        ``stages`` (a stage_metrics.StageTimes) collects per-stage timings,
+        including preparing the upload when it is not passed in.
+        """
+        if self.requires_key and not api_key:
+            raise ProviderError("auth", f"Error: {self.short_name} API key not found.")
+        deadline = deadline or Deadline()
+
+        owned_upload = None
+        if upload is None:
+            upload = owned_upload = self.prepare(image_path)
+            if stages is not None:
+                stages.add_timings(upload.timings)
+
+        stream = on_delta if self.supports_streaming else None
+        attempts = []
+
+        def attempt():
+            if stream is not None and attempts:
+                stream(None)
+            attempts.append(1)
+            started = time.perf_counter()
+            text = self.send(image_path, upload, api_key, deadline.timeout(self.timeout), stream, stages, deadline)
+            if not deadline.cancelled:
+                # A hedge leg that lost was cut short: its time says nothing about the provider
+                self.latency.record(time.perf_counter() - started)
+            return text
+
+        try:
+            return self.retry_policy.call(attempt, self.limiter, deadline, self.breaker, self.short_name)
+        finally:
+            if owned_upload is not None:
+                owned_upload.close()
+
+    def send(self, image_path, upload, api_key, timeout, on_delta=None, stages=None, deadline=None):
+        """One HTTP attempt: the parsed text, or raise for a non-200 response"""
+        raise NotImplementedError
+
+    def parse_response(self, result):
+        raise NotImplementedError
+
+    def post(self, body, headers, timeout, started, stages=None, on_delta=None, deadline=None):
+        """POST body and read the answer, timing each stage into stages
+
+        Cancelling ``deadline`` (a hedge leg that lost) drops the connection,
+        so a body still being read is abandoned at once rather than finished.
+        """
+        if stages is not None:
+            body = TimedBody(body, stages, started)
+        # Always stream so the body is read after the headers, not inside post()
+        response = get_client().post(self.endpoint, headers=headers, data=body, timeout=timeout, stream=True)
+
+        unregister = deadline.on_cancel(lambda: _abort(response)) if deadline is not None else None
+        try:
+            with response:
+                received = body.response_started() if stages is not None else None
+                if response.status_code != 200:
+                    raise classify_response(response, self.short_name)
+                if on_delta is not None and response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    text = self.read_stream(response, on_delta, started)
+                    if stages is not None:
+                        stages.add("download", time.perf_counter() - received)
+                    return text
+                content = response.content
+                if stages is None:
+                    return self.parse_response(json.loads(content))
+                stages.add("download", time.perf_counter() - received)
+                with stages.span("parse"):
+                    return self.parse_response(json.loads(content))
+        finally:
+            if unregister is not None:
+                unregister()
+
+
+class OpenAIChatProvider(Provider):
+    """OpenAI chat completions with an image_url content part"""
+
+    supports_packing = True
+
+    def __init__(self, name, display_name, base_url, model, api_key_env, **kwargs):
+        endpoint = base_url.rstrip("/") + "/chat/completions"
+        super().__init__(name, display_name, endpoint, model, api_key_env, **kwargs)
+        self.base_url = base_url
+
+    @property
+    def supports_streaming(self):
+        # Half a JSON object is no use to the reader
+        return not self.structured
+
+    def build_payload(self, mime, stream=False):
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": self.prompt
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime};base64,{IMAGE_DATA}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": self.output_tokens
+        }
+        if self.structured:
+            payload["response_format"] = structured_output.response_format()
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def build_packed_payload(self, mimes):
+        """One user message with the packed prompt and an "Image N" label before each image"""
+        from request_packing import MAX_OUTPUT_TOKENS
+        content = [{"type": "text", "text": self.packed_prompt.format(count=len(mimes))}]
+        for number, mime in enumerate(mimes, 1):
+            content.append({"type": "text", "text": f"Image {number}:"})
+            content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{IMAGE_DATA}"}})
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": min(MAX_OUTPUT_TOKENS, self.output_tokens * len(mimes)),
+        }
+        if self.structured:
+            payload["response_format"] = structured_output.response_format(packed=True)
+        return payload
+
+    def analyze_packed(self, image_paths, api_key, uploads, deadline=None, stages=None):
+        """[description text per image] from one request
+
+        Raises ProviderError like analyze(); a ``bad_response`` error means
+        the answer could not be split into one section per image.
+        """
+        from request_packing import split_packed_response
+        if self.requires_key and not api_key:
+            raise ProviderError("auth", f"Error: {self.short_name} API key not found.")
+        deadline = deadline or Deadline()
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        payload = self.build_packed_payload([upload.mime for upload in uploads])
+
+        def attempt():
+            started = time.perf_counter()
+            body = build_packed_json_body(payload, [upload.data for upload in uploads])
+            # Not recorded in self.latency: a pack takes longer than the single
+            # requests hedging compares against
+            text = self.post(body, headers, deadline.timeout(self.timeout), started, stages, deadline=deadline)
+            if self.structured:
+                texts = structured_output.split_records(text, len(uploads))
+            else:
+                texts = split_packed_response(text, len(uploads))
+            if texts is None:
+                raise ProviderError("bad_response",
+                                    f"Error: {self.short_name} answer has no section per image")
+            return texts
+
+        return self.retry_policy.call(attempt, self.limiter, deadline, self.breaker, self.short_name)
+
+    def parse_response(self, result):
+        content = result['choices'][0]['message']['content']
+        if self.structured:
+            # Raises ValueError for a cut-off or malformed answer
+            return structured_output.parse_record(content).to_json()
+        return content
+
+    def read_stream(self, response, on_delta, started):
+        """Collect a server-sent-events completion, passing each delta on"""
+        parts = []
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            event = json.loads(data)
+            if "error" in event:
+                raise ProviderError("server", f"{self.short_name} stream error: {event['error']}")
+            for choice in event.get("choices") or ():
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    if not parts:
+                        self.ttft.record(time.perf_counter() - started)
+                    parts.append(content)
+                    on_delta(content)
+        return "".join(parts)
+
+    def send(self, image_path, upload, api_key, timeout, on_delta=None, stages=None, deadline=None):
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        # The image is base64-encoded chunk by chunk while the body is sent
+        started = time.perf_counter()
+        body = build_json_body(self.build_payload(upload.mime, stream=on_delta is not None), upload.data)
+        return self.post(body, headers, timeout, started, stages, on_delta, deadline)
+
+
+class LocalOpenAIProvider(OpenAIChatProvider):
+    """OpenAI-compatible server (vLLM, Ollama, LocalAI...) that may not need a key"""
+
+    requires_key = False
+
+
+class ImageDescriberProvider(Provider):
+    """ImageDescriber.online multipart describe-image API"""
+
+    # Where the API has put the description, in the order tried
+    DESCRIPTION_PATHS = (("description",), ("data", "content"), ("data", "description"), ("result",))
+
+    def parse_response(self, result):
+        """Pull the description out of the several shapes the API returns"""
+        extracted = None
+        for path in self.DESCRIPTION_PATHS:
+            value = result
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if isinstance(value, str) and value.strip():
+                extracted = value
+                break
+
+        if extracted is None:
+            # Fallback to stringifying, but ensure it's readable
+            return json.dumps(result, ensure_ascii=False)
+        if self.structured:
+            # JSON was only asked for in the prompt; keep plain text if it was ignored
+            record = structured_output.try_parse(extracted)
+            if record is not None:
+                return record.to_json()
+        return format_imagedescriber_text(extracted)
+
+    def send(self, image_path, upload, api_key, timeout, on_delta=None, stages=None, deadline=None):
+        # Use multipart/form-data, encoded here so the upload can be timed
+        from urllib3 import encode_multipart_formdata
+        started = time.perf_counter()
+        body, content_type = encode_multipart_formdata({
+            "prompt": self.prompt,
+            "image": (upload.upload_name(image_path), upload.as_bytes(), upload.mime),
+        })
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": content_type,
+        }
+        return self.post(body, headers, timeout, started, stages, deadline=deadline)
+
+
+def format_imagedescriber_text(text):
+    """Normalize ImageDescriber text for consistent, readable display."""
+    try:
+        cleaned = text.strip()
+        if cleaned.startswith('{') and cleaned.endswith('}'):
+            # In case a JSON string slipped through
+            return cleaned
+        # Remove surrounding quotes
+        if (cleaned.startswith('"') and cleaned.endswith('"')) or (cleaned.startswith("'") and cleaned.endswith("'")):
+            cleaned = cleaned[1:-1].strip()
+        # Normalize bullets like '*   ' to '• '
+        lines = cleaned.splitlines()
+        normalized_lines = []
+        for line in lines:
+            l = line.lstrip()
+            if l.startswith('* '):
+                normalized_lines.append('• ' + l[2:])
+            elif l.startswith('*\t'):
+                normalized_lines.append('• ' + l[2:])
+            elif l.startswith('*') and '   ' in l[:4]:
+                normalized_lines.append('• ' + l[l.find(' ')+1:])
+            else:
+                normalized_lines.append(line)
+        cleaned = "\n".join(normalized_lines)
+        return cleaned
+    except Exception:
+        return text
+
+
+_registry = OrderedDict()
+
+
+def register_provider(provider):
+    """Add or replace a provider; returns it"""
+    _registry[provider.name] = provider
+    return provider
+
+
+def get_provider(name):
+    """The registered provider called name, or None"""
+    return _registry.get(name)
+
+
+def provider_names():
+    return list(_registry)
+
+
+def all_providers():
+    return list(_registry.values())
+
+
+def _env_rate(name):
+    """Requests per second from an environment variable, or None"""
+    try:
+        return float(os.getenv(name) or 0) or None
+    except ValueError:
+        return None
+
+
+def configure_from_env():
+    """(Re)register the built-in providers from environment settings"""
+    structured = os.getenv("STRUCTURED_OUTPUT", "").strip().lower() in ("1", "true", "yes", "on")
+    chatgpt = OpenAIChatProvider(
+        "chatgpt", "ChatGPT-4 (OpenAI)",
+        os.getenv("OPENAI_BASE_URL") or DEFAULT_OPENAI_BASE_URL,
+        os.getenv("OPENAI_MODEL") or DEFAULT_OPENAI_MODEL,
+        "OPENAI_API_KEY", short_name="ChatGPT",
+        rate_limit=_env_rate("OPENAI_RATE_LIMIT"), structured=structured)
+    register_provider(chatgpt)
+
+    describer = ImageDescriberProvider(
+        "imagedescriber", "ImageDescriber.online",
+        os.getenv("IMAGEDESCRIBER_URL") or DEFAULT_IMAGEDESCRIBER_URL,
+        "openapi-v2", "IMAGEDESCRIBER_API_KEY", short_name="ImageDescriber",
+        timeout=(10, 60), rate_limit=_env_rate("IMAGEDESCRIBER_RATE_LIMIT"), structured=structured)
+    register_provider(describer)
+
+    compatible_url = os.getenv("OPENAI_COMPATIBLE_BASE_URL")
+    if compatible_url:
+        model = os.getenv("OPENAI_COMPATIBLE_MODEL") or DEFAULT_OPENAI_MODEL
+        local = LocalOpenAIProvider(
+            "openai-compatible", f"{model} (OpenAI-compatible)",
+            compatible_url, model, "OPENAI_COMPATIBLE_API_KEY", short_name=model,
+            upload_limits=UPLOAD_LIMITS["chatgpt"],
+            rate_limit=_env_rate("OPENAI_COMPATIBLE_RATE_LIMIT"), structured=structured)
+        register_provider(local)
+    else:
+        _registry.pop("openai-compatible", None)
+
+
+configure_from_env()
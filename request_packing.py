@@ -0,0 +1,97 @@
+"""Several images per chat completion, to spread the per-call overhead.
+
+Every single-image request repeats the ~1 KB analysis prompt, a TLS
+round trip and the provider's fixed queueing time; for small images that
+overhead is most of the call. A packed request sends up to ``pack_size``
+images, each preceded by an "Image N" label, and asks for one analysis per
+image under a ``### Image N`` line. ``split_packed_response`` cuts the
+answer back into per-image texts, and returns None when the answer does not
+have exactly one well-ordered section per image, so the caller can fall
+back to one request per image.
+
+A pack is also bounded by tokens: images cost 85 + 170 tokens per 512 px
+tile at high detail (OpenAI's accounting), and every image needs its own
+share of the output budget, so ``split_by_budget`` starts a new pack before
+either the input or the output limit would be exceeded.
+"""
+import re
+import math
+
+from providers import ANALYSIS_PROMPT
+
+DEFAULT_PACK_SIZE = 4
+
+# Input tokens per packed request: prompt plus images
+DEFAULT_MAX_INPUT_TOKENS = 24000
+
+# Output tokens one request may ask for (gpt-4o's completion limit)
+MAX_OUTPUT_TOKENS = 16384
+
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+
+# The structure part of the single-image prompt, after its first line
+_STRUCTURE = ANALYSIS_PROMPT.split("\n", 1)[1].strip()
+
+PACKED_PROMPT = """You are given {count} images, labelled Image 1 to Image {count}. Analyze each image separately, in order.
+
+Start the analysis of each image with a line containing only "### Image N", where N is its label, then follow this exact structure for it:
+
+""" + _STRUCTURE
+
+# "### Image 2", "**Image 2**", "=== Image 2 ===", or a bare "Image 2" line
+_MARKER_RE = re.compile(r"^[ \t]*(?:#+|\*\*|=+)?[ \t]*Image[ \t]+(\d+)[ \t:*=]*$", re.IGNORECASE | re.MULTILINE)
+
+
+def packed_prompt(count):
+    return PACKED_PROMPT.format(count=count)
+
+
+def image_tokens(width, height):
+    """Input tokens of one image at high detail"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def prompt_tokens(count):
+    # About four characters per token for English text
+    return len(packed_prompt(count)) // 4 + 10 * count
+
+
+def split_by_budget(sizes, pack_size, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS,
+                    output_tokens_per_image=1500):
+    """Group indexes of images [(width, height)] into packs that fit the token limits"""
+    per_pack = max(1, min(pack_size, MAX_OUTPUT_TOKENS // max(1, output_tokens_per_image)))
+    packs = []
+    current, tokens = [], 0
+    for index, (width, height) in enumerate(sizes):
+        cost = image_tokens(width, height)
+        if current and (len(current) >= per_pack or
+                        prompt_tokens(len(current) + 1) + tokens + cost > max_input_tokens):
+            packs.append(current)
+            current, tokens = [], 0
+        current.append(index)
+        tokens += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def split_packed_response(text, count):
+    """[analysis text per image], or None unless Image 1..count each appear once, in order"""
+    markers = list(_MARKER_RE.finditer(text or ""))
+    if [int(match.group(1)) for match in markers] != list(range(1, count + 1)):
+        return None
+    sections = []
+    for match, following in zip(markers, markers[1:] + [None]):
+        end = following.start() if following is not None else len(text)
+        section = text[match.end():end].strip()
+        # A separator line the model put between images
+        section = re.sub(r"\n\s*(?:-{3,}|\*{3,}|_{3,})\s*$", "", section).strip()
+        if not section:
+            return None
+        sections.append(section)
+    return sections
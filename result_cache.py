@@ -0,0 +1,191 @@
+"""Content-addressed cache for provider analysis results.
+
+Results are keyed by the SHA-256 of the image bytes plus provider, prompt
+and model, so renaming or moving a photo still hits while any change to
+the pixels, the prompt or the model misses.
+
+Two tiers:
+  * memory - a small LRU of the most recent results
+  * disk   - SQLite, trimmed by age, entry count and total text size
+
+Concurrent requests for the same key are collapsed: the first caller runs
+the provider call, the others wait for its result.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+CACHE_FILENAME = "analysis_cache.sqlite3"
+
+# Run the (comparatively expensive) disk eviction every N writes
+_EVICT_EVERY = 32
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks so large files are never held whole"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(image_hash, provider, prompt, model):
+    """Cache key for one (image, provider, prompt, model) combination"""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    raw = "\x1f".join([image_hash, provider, prompt_hash, model or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier LRU cache with single-flight collapsing of duplicate requests"""
+
+    def __init__(self, path, memory_entries=256, max_disk_entries=20000,
+                 max_disk_bytes=128 * 1024 * 1024, max_age_days=90):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age_days * 86400
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "collapsed": 0}
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._writes = 0
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed)")
+
+    def lookup(self, key):
+        """Return (text, "memory" | "disk") or None"""
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return text, "memory"
+
+            if self._db is not None:
+                row = self._db.execute("SELECT text, created FROM results WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                if row is not None and now - row[1] <= self.max_age:
+                    self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0], "disk"
+
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, key, text, provider=None, model=None):
+        with self._lock:
+            self._remember(key, text)
+            if self._db is None:
+                return
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, provider, model, text, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, text, len(text.encode("utf-8")), now, now))
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict_disk(now)
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        """Drop expired rows, then least recently used rows over the limits"""
+        self._db.execute("DELETE FROM results WHERE created < ?", (now - self.max_age,))
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        if count <= self.max_disk_entries and total <= self.max_disk_bytes:
+            return
+        cursor = self._db.execute("SELECT key, size FROM results ORDER BY accessed")
+        doomed = []
+        for key, size in cursor:
+            if count <= self.max_disk_entries and total <= self.max_disk_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        cursor.close()
+        self._db.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def single_flight(self, key, func):
+        """Run func once per key at a time; returns (value, shared)
+
+        ``shared`` is True for callers that waited on someone else's call.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.stats["collapsed"] += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            value = func()
+            future.set_result(value)
+            return value, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache stored in the app data directory"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from photo_analysis import app_data_dir
+            _cache = AnalysisCache(os.path.join(app_data_dir(), CACHE_FILENAME))
+        return _cache
@@ -0,0 +1,143 @@
+"""Startup sample art for the image preview.
+
+The radial background used to be drawn one ``draw.point`` at a time
+(330,000 Python calls for 600x550). It is now built from Pillow's
+``Image.radial_gradient`` with a resize, a crop and per-channel lookup
+tables, all of which run in C. The finished image is memoized in-process
+and saved to the app data directory, keyed by size and SAMPLE_ART_VERSION,
+so clearing the preview or starting the app again just reloads it.
+"""
+import os
+import functools
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Bump whenever the artwork changes so stale disk copies are ignored
+SAMPLE_ART_VERSION = 2
+
+# Distance from the centre of Image.radial_gradient("L") at which it reaches 255
+_GRADIENT_CORNER = 128 * 2 ** 0.5
+
+
+def radial_background(width, height):
+    """Dark radial gradient, brighter towards the corners"""
+    max_radius = ((width/2)**2 + (height/2)**2)**0.5
+
+    # Stretch the 256x256 gradient over a square covering the whole image
+    side = max(width, height) + 2
+    gradient = Image.radial_gradient("L").resize((side, side), Image.Resampling.BILINEAR)
+    left = side // 2 - width // 2
+    top = side // 2 - height // 2
+    gradient = gradient.crop((left, top, left + width, top + height))
+
+    # Gradient value -> distance from centre / half-diagonal
+    factor = _GRADIENT_CORNER * side / 256 / max_radius / 255
+
+    # base_color = 15 + distance_factor * 40, with a slight blue tint
+    channels = [gradient.point([int(15 + min(1.0, v * factor) * 40) + offset for v in range(256)])
+                for offset in (0, 5, 10)]
+    return Image.merge("RGB", channels)
+
+
+def _load_fonts():
+    try:
+        return (ImageFont.truetype("arial.ttf", 42),
+                ImageFont.truetype("arial.ttf", 20),
+                ImageFont.truetype("arial.ttf", 16))
+    except Exception:
+        default = ImageFont.load_default()
+        return default, default, default
+
+
+def draw_sample_image(width=600, height=550):
+    """Render the sample art from scratch"""
+    image = radial_background(width, height)
+    draw = ImageDraw.Draw(image)
+
+    # Add geometric shapes with glow effect
+    # Circle with glow
+    circle_center = (200, 200)
+    circle_radius = 90
+
+    # Outer glow
+    for i in range(5, 0, -1):
+        draw.ellipse([
+            circle_center[0] - circle_radius - i*2,
+            circle_center[1] - circle_radius - i*2,
+            circle_center[0] + circle_radius + i*2,
+            circle_center[1] + circle_radius + i*2
+        ], outline='#00ff88', width=2)
+
+    # Rectangle with glow
+    rect_coords = [380, 150, 550, 280]
+    for i in range(4, 0, -1):
+        offset = i * 2
+        draw.rectangle([
+            rect_coords[0] - offset, rect_coords[1] - offset,
+            rect_coords[2] + offset, rect_coords[3] + offset
+        ], outline='#00d4ff', width=2)
+
+    # Triangle
+    triangle_points = [(475, 330), (400, 450), (550, 450)]
+    for j in range(len(triangle_points)):
+        start = triangle_points[j]
+        end = triangle_points[(j + 1) % len(triangle_points)]
+        draw.line([start, end], fill='#ff4757', width=3)
+
+    font_large, font_medium, _ = _load_fonts()
+
+    # Main title with shadow
+    text = "AI Photo Analyzer"
+    text_bbox = draw.textbbox((0, 0), text, font=font_large)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_x = (width - text_width) // 2
+    draw.text((text_x + 3, 53), text, fill='#003322', font=font_large)
+    draw.text((text_x, 50), text, fill='#00ff88', font=font_large)
+
+    # Subtitle
+    subtitle = "Drop your image here to analyze"
+    subtitle_bbox = draw.textbbox((0, 0), subtitle, font=font_medium)
+    subtitle_width = subtitle_bbox[2] - subtitle_bbox[0]
+    subtitle_x = (width - subtitle_width) // 2
+    draw.text((subtitle_x, 480), subtitle, fill='#888888', font=font_medium)
+
+    # Corner accents
+    accent_color = '#00d4ff'
+    corner_size = 30
+    for cx, dx in ((10, 1), (width - 10, -1)):
+        for cy, dy in ((10, 1), (height - 10, -1)):
+            draw.line([(cx, cy), (cx + dx * corner_size, cy)], fill=accent_color, width=3)
+            draw.line([(cx, cy), (cx, cy + dy * corner_size)], fill=accent_color, width=3)
+
+    return image
+
+
+def _disk_path(width, height):
+    from photo_analysis import app_data_dir
+    return os.path.join(app_data_dir(), "sample_art", f"sample_{width}x{height}_v{SAMPLE_ART_VERSION}.png")
+
+
+@functools.lru_cache(maxsize=4)
+def render_sample_image(width=600, height=550):
+    """Sample art for the given size: memoized, then disk cache, then drawn"""
+    path = None
+    try:
+        path = _disk_path(width, height)
+        with Image.open(path) as cached:
+            cached.load()
+            if cached.size == (width, height) and cached.mode == "RGB":
+                return cached.copy()
+    except Exception:
+        pass
+
+    image = draw_sample_image(width, height)
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            image.save(tmp_path, "PNG", compress_level=1)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A read-only home just means we redraw next time
+            pass
+    return image
@@ -0,0 +1,296 @@
+"""Persistent, full-text searchable store of analysis results.
+
+Every analysis is kept in SQLite with its image path, provider, model and
+time, and the latest one per image and provider is indexed with FTS5. The
+analysis prompt makes providers answer under fixed headings (Summary,
+Setting, Colors and Lighting, ...); each heading is its own FTS column, so
+``setting:beach`` only matches the Setting section, and a hit in the
+Summary ranks higher than one in the Background.
+
+Queries are plain words, "quoted phrases" and ``field:word`` terms, all of
+which must match; words match their stem (sunsets finds sunset) and a
+trailing ``*`` matches a prefix:
+
+    python search_index.py "beach sunset dog"
+    python search_index.py 'setting:beach "golden hour"' --limit 50
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+INDEX_FILENAME = "search_index.sqlite3"
+
+# FTS column -> headings of the analysis prompt that feed it
+SECTIONS = {
+    "summary": ("summary", "overview"),
+    "people": ("person/people", "people", "person", "persons"),
+    "setting": ("setting", "location"),
+    "objects": ("objects/elements", "objects", "elements", "key objects"),
+    "background": ("background",),
+    "foreground": ("foreground",),
+    "colors": ("colors and lighting", "colours and lighting", "colors", "colours", "lighting"),
+    "mood": ("atmosphere and mood", "atmosphere", "mood"),
+}
+# Text outside any known heading
+BODY = "body"
+COLUMNS = tuple(SECTIONS) + (BODY, "path")
+
+# bm25 weight per column, in COLUMNS order
+WEIGHTS = (4.0, 1.5, 2.0, 1.5, 1.0, 1.0, 1.5, 1.5, 1.0, 0.5)
+
+_HEADINGS = {heading: column for column, headings in SECTIONS.items() for heading in headings}
+_HEADING_RE = re.compile(
+    r"^[\s#>*_\-•]*(" + "|".join(re.escape(h) for h in sorted(_HEADINGS, key=len, reverse=True)) +
+    r")[\s*_]*:[\s*_]*(.*)$", re.IGNORECASE)
+# Heading without content of its own, e.g. "Detailed Description:"
+_OTHER_HEADING_RE = re.compile(r"^[\s#>*_\-•]*[A-Za-z][\w /&-]{0,40}[\s*_]*:[\s*_]*$")
+_QUERY_TERM_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+
+def split_sections(text):
+    """{column: text} for an analysis written under the prompt's headings"""
+    sections = {}
+    current = BODY
+    for line in (text or "").splitlines():
+        match = _HEADING_RE.match(line)
+        if match:
+            current = _HEADINGS[match.group(1).lower()]
+            line = match.group(2)
+        elif _OTHER_HEADING_RE.match(line):
+            current = BODY
+            continue
+        line = line.strip()
+        if line:
+            sections.setdefault(current, []).append(line)
+    return {column: "\n".join(lines) for column, lines in sections.items()}
+
+
+def build_query(text):
+    """FTS5 MATCH expression for a search box query, or None if it has no terms
+
+    Words are quoted so FTS operators and punctuation typed by the user
+    are taken literally; unknown ``field:`` prefixes search everywhere.
+    """
+    terms = []
+    for field, phrase, word in _QUERY_TERM_RE.findall(text or ""):
+        raw = phrase if phrase else word
+        prefix = raw.endswith("*") and not phrase
+        tokens = re.findall(r"\w+", raw)
+        if not tokens:
+            continue
+        term = '"' + " ".join(tokens) + '"' + ("*" if prefix else "")
+        field = field.lower()
+        if field in _HEADINGS:
+            field = _HEADINGS[field]
+        if field in COLUMNS:
+            term = f"{field} : {term}"
+        terms.append(term)
+    return " AND ".join(terms) if terms else None
+
+
+class SearchHit:
+    """One matching image, best-ranked analysis first"""
+
+    __slots__ = ("path", "provider", "model", "created", "score", "snippet")
+
+    def __init__(self, path, provider, model, created, score, snippet):
+        self.path = path
+        self.provider = provider
+        self.model = model
+        self.created = created
+        # bm25: lower is better
+        self.score = score
+        self.snippet = snippet
+
+
+class SearchIndex:
+    """All analyses in one table, the latest per (path, provider) in an FTS5 index"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS analyses (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            model TEXT,
+            fallback INTEGER NOT NULL,
+            created REAL NOT NULL,
+            text TEXT NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_path ON analyses(path, provider, id)")
+        self._db.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5({', '.join(COLUMNS)}, "
+            "tokenize = 'porter unicode61 remove_diacritics 2')")
+
+    def add(self, image_path, provider, text, model=None, fallback=False, created=None, sections=None):
+        """Store an analysis and make it the searchable one for (image, provider)
+
+        ``sections`` ({column: text}, e.g. from a structured analysis) saves
+        splitting the text by its headings.
+
+        Returns the analysis id, or None when it repeats the latest stored
+        text (e.g. a cache hit), so re-running a batch does not pile up copies.
+        """
+        path = os.path.abspath(image_path)
+        if sections is None:
+            sections = split_sections(text)
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                previous = self._db.execute(
+                    "SELECT id, text FROM analyses WHERE path = ? AND provider = ? ORDER BY id DESC LIMIT 1",
+                    (path, provider)).fetchone()
+                if previous is not None and previous[1] == text:
+                    self._db.execute("ROLLBACK")
+                    return None
+                analysis_id = self._db.execute(
+                    "INSERT INTO analyses (path, provider, model, fallback, created, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, provider, model, int(bool(fallback)), created or time.time(), text)).lastrowid
+                if previous is not None:
+                    self._db.execute("DELETE FROM analyses_fts WHERE rowid = ?", (previous[0],))
+                self._db.execute(
+                    f"INSERT INTO analyses_fts (rowid, {', '.join(COLUMNS)}) VALUES (?, {', '.join('?' * len(COLUMNS))})",
+                    (analysis_id, *(sections.get(column, "") for column in COLUMNS[:-1]), path))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return analysis_id
+
+    def add_result(self, result):
+        """Store a photo_analysis.AnalysisResult"""
+        import providers
+        if result.is_fallback:
+            # Kept apart, so a failed call never hides the provider's earlier analysis
+            return self.add(result.image_path, "fallback", result.text, fallback=True)
+        backend = providers.get_provider(result.provider)
+        model = backend.model if backend is not None else None
+        sections = result.record.sections() if result.record is not None else None
+        return self.add(result.image_path, result.provider, result.text, model=model, sections=sections)
+
+    def search(self, query, limit=20, include_fallback=False):
+        """Best-ranked images for a search box query (one hit per image)"""
+        expression = build_query(query)
+        if expression is None:
+            return []
+        weights = ", ".join(str(w) for w in WEIGHTS)
+        sql = (f"SELECT a.path, a.provider, a.model, a.created, bm25(analyses_fts, {weights}) AS score, "
+               "snippet(analyses_fts, -1, '[', ']', '…', 12) "
+               "FROM analyses_fts JOIN analyses a ON a.id = analyses_fts.rowid "
+               "WHERE analyses_fts MATCH ?" + ("" if include_fallback else " AND a.fallback = 0") +
+               " ORDER BY score LIMIT ?")
+        hits = []
+        seen = set()
+        with self._lock:
+            # A few extra rows, for images indexed under more than one provider
+            rows = self._db.execute(sql, (expression, limit * 2 + 10)).fetchall()
+        for row in rows:
+            if row[0] in seen:
+                continue
+            seen.add(row[0])
+            hits.append(SearchHit(*row))
+            if len(hits) >= limit:
+                break
+        return hits
+
+    def history(self, image_path):
+        """[(provider, model, created, text)] for an image, newest first"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT provider, model, created, text FROM analyses WHERE path = ? ORDER BY id DESC",
+                (os.path.abspath(image_path),)).fetchall()
+
+    def counts(self):
+        """(analyses stored, analyses searchable)"""
+        with self._lock:
+            stored = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            indexed = self._db.execute("SELECT COUNT(*) FROM analyses_fts").fetchone()[0]
+        return stored, indexed
+
+    def optimize(self):
+        """Merge the FTS segments; worth it after a large import"""
+        with self._lock:
+            self._db.execute("INSERT INTO analyses_fts(analyses_fts) VALUES ('optimize')")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Process-wide SearchIndex under the app data directory"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            from photo_analysis import app_data_dir
+            _index = SearchIndex(os.path.join(app_data_dir(), INDEX_FILENAME))
+        return _index
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Search stored photo analyses")
+    parser.add_argument("query", nargs="?", default=None,
+                        help='Words, "phrases" and field:word terms, e.g. \'setting:beach sunset\'')
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--fallback", action="store_true", help="Also search basic (fallback) analyses")
+    parser.add_argument("--import-jsonl", default=None,
+                        help="Index the records of a batch_analyzer / job_queue results file")
+    parser.add_argument("--index", default=None, help=f"Index database (default: {INDEX_FILENAME} in the app data folder)")
+    return parser
+
+
+def import_jsonl(index, path):
+    """Index result records from a JSON Lines file; returns how many were new"""
+    import json
+    added = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get("result") or not record.get("path"):
+                continue
+            analysis = record.get("analysis")
+            sections = {column: text for column, text in analysis.items()
+                        if column in SECTIONS and text} if isinstance(analysis, dict) else None
+            if index.add(record["path"], record.get("provider") or "unknown", record["result"],
+                         fallback=bool(record.get("fallback")), sections=sections) is not None:
+                added += 1
+    index.optimize()
+    return added
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    index = SearchIndex(args.index) if args.index else get_index()
+    if args.import_jsonl:
+        print(f"📥 {import_jsonl(index, args.import_jsonl)} analyses indexed from {args.import_jsonl}")
+    if args.query is None:
+        stored, indexed = index.counts()
+        print(f"🔎 {indexed:,} searchable analyses ({stored:,} stored)")
+        return 0
+    started = time.perf_counter()
+    hits = index.search(args.query, limit=max(1, args.limit), include_fallback=args.fallback)
+    elapsed = (time.perf_counter() - started) * 1000
+    for rank, hit in enumerate(hits, 1):
+        print(f"{rank:>3}. {hit.path}  [{hit.provider}]")
+        print(f"     {' '.join(hit.snippet.split())}")
+    print(f"🔎 {len(hits)} images in {elapsed:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
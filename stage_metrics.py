@@ -0,0 +1,326 @@
+"""Per-stage timings and a process-wide metrics registry.
+
+A slow analysis used to be one number. ``StageTimes`` splits it into the
+stages it went through:
+
+    read       memory-map and hash the original file
+    decode     decode the original (JPEG draft mode where possible)
+    resize     shrink to the provider's resolution
+    encode     re-encode to the provider's byte budget
+    connect    get a pooled connection and send the request headers
+    upload     send the request body
+    ttfb       wait for the response headers after the body went out
+    download   read the response body (or the whole event stream)
+    parse      decode the JSON and pull the description out
+    fallback   the basic local analysis, when the provider was not used
+
+Retries add to the same stages, so the totals are what the caller waited.
+
+``MetricsRegistry`` aggregates stage histograms and outcome counters for
+the whole process and exports them in the Prometheus text format or as
+JSON, e.g. ``batch_analyzer.py --metrics metrics.prom``.
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+
+STAGES = ("read", "decode", "resize", "encode", "connect", "upload", "ttfb", "download", "parse", "fallback")
+
+# Histogram bucket upper bounds, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Body slice size for uploads that are a single bytes object
+BODY_CHUNK = 64 * 1024
+
+METRIC_PREFIX = "photo_analyzer"
+
+
+def format_duration(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.0f} ms"
+    return f"{seconds:.1f} s"
+
+
+class StageTimes:
+    """Seconds spent in each stage of one analysis (thread-safe)"""
+
+    def __init__(self):
+        self.durations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + max(0.0, seconds)
+
+    def add_timings(self, timings_ms):
+        """Merge a {stage: milliseconds} dict such as EncodedImage.timings"""
+        for stage, ms in timings_ms.items():
+            self.add(stage, ms / 1000)
+
+    def merge(self, other):
+        for stage, seconds in other.items():
+            self.add(stage, seconds)
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def items(self):
+        with self._lock:
+            return list(self.durations.items())
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self.durations)
+
+    def summary(self, limit=None):
+        """"encode 40 ms · upload 120 ms · ttfb 2.3 s", slowest first when limited"""
+        items = self.items()
+        if limit is not None:
+            keep = {stage for stage, _ in sorted(items, key=lambda item: -item[1])[:limit]}
+            items = [item for item in items if item[0] in keep]
+        return " · ".join(f"{stage} {format_duration(seconds)}" for stage, seconds in items)
+
+    def to_dict(self):
+        """{stage: milliseconds}"""
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.items()}
+
+
+class _Span:
+    """``with stages.span("parse"):`` adds the block's duration to a stage"""
+
+    def __init__(self, stages, stage):
+        self.stages = stages
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stages.add(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class TimedBody:
+    """Request body that records connect and upload times as requests sends it
+
+    requests pulls the first chunk only once the connection is up and the
+    headers are out, and the last one when the body is handed to the
+    socket. ``body`` is an iterable with a length (e.g. a StreamingJSONBody)
+    or bytes; either way requests still sends a Content-Length.
+    """
+
+    def __init__(self, body, stages, started):
+        self.body = body
+        self.stages = stages
+        self.started = started
+        # perf_counter() when the last chunk went out, None until then
+        self.finished = None
+
+    def __len__(self):
+        return len(self.body)
+
+    def _chunks(self):
+        if isinstance(self.body, (bytes, bytearray)):
+            view = memoryview(self.body)
+            for offset in range(0, len(view), BODY_CHUNK):
+                yield view[offset:offset + BODY_CHUNK]
+        else:
+            yield from self.body
+
+    def __iter__(self):
+        first = None
+        for chunk in self._chunks():
+            if first is None:
+                first = time.perf_counter()
+                self.stages.add("connect", first - self.started)
+            yield chunk
+        if first is None:
+            first = time.perf_counter()
+            self.stages.add("connect", first - self.started)
+        self.finished = time.perf_counter()
+        self.stages.add("upload", self.finished - first)
+
+    def response_started(self):
+        """Record time to first byte; call as soon as the response headers are in"""
+        now = time.perf_counter()
+        self.stages.add("ttfb", now - (self.finished or self.started))
+        return now
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, fraction):
+        """Upper bucket bound holding the ``fraction`` quantile (None if empty)"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Counters and histograms keyed by name and labels, shared by all threads"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def record_preview(self, preview):
+        """Stage histograms for one image_preview.PreviewResult"""
+        for stage, ms in preview.timings.items():
+            self.observe("preview_stage_seconds", ms / 1000, stage=stage)
+        self.observe("preview_seconds", preview.total_ms / 1000)
+
+    def record_analysis(self, result):
+        """Outcome counters and stage histograms for one AnalysisResult"""
+        if result.cache_source:
+            outcome = "cache"
+        elif result.is_fallback:
+            outcome = "fallback"
+        else:
+            outcome = "provider"
+        self.inc("analyses_total", provider=result.provider, outcome=outcome)
+        self.observe("analysis_seconds", result.elapsed, provider=result.provider, outcome=outcome)
+        if result.error is not None:
+            self.inc("provider_errors_total", provider=result.provider, kind=result.error.kind)
+        if result.hedged:
+            self.inc("hedged_total", provider=result.provider)
+        if result.ttft is not None:
+            self.observe("time_to_first_token_seconds", result.ttft, provider=result.provider)
+        if result.stages is not None:
+            for stage, seconds in result.stages.items():
+                self.observe("analysis_stage_seconds", seconds, provider=result.provider, stage=stage)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.cumulative()), h.count, h.sum) for key, h in self.histograms.items()}
+        return counters, histograms
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        counters, histograms = self.snapshot()
+        lines = []
+        for name in sorted({key[0] for key in counters}):
+            full = f"{METRIC_PREFIX}_{name}"
+            if name in self.help:
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{full}{_label_text(labels)} {value}")
+        for name in sorted({key[0] for key in histograms}):
+            full = f"{METRIC_PREFIX}_{name}"
+            if name in self.help:
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+            for (metric, labels), (buckets, count, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, cumulative in buckets:
+                    lines.append(f"{full}_bucket{_label_text(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{full}_bucket{_label_text(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{full}_sum{_label_text(labels)} {total:.6f}")
+                lines.append(f"{full}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        counters, histograms = self.snapshot()
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), "count": count, "sum": round(total, 6),
+                            "buckets": {repr(bound): cumulative for bound, cumulative in buckets}}
+                           for (name, labels), (buckets, count, total) in sorted(histograms.items())],
+        }
+
+    def write(self, path):
+        """Write to path as JSON (.json) or Prometheus text (anything else)"""
+        text = json.dumps(self.to_dict(), indent=2) if path.endswith(".json") else self.to_prometheus()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def stage_summary(self, name="analysis_stage_seconds"):
+        """{stage: (count, mean seconds)} summed over all providers"""
+        _, histograms = self.snapshot()
+        totals = OrderedDict((stage, [0, 0.0]) for stage in STAGES)
+        for (metric, labels), (_, count, total) in histograms.items():
+            if metric != name:
+                continue
+            stage = dict(labels).get("stage")
+            entry = totals.setdefault(stage, [0, 0.0])
+            entry[0] += count
+            entry[1] += total
+        return OrderedDict((stage, (count, total / count)) for stage, (count, total) in totals.items() if count)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Process-wide MetricsRegistry"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+            _metrics.describe("analyses_total", "Analyses by provider and outcome (provider, fallback, cache)")
+            _metrics.describe("analysis_seconds", "Wall time of analyze_image")
+            _metrics.describe("analysis_stage_seconds", "Time per analysis stage; retries add up")
+            _metrics.describe("provider_errors_total", "Provider failures that fell back, by error kind")
+            _metrics.describe("hedged_total", "Analyses that raced or failed over to a backup provider")
+            _metrics.describe("time_to_first_token_seconds", "Time until the first streamed token")
+            _metrics.describe("preview_stage_seconds", "Time per preview decode stage")
+            _metrics.describe("preview_seconds", "Total preview decode time")
+        return _metrics
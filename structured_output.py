@@ -0,0 +1,145 @@
+"""Structured (JSON) analyses with a word budget per field.
+
+The default prompt asks for free text under headings, which the model
+writes at length and the tools then split up again by matching headings.
+In structured mode (``STRUCTURED_OUTPUT=1`` in .env, or ``--structured``
+for batch runs) providers are asked for a JSON object instead, with one
+short field per section:
+
+    summary, people, setting, objects, background, foreground, colors, mood
+
+Chat completions providers get the JSON schema as ``response_format``, so
+the answer is guaranteed to parse; the others only get it in the prompt
+and fall back to plain text when they ignore it. Each field has a word
+budget and the whole answer a matching ``max_tokens``, which keeps
+answers to roughly a third of the free-text length.
+
+Answers are kept as compact JSON (``PhotoDescription.to_json``) in the
+result cache and exported as the ``analysis`` field of result records;
+``PhotoDescription.to_text`` renders the usual headings for display.
+"""
+import json
+
+# (field, heading shown to the user, what to write, word budget)
+FIELDS = (
+    ("summary", "Summary", "One-sentence overview capturing the essence of the image.", 25),
+    ("people", "Person/People", "Age range, appearance, clothing, pose and expression of any people; "
+                                "empty if there are none.", 50),
+    ("setting", "Setting", "Environment, location type and physical surroundings.", 35),
+    ("objects", "Objects/Elements", "Key objects, structures or elements in the scene.", 50),
+    ("background", "Background", "What is visible in the background.", 35),
+    ("foreground", "Foreground", "Elements in the immediate foreground.", 35),
+    ("colors", "Colors and Lighting", "Color palette, lighting conditions and visual tone.", 35),
+    ("mood", "Atmosphere and Mood", "Overall feeling, mood and emotional tone.", 30),
+)
+FIELD_NAMES = tuple(field[0] for field in FIELDS)
+
+# About 1.3 tokens per English word, plus the JSON keys and quotes
+MAX_TOKENS = int(sum(field[3] for field in FIELDS) * 1.3) + 80
+
+SCHEMA = {
+    "type": "object",
+    "properties": {name: {"type": "string", "description": f"{text} At most {words} words."}
+                   for name, _, text, words in FIELDS},
+    "required": list(FIELD_NAMES),
+    "additionalProperties": False,
+}
+
+PACKED_SCHEMA = {
+    "type": "object",
+    "properties": {"images": {"type": "array", "items": SCHEMA}},
+    "required": ["images"],
+    "additionalProperties": False,
+}
+
+_FIELD_LINES = "\n".join(f'"{name}": {text} At most {words} words.' for name, _, text, words in FIELDS)
+
+STRUCTURED_PROMPT = ("Analyze this image. Answer with only a JSON object with these string fields, "
+                     "keeping to each field's word limit:\n\n" + _FIELD_LINES)
+
+PACKED_STRUCTURED_PROMPT = ("You are given {count} images, labelled Image 1 to Image {count}. Analyze each image "
+                            'separately. Answer with only a JSON object whose "images" array has one entry per '
+                            "image, in order, each with these string fields, keeping to each field's word "
+                            "limit:\n\n" + _FIELD_LINES.replace("{", "{{").replace("}", "}}"))
+
+
+def response_format(packed=False):
+    """The chat completions ``response_format`` for (packed) structured answers"""
+    return {"type": "json_schema",
+            "json_schema": {"name": "photo_descriptions" if packed else "photo_description",
+                            "strict": True, "schema": PACKED_SCHEMA if packed else SCHEMA}}
+
+
+class PhotoDescription:
+    """One structured analysis: a short text per section"""
+
+    __slots__ = FIELD_NAMES
+
+    def __init__(self, **fields):
+        for name in FIELD_NAMES:
+            setattr(self, name, (fields.get(name) or "").strip())
+
+    @classmethod
+    def from_dict(cls, data):
+        """Record from a decoded answer; raises ValueError if it isn't one"""
+        if not isinstance(data, dict) or not isinstance(data.get("summary"), str):
+            raise ValueError("not a structured analysis")
+        fields = {}
+        for name in FIELD_NAMES:
+            value = data.get(name)
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"field {name} is not a string")
+            fields[name] = value
+        return cls(**fields)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELD_NAMES}
+
+    def to_json(self):
+        """Compact JSON, as stored in the result cache"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+    def sections(self):
+        """{field: text} of the non-empty fields (search_index columns)"""
+        return {name: getattr(self, name) for name in FIELD_NAMES if getattr(self, name)}
+
+    def to_text(self):
+        """The analysis under the same headings as a free-text answer"""
+        return "\n\n".join(f"{heading}: {getattr(self, name)}"
+                           for name, heading, _, _ in FIELDS if getattr(self, name))
+
+
+def _strip_fence(text):
+    """Remove a ```json fence some models put around JSON"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def parse_record(text):
+    """PhotoDescription from a JSON answer; raises ValueError if it isn't one"""
+    return PhotoDescription.from_dict(json.loads(_strip_fence(text or "")))
+
+
+def try_parse(text):
+    """PhotoDescription if text is a structured answer, else None (cheap for free text)"""
+    if not text or text.lstrip()[:1] not in ("{", "`"):
+        return None
+    try:
+        return parse_record(text)
+    except ValueError:
+        return None
+
+
+def split_records(text, count):
+    """[compact JSON per image] of a packed structured answer, or None unless it has count records"""
+    try:
+        images = json.loads(_strip_fence(text or "")).get("images")
+        if not isinstance(images, list) or len(images) != count:
+            return None
+        return [PhotoDescription.from_dict(image).to_json() for image in images]
+    except (ValueError, AttributeError):
+        return None
@@ -0,0 +1,46 @@
+"""Regression checks for job_queue; run with python -m unittest test_job_queue"""
+import os
+import time
+import tempfile
+import unittest
+
+from PIL import Image
+
+from job_queue import JobQueue, QueueRunner
+
+
+class ExhaustedLeaseTest(unittest.TestCase):
+    """An expired lease out of attempts (an image that kept crashing the process)"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.environ["PHOTO_ANALYZER_HOME"] = os.path.join(self.tmp.name, "home")
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.tmp.name, f"img-{index}.png")
+            Image.new("RGB", (32, 32), (index * 80, 90, 160)).save(path)
+            self.paths.append(path)
+        self.jobs = JobQueue(os.path.join(self.tmp.name, "jobs.sqlite3"), max_attempts=2)
+        self.jobs.enqueue(self.paths)
+        # The first job was leased by a process that died, for the last time
+        self.jobs._db.execute("UPDATE jobs SET state = 'in_flight', attempts = 2, lease_owner = 'gone:1:0', "
+                              "lease_expires = ? WHERE path = ?", (time.time() - 60, self.paths[0]))
+
+    def tearDown(self):
+        self.jobs.close()
+        self.tmp.cleanup()
+
+    def test_claim_skips_past_it(self):
+        claimed = self.jobs.claim("test:1:0")
+        self.assertEqual([path for _, path in claimed], [self.paths[1]])
+        self.assertEqual(self.jobs.counts()["failed"], 1)
+
+    def test_runner_drains_the_rest(self):
+        QueueRunner(self.jobs, "fallback", None, workers=1, use_cache=False, dedupe_distance=None,
+                    progress=False).run()
+        counts = self.jobs.counts()
+        self.assertEqual((counts["pending"], counts["in_flight"], counts["failed"], counts["done"]), (0, 0, 1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
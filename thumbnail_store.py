@@ -0,0 +1,218 @@
+"""Packed on-disk store of gallery thumbnails.
+
+Scrolling a gallery of 10k photos must not decode 10k originals, and 10k
+tiny files would cost a filesystem lookup each. Thumbnails are therefore
+JPEG-encoded once and appended to a single pack file that is read through
+a memory map; an SQLite index maps each source path to the offset and
+length of its thumbnail, plus the source's mtime and size so an edited
+photo gets a fresh thumbnail.
+
+Replaced thumbnails leave dead bytes in the pack; it is compacted when it
+is opened and more than half of it is dead.
+"""
+import io
+import os
+import mmap
+import sqlite3
+import threading
+
+PACK_FILENAME = "thumbnails.pack"
+INDEX_FILENAME = "thumbnails.sqlite3"
+
+# Longest side of a stored thumbnail, px
+THUMB_SIZE = 112
+THUMB_QUALITY = 80
+
+# Compact on open when dead bytes exceed this share of a pack at least COMPACT_MIN_BYTES long
+COMPACT_RATIO = 0.5
+COMPACT_MIN_BYTES = 8 * 1024 * 1024
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, used to notice edits"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class ThumbnailEntry:
+    """Where a thumbnail lives in the pack, and the source it was made from"""
+
+    __slots__ = ("mtime_ns", "file_size", "offset", "length", "width", "height")
+
+    def __init__(self, mtime_ns, file_size, offset, length, width, height):
+        self.mtime_ns = mtime_ns
+        self.file_size = file_size
+        self.offset = offset
+        self.length = length
+        # Size of the original image
+        self.width = width
+        self.height = height
+
+
+class ThumbnailStore:
+    """Append-only thumbnail pack with an in-memory copy of its offset index"""
+
+    def __init__(self, directory, size=THUMB_SIZE, quality=THUMB_QUALITY):
+        os.makedirs(directory, exist_ok=True)
+        self.pack_path = os.path.join(directory, PACK_FILENAME)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.size = size
+        self.quality = quality
+        self.stats = {"hits": 0, "misses": 0, "created": 0, "stale": 0}
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS thumbnails (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            file_size INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL)""")
+        self._entries = {row[0]: ThumbnailEntry(*row[1:]) for row in self._db.execute(
+            "SELECT path, mtime_ns, file_size, offset, length, width, height FROM thumbnails")}
+        self._drop_truncated()
+        if self._dead_bytes() > max(COMPACT_MIN_BYTES, COMPACT_RATIO * self._pack_size()):
+            self.compact()
+
+        self._pack = open(self.pack_path, "ab")
+        self._map = None
+
+    def _pack_size(self):
+        try:
+            return os.path.getsize(self.pack_path)
+        except OSError:
+            return 0
+
+    def _dead_bytes(self):
+        return self._pack_size() - sum(entry.length for entry in self._entries.values())
+
+    def _drop_truncated(self):
+        """Forget entries past the end of the pack (e.g. it was deleted or cut short)"""
+        size = self._pack_size()
+        lost = [path for path, entry in self._entries.items() if entry.offset + entry.length > size]
+        for path in lost:
+            del self._entries[path]
+        if lost:
+            self._db.executemany("DELETE FROM thumbnails WHERE path = ?", [(path,) for path in lost])
+
+    def _read(self, entry):
+        """Thumbnail bytes from the memory-mapped pack"""
+        with self._lock:
+            end = entry.offset + entry.length
+            if self._map is None or len(self._map) < end:
+                # The pack grew since it was mapped
+                if self._map is not None:
+                    self._map.close()
+                self._pack.flush()
+                with open(self.pack_path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map[entry.offset:end]
+
+    def entry(self, image_path):
+        """Index entry for image_path if its thumbnail is current, else None"""
+        path = os.path.abspath(image_path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            if file_signature(path) != (entry.mtime_ns, entry.file_size):
+                self.stats["stale"] += 1
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def lookup(self, image_path):
+        """Stored thumbnail as a PIL image, or None; never touches the original's pixels"""
+        from PIL import Image
+        entry = self.entry(image_path)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            with Image.open(io.BytesIO(self._read(entry))) as thumb:
+                thumb.load()
+                thumb = thumb.copy() if thumb.mode == "RGB" else thumb.convert("RGB")
+        except (OSError, SyntaxError, ValueError):
+            # Damaged pack (e.g. a compaction was interrupted): make it again
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return thumb
+
+    def put(self, image_path, thumbnail, width, height, signature=None):
+        """Append a thumbnail for image_path (whose original is width x height)"""
+        path = os.path.abspath(image_path)
+        mtime_ns, file_size = signature or file_signature(path)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, "JPEG", quality=self.quality)
+        data = buffer.getvalue()
+        with self._lock:
+            offset = self._pack.seek(0, os.SEEK_END)
+            self._pack.write(data)
+            self._pack.flush()
+            entry = ThumbnailEntry(mtime_ns, file_size, offset, len(data), width, height)
+            self._entries[path] = entry
+            self._db.execute("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (path, mtime_ns, file_size, offset, len(data), width, height))
+        self.stats["created"] += 1
+        return entry
+
+    def get_or_create(self, image_path):
+        """Thumbnail for image_path, decoding the original only on a miss"""
+        thumb = self.lookup(image_path)
+        if thumb is not None:
+            return thumb
+        from image_preview import decode_preview
+        signature = file_signature(image_path)
+        preview = decode_preview(image_path, (self.size, self.size))
+        self.put(image_path, preview.image, preview.width, preview.height, signature)
+        return preview.image
+
+    def compact(self):
+        """Rewrite the pack with live thumbnails only (call before the pack is opened)"""
+        tmp_path = self.pack_path + ".tmp"
+        moved = []
+        with open(self.pack_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for path, entry in sorted(self._entries.items(), key=lambda item: item[1].offset):
+                src.seek(entry.offset)
+                data = src.read(entry.length)
+                offset = dst.tell()
+                dst.write(data)
+                moved.append((offset, path))
+                entry.offset = offset
+        self._db.execute("BEGIN")
+        self._db.executemany("UPDATE thumbnails SET offset = ? WHERE path = ?", moved)
+        os.replace(tmp_path, self.pack_path)
+        self._db.execute("COMMIT")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._pack.close()
+            self._db.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide ThumbnailStore under the app data directory"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            from photo_analysis import app_data_dir
+            _store = ThumbnailStore(os.path.join(app_data_dir(), "thumbnails"))
+        return _store
@@ -0,0 +1,508 @@
+"""Watch a folder and analyze photos as they arrive.
+
+Photos dropped into a shared folder are picked up without a manual batch
+run. Changes are noticed with inotify on Linux (through ctypes, no extra
+dependency) or by re-scanning the tree every few seconds elsewhere, or when
+the inotify watch limit is reached.
+
+A copy in progress shows up as a file that keeps growing, so a changed
+path is only analyzed once its size and mtime have been stable for
+``--settle`` seconds. Ready images go through a bounded queue to a few
+workers that run the batch analyzer's decode, encode and submit stages;
+while the queue is full the watcher stops taking files off the debouncer,
+so a burst of thousands of photos never piles up in memory.
+
+Each analyzed file is recorded with its mtime and size in a small SQLite
+state database. On restart the tree is walked once (a stat per file, no
+decoding) and only images that are new or changed since they were last
+analyzed are queued.
+
+Usage:
+    python watch_folder.py PHOTOS_DIR --provider chatgpt --output results.jsonl
+    python watch_folder.py PHOTOS_DIR --sidecars      # PHOTO.jpg.analysis.json next to each photo
+"""
+import os
+import sys
+import json
+import time
+import queue
+import select
+import struct
+import sqlite3
+import argparse
+import threading
+
+import photo_analysis
+import providers
+import hedging
+import duplicate_index
+from batch_analyzer import BatchItem, make_encode_stage, make_submit_stage, process_item
+
+STATE_FILENAME = "watch_state.sqlite3"
+SIDECAR_SUFFIX = ".analysis.json"
+
+# Seconds a file's size and mtime must stay unchanged before it is analyzed
+DEFAULT_SETTLE = 2.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or None if it is gone"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def is_watched_file(path):
+    """Images only; hidden files are usually a copy tool's temporaries"""
+    name = os.path.basename(path)
+    return not name.startswith(".") and photo_analysis.is_image_file(name)
+
+
+def walk_tree(root_dir):
+    """(directories, image paths) under root_dir, without following symlinks"""
+    directories, images = [], []
+    stack = [root_dir]
+    while stack:
+        current = stack.pop()
+        directories.append(current)
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith("."):
+                            stack.append(entry.path)
+                    elif entry.is_file() and is_watched_file(entry.name):
+                        images.append(entry.path)
+        except OSError:
+            continue
+    return directories, images
+
+
+class PollingWatcher:
+    """Finds changes by re-scanning the tree every ``interval`` seconds"""
+
+    name = "polling"
+
+    def __init__(self, root_dir, interval=DEFAULT_POLL_INTERVAL):
+        self.root_dir = root_dir
+        self.interval = interval
+        self.snapshot = {}
+        self._next_scan = 0.0
+
+    def start(self):
+        """Take the first snapshot and return every image path in the tree"""
+        self.snapshot = self._scan()
+        self._next_scan = time.monotonic() + self.interval
+        return list(self.snapshot)
+
+    def _scan(self):
+        _, images = walk_tree(self.root_dir)
+        snapshot = {}
+        for path in images:
+            signature = file_signature(path)
+            if signature is not None:
+                snapshot[path] = signature
+        return snapshot
+
+    def poll(self, timeout):
+        """Paths added or changed since the last scan; waits up to timeout"""
+        wait = self._next_scan - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self._next_scan:
+                return []
+        snapshot = self._scan()
+        changed = [path for path, signature in snapshot.items() if self.snapshot.get(path) != signature]
+        self.snapshot = snapshot
+        self._next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify on every directory of the tree, through libc and ctypes"""
+
+    name = "inotify"
+
+    def __init__(self, root_dir):
+        import ctypes
+        import ctypes.util
+        self.root_dir = root_dir
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._errno = ctypes.get_errno
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._errno(), "inotify_init1 failed")
+        # watch descriptor -> directory
+        self.directories = {}
+
+    @staticmethod
+    def available():
+        return sys.platform.startswith("linux")
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            # ENOSPC: fs.inotify.max_user_watches reached
+            raise OSError(self._errno(), f"cannot watch {directory}")
+        self.directories[wd] = directory
+
+    def _watch_tree(self, directory):
+        """Watch directory and everything below it; return the images found"""
+        directories, images = walk_tree(directory)
+        for path in directories:
+            self._add_watch(path)
+        return images
+
+    def start(self):
+        return self._watch_tree(self.root_dir)
+
+    def poll(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: every file may have changed
+                changed.extend(walk_tree(self.root_dir)[1])
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # A new or moved-in folder: files may already be inside it
+                if mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith("."):
+                    changed.extend(self._watch_tree(path))
+            elif is_watched_file(name):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(root_dir, use_polling=False, poll_interval=DEFAULT_POLL_INTERVAL):
+    """Started watcher for root_dir and the image paths it found, preferring inotify"""
+    if not use_polling and InotifyWatcher.available():
+        watcher = None
+        try:
+            watcher = InotifyWatcher(root_dir)
+            return watcher, watcher.start()
+        except (OSError, AttributeError) as e:
+            if watcher is not None:
+                watcher.close()
+            print(f"⚠️ inotify unavailable ({e}); polling every {poll_interval:g}s", file=sys.stderr)
+    watcher = PollingWatcher(root_dir, poll_interval)
+    return watcher, watcher.start()
+
+
+class Debouncer:
+    """Holds changed paths until their size and mtime stop changing"""
+
+    def __init__(self, settle=DEFAULT_SETTLE):
+        self.settle = settle
+        # path -> (signature, monotonic time it was first seen with that signature)
+        self.pending = {}
+
+    def touch(self, path, now=None):
+        now = time.monotonic() if now is None else now
+        signature = file_signature(path)
+        if signature is None:
+            self.pending.pop(path, None)
+            return
+        current = self.pending.get(path)
+        if current is None or current[0] != signature:
+            self.pending[path] = (signature, now)
+
+    def next_due(self, now=None):
+        """Seconds until the earliest pending path may be ready (None if nothing pending)"""
+        if not self.pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(since for _, since in self.pending.values()) + self.settle - now)
+
+    def due(self, now=None):
+        """Yield (path, signature) for files that have been stable long enough"""
+        now = time.monotonic() if now is None else now
+        for path, (signature, since) in list(self.pending.items()):
+            if now - since < self.settle:
+                continue
+            current = file_signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != signature:
+                # Still being written
+                self.pending[path] = (current, now)
+            else:
+                del self.pending[path]
+                # Photos are never empty; a placeholder gets another event when written
+                if signature[1] > 0:
+                    yield path, signature
+
+
+class WatchState:
+    """Which files were analyzed, at which mtime and size"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            file_size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            analyzed REAL NOT NULL)""")
+
+    def is_current(self, path, signature):
+        """True if path was analyzed as it is now (fallback and failed results are retried)"""
+        with self._lock:
+            row = self._db.execute("SELECT mtime_ns, file_size FROM files WHERE path = ? AND status = 'analyzed'",
+                                   (os.path.abspath(path),)).fetchone()
+        return row is not None and tuple(row) == tuple(signature)
+
+    def record(self, path, signature, status):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                             (os.path.abspath(path), signature[0], signature[1], status, time.time()))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class WatchRunner:
+    """Feeds settled images from a watcher through a bounded queue to analysis workers"""
+
+    def __init__(self, root_dir, provider, api_key, output=None, sidecars=False, state=None,
+                 settle=DEFAULT_SETTLE, workers=2, queue_size=16, use_polling=False,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_cache=True,
+                 dedupe_distance=duplicate_index.DEFAULT_MAX_DISTANCE, hedge_settings=None,
+                 api_keys=None, progress=True):
+        self.root_dir = root_dir
+        self.output = output
+        self.sidecars = sidecars
+        self.state = state or WatchState(os.path.join(photo_analysis.app_data_dir(), STATE_FILENAME))
+        self.debouncer = Debouncer(settle)
+        self.workers = workers
+        self.use_polling = use_polling
+        self.poll_interval = poll_interval
+        self.progress = progress
+        self.queue = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self._write_lock = threading.Lock()
+        self._queued = set()
+        self._encode = make_encode_stage(provider)
+        self._submit = make_submit_stage(provider, api_key, use_cache, dedupe_distance, hedge_settings,
+                                         api_keys)
+        self.stats = {"seen": 0, "skipped": 0, "analyzed": 0, "fallback": 0, "failed": 0}
+        self.watcher = None
+        self.threads = []
+
+    def run(self, until=None):
+        """Watch until stop() (or Ctrl+C); ``until`` is an optional monotonic end time"""
+        self.watcher, existing = make_watcher(self.root_dir, self.use_polling, self.poll_interval)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"watch-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # Catch up on what arrived while we weren't running
+        now = time.monotonic()
+        for path in existing:
+            signature = file_signature(path)
+            if signature is None:
+                continue
+            if self.state.is_current(path, signature):
+                self.stats["skipped"] += 1
+            else:
+                self.debouncer.touch(path, now)
+        if self.progress:
+            print(f"👀 Watching {self.root_dir} ({self.watcher.name}): {len(existing)} images, "
+                  f"{len(self.debouncer.pending)} new or changed", file=sys.stderr)
+
+        try:
+            while not self.stop_event.is_set():
+                if until is not None and time.monotonic() >= until:
+                    break
+                self._release_ready()
+                wait = self.debouncer.next_due()
+                timeout = 1.0 if wait is None else min(1.0, max(0.05, wait))
+                for path in self.watcher.poll(timeout):
+                    self.stats["seen"] += 1
+                    self.debouncer.touch(path)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        return self.stats
+
+    def _release_ready(self):
+        for path, signature in self.debouncer.due():
+            if path in self._queued or self.state.is_current(path, signature):
+                continue
+            self._queued.add(path)
+            # Blocks while the workers are behind
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put((path, signature), timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def stop(self):
+        """Let workers finish the image in hand; queued ones are picked up again on restart"""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def _work(self):
+        while not self.stop_event.is_set():
+            try:
+                path, signature = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._analyze(path, signature)
+            finally:
+                self._queued.discard(path)
+
+    def _analyze(self, path, signature):
+        item = process_item(BatchItem(path), self._encode, self._submit)
+        status = item.outcome()
+        record = item.to_record()
+        with self._write_lock:
+            try:
+                self._write(path, record)
+            except OSError as e:
+                print(f"❌ Could not write the result for {path}: {e}", file=sys.stderr)
+                return
+            self.stats[status] += 1
+        # Recorded last: a crash before this point analyzes the file again
+        self.state.record(path, signature, status)
+        if self.progress:
+            print(f"{'❌' if status == 'failed' else '✅'} {path}", file=sys.stderr)
+
+    def _write(self, path, record):
+        line = json.dumps(record, ensure_ascii=False)
+        if self.output:
+            with open(self.output, "a", encoding="utf-8") as out:
+                out.write(line + "\n")
+        if self.sidecars:
+            sidecar = path + SIDECAR_SUFFIX
+            tmp_path = sidecar + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, sidecar)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Analyze photos as they are added to a folder")
+    parser.add_argument("folder", help="Folder to watch (recursively)")
+    parser.add_argument("--provider", default="chatgpt",
+                        choices=providers.provider_names() + ["fallback"])
+    parser.add_argument("--api-key", default=None, help="Overrides the key from .env")
+    parser.add_argument("--output", default=None,
+                        help="JSON Lines file results are appended to (default: analysis_results.jsonl "
+                             "unless --sidecars is given)")
+    parser.add_argument("--sidecars", action="store_true",
+                        help=f"Write PHOTO{SIDECAR_SUFFIX} next to each photo")
+    parser.add_argument("--state", default=None,
+                        help=f"State database (default: {STATE_FILENAME} in the app data folder)")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help="Seconds a file must stay unchanged before it is analyzed")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent analyses")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="Settled images waiting for a worker before the watcher holds back")
+    parser.add_argument("--poll", action="store_true", help="Re-scan instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Seconds between scans when polling")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the provider, ignoring cached results")
+    parser.add_argument("--dedupe-distance", type=int, default=duplicate_index.DEFAULT_MAX_DISTANCE,
+                        help="Reuse the analysis of near-duplicates within this many bits (-1 disables)")
+    parser.add_argument("--quiet", action="store_true", help="No per-image progress lines")
+    return parser
+
+
+def main(argv=None):
+    keys = photo_analysis.load_environment()
+    args = build_arg_parser().parse_args(argv)
+    if not os.path.isdir(args.folder):
+        print(f"Error: folder not found: {args.folder}", file=sys.stderr)
+        return 2
+
+    api_key = args.api_key if args.api_key is not None else keys.get(args.provider, "")
+    output = args.output or (None if args.sidecars else "analysis_results.jsonl")
+    state = WatchState(args.state) if args.state else None
+    runner = WatchRunner(os.path.abspath(args.folder), args.provider, api_key,
+                         output=output,
+                         sidecars=args.sidecars,
+                         state=state,
+                         settle=max(0.0, args.settle),
+                         workers=max(1, args.workers),
+                         queue_size=max(1, args.queue_size),
+                         use_polling=args.poll,
+                         poll_interval=max(0.5, args.poll_interval),
+                         use_cache=not args.no_cache,
+                         dedupe_distance=args.dedupe_distance if args.dedupe_distance >= 0 else None,
+                         hedge_settings=hedging.settings_from_env(),
+                         api_keys=keys,
+                         progress=not args.quiet)
+    stats = runner.run()
+    print(f"📊 {stats['analyzed']} analyzed, {stats['fallback']} fallback, {stats['failed']} failed, "
+          f"{stats['skipped']} already up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())